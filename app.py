@@ -1,21 +1,77 @@
 """
 图生图后端服务 - 支持多图输入和批量生成
 """
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, redirect
 from flask_cors import CORS
-import requests
 import re
 import base64
+import hashlib
+import json
+import math
 import os
+import tempfile
+import threading
+import time
 from datetime import datetime
-from typing import List, Optional
+from typing import Callable, List, Optional
+from urllib.parse import quote
+
+import upstream
+from timings import STAGE_SECONDS, Timings, log_request
+from metrics import (BYTES_BUCKETS, DEPTH_BUCKETS, Counter, Gauge, Histogram,
+                     register_collector, render as render_metrics)
+from file_serving import serve_file
+from image_meta import file_mime, sniff_format
+from image_store import ImageStore
+from image_writer import ImageWriter
+from uploads import UPLOAD_MAX_BYTES, UPLOAD_TTL, UploadStore
+from thumbnails import VARIANTS as THUMB_VARIANTS, Thumbnailer, variant_mime
+import thumbnails
+from stream_decode import CHUNK_SIZE, HashingSink, decode_images_stream
+from batch import BATCH_MAX_ITEMS, start_batch
+from jobs import job_store, sse_stream
+from model_cache import key_hash, model_cache
+from race import RACE_HEDGE_DELAY, RACE_POOL_SIZE, RACE_WIDTH, race_models
+from references import ReferenceSet, decode_reference, reference_preparer
+from scoreboard import create_scoreboard
+from scheduler import BATCH, INTERACTIVE, PRIORITY_NAMES, scheduler
+from result_cache import RESULT_CACHE_DB, ResultCache
+from singleflight import SingleFlight
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
-API_BASE = "http://152.53.90.90:3000"
+UPSTREAM_SECONDS = Histogram("imagegen_upstream_request_seconds", "上游生成请求耗时（含读取响应体）", ("model", "status"))
+UPSTREAM_REQUEST_BYTES = Histogram("imagegen_upstream_request_bytes", "发给上游的请求体大小", ("model",), BYTES_BUCKETS)
+UPSTREAM_RESPONSE_BYTES = Histogram("imagegen_upstream_response_bytes", "上游响应体大小", ("model",), BYTES_BUCKETS)
+UPSTREAM_IN_FLIGHT = Gauge("imagegen_upstream_in_flight", "在途的上游生成请求数")
+GENERATIONS_IN_FLIGHT = Gauge("imagegen_generations_in_flight", "进行中的生成数")
+GENERATIONS = Counter("imagegen_generations_total", "生成次数（按结果状态码）", ("status",))
+FALLBACK_DEPTH = Histogram("imagegen_fallback_depth", "每次生成尝试过的模型数", buckets=DEPTH_BUCKETS)
+DOWNGRADES = Counter("imagegen_downgrades_total", "4K 降级重试次数", ("model",))
+RESULT_CACHE_LOOKUPS = Counter("imagegen_result_cache_lookups_total", "结果缓存查询次数", ("result",))
+HTTP_REQUEST_BYTES = Histogram("imagegen_http_request_bytes", "API 请求体大小", ("endpoint",), BYTES_BUCKETS)
+HTTP_RESPONSE_BYTES = Histogram("imagegen_http_response_bytes", "API 响应体大小", ("endpoint",), BYTES_BUCKETS)
+
+# 一次上游响应里最多保存的图片数
+MAX_IMAGES_PER_RESPONSE = int(os.environ.get("MAX_IMAGES_PER_RESPONSE", "8"))
+
+# 上游地址，可用环境变量覆盖（压测时指向本地桩服务，见 bench/）
+API_BASE = os.environ.get("API_BASE", "http://152.53.90.90:3000").rstrip("/")
 OUTPUT_DIR = "generated_images"
 
+image_store = ImageStore(OUTPUT_DIR)
+thumbnailer = Thumbnailer(OUTPUT_DIR)
+# 图片在后台线程中落盘并登记，提交后再排队生成缩略图
+image_writer = ImageWriter(image_store, on_commit=thumbnailer.schedule)
+upload_store = UploadStore(OUTPUT_DIR)
+scoreboard = create_scoreboard(OUTPUT_DIR)
+result_cache = ResultCache(os.path.join(image_store.root, RESULT_CACHE_DB))
+generation_flight = SingleFlight()
+# 参考图引用已生成的图片：output:<文件名>
+OUTPUT_REF_PREFIX = "output:"
+BLOB_NAME = re.compile(r"^([0-9a-f]{64})\.(png|jpg|gif|webp)$")
+
 SYSTEM_INSTRUCTION = """你是一个擅长多图融合的 AI 专家。我已按顺序为你提供了多张标记为[参考图片 X]的图像。请仔细阅读我的用户指令，精准识别指令中提到的图片编号，并分析它们各自需要贡献的元素（如风格、构图、主体等），最后合成一张高质量图像。"""
 
 QUALITY_SUFFIX = ", 4k resolution, UHD, highly detailed, photorealistic, 8k wallpaper, sharp focus, intricate textures, masterpiece, professional photography, cinema lighting, ultra HD, crystal clear"
@@ -33,85 +89,128 @@ QUALITY_PROMPTS = [
     "masterpiece"
 ]
 
-def extract_base64_from_markdown(text):
-    """从 Markdown 格式提取 Base64 图片数据"""
-    pattern = r'!\[.*?\]\((data:image/[^;]+;base64,([^)]+))\)'
-    match = re.search(pattern, text)
-    if match:
-        mime = match.group(1).split(';base64,')[0] + ';base64'
-        data = match.group(2)
-        return f"{mime},{data}"
-    return None
+def fetch_image_models(api_key: str) -> List[dict]:
+    """从上游获取所有包含 image 的模型（失败时抛出异常）"""
+    r = upstream.get(f"{API_BASE}/v1/models", api_key)
+    
+    if r.status_code != 200:
+        raise RuntimeError(f"HTTP {r.status_code}")
+    
+    data = r.json()
+    models = []
+    
+    for m in data.get('data', []):
+        model_id = m.get('id', '')
+        if 'image' in model_id.lower():
+            models.append({
+                'id': model_id,
+                'name': model_id,
+                'is_flash': 'flash' in model_id.lower(),
+                'speed': 0 if 'flash' in model_id.lower() else 1
+            })
+    
+    models.sort(key=lambda x: (x['speed'], x['id']))
+    return models
 
 def get_image_models(api_key: str) -> List[dict]:
-    """获取所有包含 image 的模型"""
+    """获取所有包含 image 的模型（按 Key 缓存）"""
     try:
-        r = requests.get(
-            f"{API_BASE}/v1/models",
-            headers={"Authorization": f"Bearer {api_key}"},
-            timeout=10
-        )
-        
-        if r.status_code != 200:
-            return []
-        
-        data = r.json()
-        models = []
-        
-        for m in data.get('data', []):
-            model_id = m.get('id', '')
-            if 'image' in model_id.lower():
-                models.append({
-                    'id': model_id,
-                    'name': model_id,
-                    'is_flash': 'flash' in model_id.lower(),
-                    'speed': 0 if 'flash' in model_id.lower() else 1
-                })
-        
-        models.sort(key=lambda x: (x['speed'], x['id']))
-        return models
-        
+        return model_cache.get(api_key, fetch_image_models)
     except Exception as e:
         print(f"获取模型列表失败: {e}")
         return []
 
-def save_image(base64_data: str, prompt: str, index: int = 0) -> Optional[str]:
-    """保存图片到本地"""
+def _image_stem(prompt: str, index: int = 0) -> str:
+    """文件名前缀，存储层会补上内容哈希和真实扩展名"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    safe_prompt = "".join(c for c in prompt[:15] if c.isalnum() or c in ' -_').strip()
+    safe_prompt = safe_prompt.replace(' ', '_')
+    return f"{timestamp}_{safe_prompt}_{index + 1}"
+
+def _index_meta(prompt: str, model: Optional[str], is_4k: Optional[bool], downgraded: bool) -> dict:
+    return {"prompt": prompt, "model": model, "is_4k": is_4k, "downgraded": int(downgraded)}
+
+def save_image_file(tmp_path: str, prompt: str, index: int = 0, sha256: Optional[str] = None,
+                    model: Optional[str] = None, is_4k: Optional[bool] = None,
+                    downgraded: bool = False) -> Optional[dict]:
+    """把流式解码得到的临时文件排队写入，返回将要登记的存储记录（写入在后台完成，见 image_writer）"""
     try:
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_prompt = "".join(c for c in prompt[:15] if c.isalnum() or c in ' -_').strip()
-        safe_prompt = safe_prompt.replace(' ', '_')
-        
-        filename = f"{timestamp}_{safe_prompt}_{index + 1}.png"
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        
-        data = base64_data.split(',', 1)[1] if ',' in base64_data else base64_data
-        with open(filepath, "wb") as f:
-            f.write(base64.b64decode(data))
-        
-        print(f"  💾 保存: {filepath}")
-        return filepath
+        record, _ = image_writer.submit_file(tmp_path, _image_stem(prompt, index), sha256,
+                                             _index_meta(prompt, model, is_4k, downgraded))
+        return record
     except Exception as e:
         print(f"  ⚠️ 保存失败: {e}")
+        discard_image_file(tmp_path)
         return None
 
+def save_image_files(images: List[dict], prompt: str, model: Optional[str] = None,
+                     is_4k: Optional[bool] = None, downgraded: bool = False) -> List[dict]:
+    """排队写入同一次生成得到的多张图片，返回成功入队的记录（顺序不变）"""
+    records = [save_image_file(image["path"], prompt, index, sha256=image["sha256"], model=model,
+                               is_4k=is_4k, downgraded=downgraded)
+               for index, image in enumerate(images)]
+    return [record for record in records if record]
+
+def discard_image_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def discard_image_files(images: List[dict]):
+    for image in images:
+        discard_image_file(image["path"])
+
+def stream_images_to_files(r, cancel: Optional[threading.Event] = None):
+    """
+    把 200 响应里的所有图片边读边解码到 OUTPUT_DIR 下的临时文件（每张一个）
+
+    返回 (images, head)：images 为 [{"path", "mime", "bytes", "sha256"}, ...]，内容相同的只保留一张；
+    没有图片时为空列表，head 是响应体开头，用作错误信息
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    opened = []
+    
+    def open_sink(mime):
+        fd, tmp_path = tempfile.mkstemp(prefix=image_store.temp_prefix(), dir=OUTPUT_DIR)
+        sink = HashingSink(os.fdopen(fd, 'wb'))
+        opened.append((tmp_path, sink))
+        return sink
+    
+    found = []
+    try:
+        found, head = decode_images_stream(r.iter_content(CHUNK_SIZE), open_sink, cancel,
+                                           max_images=MAX_IMAGES_PER_RESPONSE)
+    finally:
+        for tmp_path, sink in opened:
+            sink.f.close()
+        # 出错或被取消时 found 为空，全部删除
+        for tmp_path, _ in opened[len(found):]:
+            discard_image_file(tmp_path)
+    
+    images = []
+    for (mime, size), (tmp_path, sink) in zip(found, opened):
+        sha256 = sink.hexdigest()
+        if not size or any(image["sha256"] == sha256 for image in images):
+            discard_image_file(tmp_path)
+            continue
+        images.append({"path": tmp_path, "mime": mime, "bytes": size, "sha256": sha256})
+    
+    if not images:
+        return [], head.decode('utf-8', 'replace')
+    return images, None
+
 def get_latest_images(limit: int = 10):
     """获取最新生成的图片列表"""
     try:
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        files = [f for f in os.listdir(OUTPUT_DIR) if f.endswith('.png')]
-        if not files:
-            return []
-        sorted_files = sorted(files, key=lambda x: os.path.getmtime(os.path.join(OUTPUT_DIR, x)), reverse=True)
-        return sorted_files[:limit]
+        return [r["filename"] for r in image_store.latest(limit)]
     except Exception as e:
         print(f"获取图片列表失败: {e}")
         return []
 
 def build_contents_parts(images: List[str], user_prompt: str, denoising: float = 0.8, weight: float = 1.0) -> List[dict]:
     """
-    构建 Gemini API 的 contents parts 数组
+    构建 Gemini API 的 contents parts 数组（images 为 data URI，见 references）
     
     优化结构：
     1. 先放所有图片（带索引标签）
@@ -131,7 +230,7 @@ def build_contents_parts(images: List[str], user_prompt: str, denoising: float =
         
         parts.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/png;base64,{img_data}"}
+            "image_url": {"url": img_data}
         })
     
     ignore_instruction = "请忽略原图的部分细节，严格执行以下文字要求。"
@@ -194,18 +293,79 @@ def list_models():
         "count": len(models)
     })
 
+IMAGE_PAGE_DEFAULT = 50
+IMAGE_PAGE_MAX = 500
+
+# fields 参数可选的字段 → 索引列
+IMAGE_FIELDS = {
+    "size": ("bytes",),
+    "dimensions": ("width", "height"),
+    "prompt": ("prompt",),
+    "model": ("model",),
+    "created_at": ("created_at",),
+    "sha256": ("sha256",),
+    "flags": ("is_4k", "downgraded"),
+}
+
+def encode_cursor(row: dict) -> str:
+    raw = f"{row['created_at']!r}|{row['filename']}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+    created_at, filename = raw.split('|', 1)
+    return float(created_at), filename
+
 @app.route('/api/images', methods=['GET'])
 def list_images():
-    """获取已生成的图片列表"""
+    """
+    获取已生成的图片列表（按生成时间倒序，游标分页）
+
+    参数：limit、before/after（上一页返回的游标）、since（时间戳，只取之后生成的）、
+    fields（逗号分隔，见 IMAGE_FIELDS）、model / is_4k / downgraded 过滤
+    """
     try:
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        files = sorted(os.listdir(OUTPUT_DIR), reverse=True)
-        images = [f for f in files if f.endswith('.png')]
-        return jsonify({
-            "code": 200, 
-            "images": images,
-            "count": len(images)
-        })
+        args = request.args
+        try:
+            limit = min(int(args.get('limit', IMAGE_PAGE_DEFAULT)), IMAGE_PAGE_MAX)
+            before = decode_cursor(args['before']) if args.get('before') else None
+            after = decode_cursor(args['after']) if args.get('after') else None
+            since = float(args['since']) if args.get('since') else None
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({"code": 400, "msg": "分页参数无效"}), 400
+        if limit <= 0:
+            limit = IMAGE_PAGE_DEFAULT
+        
+        fields = [f for f in args.get('fields', '').split(',') if f]
+        unknown = [f for f in fields if f not in IMAGE_FIELDS]
+        if unknown:
+            return jsonify({"code": 400, "msg": f"未知字段: {', '.join(unknown)}"}), 400
+        
+        filters = {}
+        if args.get('model'):
+            filters["model"] = args['model']
+        for key in ("is_4k", "downgraded"):
+            if args.get(key) is not None:
+                filters[key] = args[key].lower() in ("1", "true", "yes")
+        
+        rows, has_more = image_store.page(limit, before=before, after=after, since=since, **filters)
+        
+        body = {
+            "code": 200,
+            "images": [r["filename"] for r in rows],
+            "count": len(rows),
+            "has_more": has_more,
+            "next_cursor": encode_cursor(rows[-1]) if rows else None,
+            "prev_cursor": encode_cursor(rows[0]) if rows else None,
+            # 下次增量刷新时作为 since 传回
+            "latest": max((r["created_at"] for r in rows), default=since)
+        }
+        if fields:
+            body["items"] = [
+                dict({"filename": r["filename"]}, **{col: r[col] for f in fields for col in IMAGE_FIELDS[f]})
+                for r in rows
+            ]
+        return jsonify(body)
     except Exception as e:
         return jsonify({"code": 500, "msg": str(e)}), 500
 
@@ -213,11 +373,15 @@ def list_images():
 def latest_image():
     """获取最新生成的图片"""
     try:
-        files = get_latest_images(1)
-        if files:
-            filepath = os.path.join(OUTPUT_DIR, files[0])
-            if os.path.exists(filepath):
-                return send_file(filepath, mimetype='image/png')
+        # 本进程刚排队的图片先提交，免得返回上一张
+        image_store.wait_all_pending()
+        latest = image_store.latest(1)
+        if latest:
+            record = latest[0]
+            if os.path.exists(record["path"]):
+                # 内容随新图变化，只能再验证不能长期缓存
+                return serve_file(record["path"], image_store.root, file_mime(record["path"]),
+                                  etag=record["sha256"])
         return jsonify({"error": "没有找到图片"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -225,174 +389,680 @@ def latest_image():
 @app.route('/api/image/<filename>')
 def get_image(filename):
     """获取指定图片"""
-    filepath = os.path.join(OUTPUT_DIR, filename)
-    if os.path.exists(filepath):
-        return send_file(filepath, mimetype='image/png')
+    record = image_store.resolve(filename)
+    if record:
+        # 新文件名带内容哈希，指向的内容不会再变；旧版文件名只做再验证
+        return serve_file(record["path"], image_store.root, file_mime(record["path"]),
+                          etag=record["sha256"], immutable=bool(record["sha256"]))
     return jsonify({"error": "图片不存在"}), 404
 
-@app.route('/api/gen_image', methods=['POST'])
-def gen_image():
-    data = request.get_json()
-    api_key = data.get('api_key', '')
-    images = data.get('images', [])
-    prompt = data.get('prompt', '')
-    selected_model = data.get('model', '')
-    auto_mode = data.get('auto', True)
-    is_4k = data.get('4k', True)
-    denoising = data.get('denoising', 0.8)
-    prompt_weight = data.get('prompt_weight', 1.0)
+@app.route('/api/blob/<name>')
+def get_blob(name):
+    """按内容哈希获取图片（<sha256>.<ext>），URL 与内容一一对应，可永久缓存"""
+    match = BLOB_NAME.match(name)
+    if not match:
+        return jsonify({"error": "无效的图片地址"}), 400
+    path = image_store.blob_path(match.group(1), match.group(2))
+    if not os.path.isfile(path) and not image_store.wait_pending(name):
+        return jsonify({"error": "图片不存在"}), 404
+    return serve_file(path, image_store.root, file_mime(path), etag=match.group(1), immutable=True)
+
+@app.route('/api/thumb/<variant>/<filename>')
+def get_thumbnail(variant, filename):
+    """获取缩略图（128 / 256 / 512）或 WebP 预览图（preview），首次请求时生成"""
+    if variant not in THUMB_VARIANTS:
+        return jsonify({"error": f"不支持的尺寸，可选: {', '.join(THUMB_VARIANTS)}"}), 400
+    record = image_store.resolve(filename)
+    if not record:
+        return jsonify({"error": "图片不存在"}), 404
+    if not thumbnails.available():
+        # 未安装 Pillow：退回原图
+        return redirect(f"/api/image/{quote(filename)}")
+    path = thumbnailer.get(record, variant)
+    if not path:
+        return jsonify({"error": "缩略图生成失败"}), 500
+    etag = f"{record['sha256']}-{variant}" if record["sha256"] else None
+    return serve_file(path, thumbnailer.root, variant_mime(variant),
+                      etag=etag, immutable=bool(record["sha256"]))
+
+def _no_emit(event: str, data: dict):
+    pass
+
+def post_generation(url: str, api_key: str, payload: dict, cancel: Optional[threading.Event],
+                    timings: Timings, stage_prefix: str = ""):
+    """
+    发出一次生成请求，200 时把图片流式写入临时文件
+
+    返回 (状态码, images, 错误文本)，images 见 stream_images_to_files；请求或解析失败时抛出异常。
+    记录上游耗时、收发字节数；等待响应头计入 upstream 阶段，读取响应体计入 stream_decode 阶段
+    """
+    model = model_cache.label(payload["model"])
+    status = "error"
+    started = time.perf_counter()
+    try:
+        with UPSTREAM_IN_FLIGHT.track():
+            with timings.stage(stage_prefix + "upstream"):
+                r = upstream.post(url, api_key, payload, stream=True)
+            with r:
+                status = str(r.status_code)
+                UPSTREAM_REQUEST_BYTES.observe(len(r.request.body or b""), model)
+                if r.status_code != 200:
+                    return r.status_code, [], r.text
+                with timings.stage(stage_prefix + "stream_decode"):
+                    images, error_text = stream_images_to_files(r, cancel)
+                UPSTREAM_RESPONSE_BYTES.observe(r.raw.tell(), model)
+                return 200, images, error_text
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, model, status)
+
+def attempt_model(model: str, api_key: str, images: List[str], prompt: str, is_4k: bool,
+                  denoising: float, prompt_weight: float, cancel: Optional[threading.Event] = None,
+                  emit: Callable[[str, dict], None] = _no_emit, timings: Optional[Timings] = None) -> dict:
+    """
+    用单个模型尝试生成（含 4K → 高清降级重试），不保存图片，各阶段耗时记入 timings
+
+    返回 {"ok": True, "images", "model", "is_4k", "downgraded"}（images 见 stream_images_to_files）
+    或 {"ok": False, "error", "no_channel"}
+    """
+    emit("attempt", {"model": model, "is_4k": is_4k})
+    print(f"\n[尝试] {model}")
+    print(f"  图片数量: {len(images)}")
+    print(f"  4K模式: {'是' if is_4k else '否'}")
+    print(f"  Denoising: {denoising}")
+    print(f"  提示词权重: {prompt_weight}")
+    print(f"  用户指令: {prompt[:50]}...")
     
-    if not api_key:
-        return jsonify({"code": 401, "msg": "API Key 未配置"}), 401
+    if timings is None:
+        timings = Timings(model)
+    
+    with timings.stage("payload"):
+        contents_parts = build_contents_parts(images, prompt, denoising, prompt_weight)
+        generation_config = build_generation_config()
+        
+        payload = {
+            "model": model,
+            "messages": [{
+                "role": "user",
+                "content": contents_parts
+            }],
+            "generation_config": generation_config,
+            "is_4k": is_4k
+        }
+    
+    url = f"{API_BASE}/v1/chat/completions"
+    
+    try:
+        status, images, error_text = post_generation(url, api_key, payload, cancel, timings)
+    except Exception as e:
+        print(f"  请求失败: {e}")
+        return {"ok": False, "error": str(e), "no_channel": False}
+    
+    if status == 200:
+        if images:
+            return {"ok": True, "images": images, "model": model,
+                    "is_4k": is_4k, "downgraded": False}
+        return {"ok": False, "error": error_text[:200], "no_channel": False}
+    
+    if status == 503:
+        if '无可用渠道' in error_text or 'no available' in error_text.lower():
+            print(f"  503 无渠道，自动切换下一个...")
+            model_cache.invalidate(api_key)
+            return {"ok": False, "error": error_text[:200], "no_channel": True}
+    
+    if status in [400, 413] and not (cancel and cancel.is_set()):
+        print(f"  ⚠️ 分辨率不支持，尝试降级...")
+        emit("downgrade", {"model": model, "status": status})
+        DOWNGRADES.inc(model_cache.label(model))
+        payload["is_4k"] = False
+        payload["prompt"] = prompt
+        
+        try:
+            status, images, _ = post_generation(url, api_key, payload, cancel, timings, "downgrade_")
+            if status == 200 and images:
+                print(f"  ✅ 降级生成成功 (非4K)")
+                return {"ok": True, "images": images, "model": model,
+                        "is_4k": False, "downgraded": True}
+        except Exception as e:
+            print(f"  降级请求失败: {e}")
+    
+    return {"ok": False, "error": error_text[:200], "no_channel": False}
+
+def describe_image(record: dict) -> dict:
+    """生成结果的元信息（不含图片本身）"""
+    return {
+        "filename": record["filename"],
+        "url": f"/api/image/{record['filename']}",
+        "blob_url": f"/api/blob/{record['sha256']}.{record['ext']}",
+        # 可直接放进下一次请求的 images，用这张图继续编辑
+        "reference": f"{OUTPUT_REF_PREFIX}{record['filename']}",
+        "mime": record["mime"],
+        "width": record["width"],
+        "height": record["height"],
+        "bytes": record["bytes"],
+        "sha256": record["sha256"]
+    }
+
+def read_data_uri(path: str) -> str:
+    """读取图片为 data URI，仅在客户端显式要求内联时使用"""
+    with open(path, "rb") as f:
+        data = f.read()
+    _, mime = sniff_format(data[:16])
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+def load_reference(item: str) -> bytes:
+    """
+    读取一张参考图，支持：
+    - 上传句柄 upload:<sha256>（见 /api/uploads）
+    - 已生成的图片 output:<文件名>，直接从磁盘读取
+    - Base64 / data URI
+
+    句柄或文件不存在时抛出 LookupError，Base64 无效时抛出 ValueError
+    """
+    if upload_store.is_handle(item):
+        data = upload_store.read(item)
+        if data is None:
+            raise LookupError(item)
+        return data
+    if item.startswith(OUTPUT_REF_PREFIX):
+        record = image_store.resolve(item[len(OUTPUT_REF_PREFIX):])
+        if not record:
+            raise LookupError(item)
+        with open(record["path"], "rb") as f:
+            return f.read()
+    return decode_reference(item)
+
+def parse_race_width(value) -> int:
+    """race 字段 → 竞速宽度：false/0 不竞速，true 用默认宽度，整数不超过竞速线程池大小"""
+    if value is None or value is False:
+        return 0
+    if value is True:
+        return RACE_WIDTH
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    width = int(value)
+    if width < 0:
+        raise ValueError(value)
+    return min(width, RACE_POOL_SIZE)
+
+def parse_hedge_delay(value) -> float:
+    """hedge_delay 字段 → 秒数，不超过上游读超时"""
+    if isinstance(value, bool):
+        raise ValueError(value)
+    delay = float(value)
+    if not math.isfinite(delay) or delay < 0:
+        raise ValueError(value)
+    return min(delay, upstream.READ_TIMEOUT)
+
+def parse_generation_request(data: Optional[dict]):
+    """
+    校验并整理生成请求参数
+
+    返回 (params, None) 或 (None, (错误响应体, 状态码))
+    """
+    data = data or {}
+    params = {
+        "api_key": data.get('api_key', ''),
+        "images": data.get('images', []),
+        "prompt": data.get('prompt', ''),
+        "selected_model": data.get('model', ''),
+        "auto_mode": data.get('auto', True),
+        "is_4k": data.get('4k', True),
+        "denoising": data.get('denoising', 0.8),
+        "prompt_weight": data.get('prompt_weight', 1.0),
+        "race": data.get('race', False),
+        "hedge_delay": data.get('hedge_delay', RACE_HEDGE_DELAY),
+        # 默认只返回文件名/URL/尺寸/哈希，内联 Base64 需显式要求
+        "inline": bool(data.get('inline', False)),
+        # 结果缓存开启时，cache=false 跳过缓存强制重新生成
+        "use_cache": bool(data.get('cache', True)),
+        "priority": INTERACTIVE,
+    }
+    
+    if not params["api_key"]:
+        return None, ({"code": 401, "msg": "API Key 未配置"}, 401)
     
-    if not images or not prompt:
-        return jsonify({"code": 400, "msg": "参数不完整"}), 400
+    if not params["images"] or not params["prompt"]:
+        return None, ({"code": 400, "msg": "参数不完整"}, 400)
+    
+    try:
+        params["race"] = parse_race_width(params["race"])
+    except (TypeError, ValueError):
+        return None, ({"code": 400, "msg": "race 必须是布尔值或非负整数"}, 400)
+    try:
+        params["hedge_delay"] = parse_hedge_delay(params["hedge_delay"])
+    except (TypeError, ValueError):
+        return None, ({"code": 400, "msg": "hedge_delay 必须是非负秒数"}, 400)
+    
+    try:
+        # 解码后只保留二进制，不再持有原始 Base64 字符串
+        params["references"] = ReferenceSet([load_reference(item) for item in params.pop("images")])
+    except LookupError as e:
+        return None, ({"code": 410, "msg": f"参考图片不存在或已过期: {e.args[0]}"}, 410)
+    except (ValueError, TypeError, AttributeError):
+        return None, ({"code": 400, "msg": "参考图片格式无效"}, 400)
     
-    headers = {"Authorization": f"Bearer {api_key}"}
+    return params, None
+
+def generation_fingerprint(params: dict) -> str:
+    """请求指纹：参考图 sha256 + 提示词与权重 + 生成配置 + 4K + 模型选择，按 API Key 隔离"""
+    material = {
+        "key": key_hash(params["api_key"]),
+        "references": params["references"].digests(),
+        "prompt": params["prompt"],
+        "denoising": params["denoising"],
+        "weight": params["prompt_weight"],
+        "suffix": QUALITY_SUFFIX,
+        "generation_config": build_generation_config(),
+        "is_4k": params["is_4k"],
+        "model": params["selected_model"],
+        "auto": params["auto_mode"],
+    }
+    raw = json.dumps(material, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def _with_inline_image(body: dict, params: dict) -> dict:
+    """按需补上内联 Base64（缓存和共享的结果里都不带图片本身）"""
+    if not params["inline"] or not body.get("saved_to"):
+        return body
+    image_store.wait_pending(body["data"]["filename"])
+    data = dict(body["data"], image=read_data_uri(body["saved_to"]))
+    return dict(body, data=data)
+
+def _cached_result(fingerprint: str) -> Optional[dict]:
+    body = result_cache.get(fingerprint)
+    if body is None:
+        return None
+    record = image_store.resolve(body["data"]["filename"])
+    if not record:
+        # 图片已被删除，缓存条目作废
+        result_cache.remove(fingerprint)
+        return None
+    return dict(body, saved_to=record["path"], cached=True)
+
+def run_generation(params: dict, emit: Callable[[str, dict], None] = _no_emit,
+                   timings: Optional[Timings] = None):
+    """
+    执行一次生成；开启结果缓存时先查缓存，相同的在途请求只向上游发一次
+
+    emit(event, data) 用于推送进度事件：cache / queued / dispatched / attempt / downgrade / fallback
+    timings 可由调用方提前创建（以便计入请求解析时间），响应体的 timings 字段为分阶段耗时
+    返回 (响应体, 状态码)
+    """
+    if timings is None:
+        timings = Timings()
+    with GENERATIONS_IN_FLIGHT.track():
+        body, status = _run_with_cache(params, emit, timings)
+    GENERATIONS.inc(str(status))
+    timings.finish(status == 200)
+    body = dict(body, timings=timings.to_dict())
+    log_request({
+        "ts": round(time.time(), 3),
+        "status": status,
+        "priority": PRIORITY_NAMES[params["priority"]],
+        "model": body.get("model_used"),
+        "tried_models": body.get("tried_models", []),
+        "references": len(params["references"]),
+        **body["timings"]
+    })
+    return body, status
+
+def _run_with_cache(params: dict, emit: Callable[[str, dict], None], timings: Timings):
+    if not result_cache.enabled or not params["use_cache"]:
+        return _generate(params, emit, timings)
+
+    fingerprint = generation_fingerprint(params)
+    with timings.stage("cache"):
+        body = _cached_result(fingerprint)
+    RESULT_CACHE_LOOKUPS.inc("hit" if body is not None else "miss")
+    if body is not None:
+        print(f"\n[缓存命中] {body['data']['filename']}")
+        emit("cache", {"hit": True, "filename": body["data"]["filename"]})
+        return _with_inline_image(body, params), 200
+    emit("cache", {"hit": False})
+
+    def generate():
+        body, status = _generate(dict(params, inline=False), emit, timings)
+        if status == 200 and body["data"].get("filename"):
+            result_cache.put(fingerprint, body)
+        return body, status
+
+    body, status = generation_flight.do(fingerprint, generate)
+    return _with_inline_image(body, params), status
+
+def _generate(params: dict, emit: Callable[[str, dict], None], timings: Timings):
+    """
+    执行一次完整的生成（模型选择 → 逐个/竞速尝试 → 保存）
+    """
+    api_key = params["api_key"]
+    references = params["references"]
+    prompt = params["prompt"]
+    selected_model = params["selected_model"]
+    auto_mode = params["auto_mode"]
+    race = params["race"]
     
     models_to_try = []
     
     if auto_mode and not selected_model:
-        all_models = get_image_models(api_key)
+        with timings.stage("discovery"):
+            all_models = get_image_models(api_key)
         models_to_try = [m['id'] for m in all_models]
     elif selected_model:
         models_to_try = [selected_model]
         if auto_mode:
-            all_models = get_image_models(api_key)
+            with timings.stage("discovery"):
+                all_models = get_image_models(api_key)
             other_models = [m['id'] for m in all_models if m['id'] != selected_model]
             models_to_try.extend(other_models)
     
     if not models_to_try:
-        return jsonify({
+        body = {
             "code": 404,
             "msg": "未找到可用的图片生成模型"
-        }), 404
+        }
+        return body, 404
+    
+    if auto_mode and len(models_to_try) > 1:
+        # 按实际表现排序，熔断中的模型排到最后；用户指定的模型仍然先试
+        models_to_try = scoreboard.rank(models_to_try, pinned=1 if selected_model else 0)
+        print(f"\n[模型顺序] {', '.join(models_to_try)}")
+    
+    def attempt(model, cancel=None):
+        started = time.time()
+        attempt_timings = timings.attempt(model)
+        with attempt_timings.stage("payload"):
+            images = references.for_model(model)
+        res = attempt_model(model, api_key, images, prompt, params["is_4k"], params["denoising"],
+                            params["prompt_weight"], cancel, emit, attempt_timings)
+        attempt_timings.finish(res["ok"])
+        if res["ok"] or not (cancel and cancel.is_set()):
+            # 竞速中被取消的请求不算模型的失败
+            scoreboard.record(model_cache.label(model), res["ok"], time.time() - started, downgraded=res.get("downgraded", False),
+                              no_channel=res.get("no_channel", False))
+        if not res["ok"]:
+            emit("fallback", {"model": model, "error": res["error"], "no_channel": res.get("no_channel", False)})
+        return res
+    
+    # 每次上游请求都要先从调度器拿名额，排队进度作为 queued / dispatched 事件推送
+    queue_waits = []
+    
+    def on_wait(event, data):
+        if event == "dispatched":
+            queue_waits.append(data["wait_ms"])
+            timings.add("queue", data["wait_ms"] / 1000)
+        emit(event, data)
     
+    limit_key = key_hash(api_key)
+    limiter = scheduler.limiter(params["priority"], on_wait)
+    
+    result = None
     tried_models = []
     last_error = None
     
-    for model in models_to_try:
-        tried_models.append(model)
-        print(f"\n[尝试] {model} (已试: {len(tried_models)}/{len(models_to_try)})")
-        print(f"  图片数量: {len(images)}")
-        print(f"  4K模式: {'是' if is_4k else '否'}")
-        print(f"  Denoising: {denoising}")
-        print(f"  提示词权重: {prompt_weight}")
-        print(f"  用户指令: {prompt[:50]}...")
+    if race:
+        # race 已在解析请求时换算成并发数（见 parse_race_width）
+        result, tried_models, last_error = race_models(
+            models_to_try, attempt, limit_key,
+            width=race, hedge_delay=params["hedge_delay"], limiter=limiter,
+            on_discard=lambda res: discard_image_files(res["images"])
+        )
+    else:
+        for model in models_to_try:
+            if not limiter.acquire(limit_key):
+                last_error = "排队超时"
+                break
+            tried_models.append(model)
+            print(f"\n(已试: {len(tried_models)}/{len(models_to_try)})")
+            try:
+                res = attempt(model)
+            finally:
+                limiter.release(limit_key)
+            if res["ok"]:
+                result = res
+                break
+            last_error = res["error"]
+    
+    if tried_models:
+        FALLBACK_DEPTH.observe(len(tried_models))
+    
+    if result:
+        with timings.stage("save"):
+            records = save_image_files(result["images"], prompt, model=result["model"],
+                                       is_4k=result["is_4k"], downgraded=result["downgraded"])
+        record = records[0] if records else None
         
-        contents_parts = build_contents_parts(images, prompt, denoising, prompt_weight)
-        generation_config = build_generation_config()
+        if record:
+            image_info = describe_image(record)
+            if params["inline"]:
+                image_store.wait_pending(record["filename"])
+                image_info["image"] = read_data_uri(record["path"])
+        else:
+            image_info = {"filename": None}
         
-        payload = {
-            "model": model,
-            "messages": [{
-                "role": "user",
-                "content": contents_parts
-            }],
-            "generation_config": generation_config,
-            "is_4k": is_4k
+        body = {
+            "code": 200,
+            "msg": "生成成功 (已降级到高清模式)" if result["downgraded"] else f"生成成功 (使用 {result['model']})",
+            "data": image_info,
+            # 上游一次返回多张时全部保存；data 是第一张，这里列出所有图片的元信息（不含内联图片）
+            "images": [describe_image(r) for r in records],
+            "model_used": result["model"],
+            "saved_to": record["path"] if record else None,
+            "tried_models": tried_models,
+            "is_4k": result["is_4k"]
         }
-        
-        url = f"{API_BASE}/v1/chat/completions"
-        
-        try:
-            r = requests.post(url, json=payload, headers=headers, timeout=600)
-            
-            if r.status_code == 200:
-                try:
-                    data_resp = r.json()
-                    content = data_resp.get('choices', [{}])[0].get('message', {}).get('content', '')
-                    
-                    img_data = None
-                    if '![image](' in content:
-                        img_data = extract_base64_from_markdown(content)
-                    elif 'data:image' in content:
-                        parts = content.split('data:image')
-                        if len(parts) > 1:
-                            img_data = f"data:image{parts[1]}"
-                    
-                    if img_data:
-                        saved_path = save_image(img_data, prompt)
-                        filename = os.path.basename(saved_path) if saved_path else None
-                        
-                        return jsonify({
-                            "code": 200,
-                            "msg": f"生成成功 (使用 {model})",
-                            "data": {
-                                "image": img_data,
-                                "filename": filename
-                            },
-                            "model_used": model,
-                            "saved_to": saved_path,
-                            "tried_models": tried_models,
-                            "is_4k": is_4k
-                        })
-                        
-                except Exception as e:
-                    print(f"  解析失败: {e}")
-            
-            if r.status_code == 503:
-                error_text = r.text
-                if '无可用渠道' in error_text or 'no available' in error_text.lower():
-                    print(f"  503 无渠道，自动切换下一个...")
-                    continue
-            
-            if r.status_code in [400, 413]:
-                print(f"  ⚠️ 分辨率不支持，尝试降级...")
-                payload["is_4k"] = False
-                payload["prompt"] = prompt
-                
-                r2 = requests.post(url, json=payload, headers=headers, timeout=600)
-                
-                if r2.status_code == 200:
-                    try:
-                        data_resp = r2.json()
-                        content = data_resp.get('choices', [{}])[0].get('message', {}).get('content', '')
-                        
-                        img_data = None
-                        if '![image](' in content:
-                            img_data = extract_base64_from_markdown(content)
-                        elif 'data:image' in content:
-                            parts = content.split('data:image')
-                            if len(parts) > 1:
-                                img_data = f"data:image{parts[1]}"
-                        
-                        if img_data:
-                            saved_path = save_image(img_data, prompt)
-                            filename = os.path.basename(saved_path) if saved_path else None
-                            
-                            print(f"  ✅ 降级生成成功 (非4K)")
-                            
-                            return jsonify({
-                                "code": 200,
-                                "msg": f"生成成功 (已降级到高清模式)",
-                                "data": {
-                                    "image": img_data,
-                                    "filename": filename
-                                },
-                                "model_used": model,
-                                "saved_to": saved_path,
-                                "tried_models": tried_models,
-                                "is_4k": False,
-                                "downgraded": True
-                            })
-                    except Exception as e:
-                        print(f"  降级解析失败: {e}")
-            
-            last_error = r.text[:200]
-            
-        except Exception as e:
-            last_error = str(e)
-            continue
+        if result["downgraded"]:
+            body["downgraded"] = True
+        body["references"] = references.stats(result["model"])
+        body["queue_wait_ms"] = sum(queue_waits)
+        print(f"  📉 参考图: {body['references']['original_bytes'] / 1024:.0f} KB -> "
+              f"{body['references']['sent_bytes'] / 1024:.0f} KB")
+        return body, 200
     
     tried_list = "\n".join(f"  - {m}" for m in tried_models)
-    return jsonify({
+    body = {
         "code": 503,
         "msg": "所有模型都不可用",
         "detail": f"已尝试 {len(tried_models)} 个模型:\n{tried_list}",
         "tried_models": tried_models,
-        "last_error": last_error
-    }), 503
+        "last_error": last_error,
+        "queue_wait_ms": sum(queue_waits)
+    }
+    return body, 503
+
+@app.route('/api/uploads', methods=['POST'])
+def upload_reference():
+    """
+    上传参考图，返回可放进 images 数组的句柄
+
+    图片放在 multipart 的 file 字段，或直接作为请求体；也接受 JSON {"image": Base64}
+    """
+    if request.content_length and request.content_length > UPLOAD_MAX_BYTES:
+        return jsonify({"code": 413, "msg": "图片过大"}), 413
+    try:
+        file = request.files.get('file')
+        if file:
+            data = file.read()
+        elif request.is_json:
+            data = decode_reference((request.get_json() or {}).get('image', ''))
+        else:
+            data = request.get_data()
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({"code": 400, "msg": "图片数据无效"}), 400
+    if len(data) > UPLOAD_MAX_BYTES:
+        return jsonify({"code": 413, "msg": "图片过大"}), 413
+    
+    try:
+        info = upload_store.put(data)
+    except ValueError as e:
+        return jsonify({"code": 400, "msg": str(e)}), 400
+    return jsonify({"code": 200, "data": dict(info, expires_in=UPLOAD_TTL)})
+
+@app.route('/api/gen_image', methods=['POST'])
+def gen_image():
+    timings = Timings()
+    with timings.stage("parse"):
+        params, error = parse_generation_request(request.get_json())
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    body, status = run_generation(params, timings=timings)
+    response = jsonify(body)
+    response.headers["Server-Timing"] = timings.server_timing()
+    # 跨域前端也能在 Resource Timing 里读到
+    response.headers["Timing-Allow-Origin"] = "*"
+    return response, status
+
+def _without_inline_image(body: dict) -> dict:
+    """任务结果常驻内存，去掉内联的 Base64 图片（前端按 filename 取图）"""
+    if isinstance(body.get("data"), dict) and "image" in body["data"]:
+        body = dict(body, data={k: v for k, v in body["data"].items() if k != "image"})
+    return body
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """创建异步生成任务，立即返回任务 ID"""
+    timings = Timings()
+    with timings.stage("parse"):
+        params, error = parse_generation_request(request.get_json())
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    def run(emit):
+        body, status = run_generation(params, emit, timings)
+        return _without_inline_image(body), status
+    
+    job = job_store.submit(run)
+    return jsonify({
+        "code": 202,
+        "msg": "任务已创建",
+        "data": job.to_dict(),
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events"
+    }), 202
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """
+    创建批量生成任务：count 张，或 prompts 中每个提示词一张，共享同一组参考图
+
+    与 /api/jobs 一样立即返回任务 ID；每完成一张推送一个 item 事件，
+    全部结束后 completed 事件带上按顺序排列的所有结果；
+    多张时按批量优先级调度，只有一张时与 /api/jobs 相同（交互优先级，可命中结果缓存）
+    """
+    data = dict(request.get_json() or {})
+    prompts = data.get('prompts')
+    if prompts is not None:
+        if not isinstance(prompts, list) or not all(isinstance(p, str) and p.strip() for p in prompts):
+            return jsonify({"code": 400, "msg": "prompts 必须是非空字符串列表"}), 400
+        data['prompt'] = prompts[0] if prompts else ''
+    else:
+        try:
+            count = int(data.get('count', 1))
+        except (TypeError, ValueError):
+            return jsonify({"code": 400, "msg": "count 无效"}), 400
+        prompts = [data.get('prompt', '')] * max(count, 0)
+    
+    if not 1 <= len(prompts) <= BATCH_MAX_ITEMS:
+        return jsonify({"code": 400, "msg": f"每批 1 到 {BATCH_MAX_ITEMS} 张"}), 400
+    
+    # 参考图只解码、预处理一次，各张共享
+    with STAGE_SECONDS.time("parse"):
+        params, error = parse_generation_request(data)
+    if error:
+        return jsonify(error[0]), error[1]
+    params["inline"] = False
+    if len(prompts) > 1:
+        params["priority"] = BATCH
+        if data.get('prompts') is None:
+            # 同一提示词生成多张是要不同的结果，不能命中缓存或合并成一次请求
+            params["use_cache"] = False
+    
+    # 各张由 batch 按 Key 排队执行，批量任务本身不占任务线程
+    job = job_store.create()
+    
+    def generate(prompt, emit):
+        job.start()
+        return run_generation(dict(params, prompt=prompt), emit)
+    
+    def done(results):
+        succeeded = sum(1 for _, status in results if status == 200)
+        body = {
+            "code": 200 if succeeded else 503,
+            "msg": f"完成 {succeeded}/{len(results)} 张",
+            "data": [_without_inline_image(b) for b, _ in results],
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded
+        }
+        job.finish(body, body["code"])
+    
+    start_batch(prompts, generate, key_hash(params["api_key"]), job.emit, done)
+    return jsonify({
+        "code": 202,
+        "msg": "批量任务已创建",
+        "data": job.to_dict(),
+        "count": len(prompts),
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events"
+    }), 202
+
+@app.after_request
+def record_http_sizes(response):
+    if request.url_rule is not None and request.path.startswith('/api/'):
+        endpoint = request.url_rule.rule
+        HTTP_REQUEST_BYTES.observe(request.content_length or 0, endpoint)
+        if response.content_length is not None:
+            HTTP_RESPONSE_BYTES.observe(response.content_length, endpoint)
+    return response
+
+def _scheduler_metrics():
+    stats = scheduler.stats()
+    return [
+        ("imagegen_scheduler_running", "gauge", "占用中的上游名额", [({}, stats["running"])]),
+        ("imagegen_scheduler_queued", "gauge", "排队等待上游名额的请求数", [({}, stats["queued"])]),
+        ("imagegen_scheduler_capacity", "gauge", "上游名额总数", [({}, stats["capacity"])]),
+    ]
+
+register_collector(_scheduler_metrics)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 指标"""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/models/stats', methods=['GET'])
+def model_stats():
+    """模型记分板：耗时/成功率/降级率 EWMA、近期 503 次数、熔断状态、预计出图时间"""
+    return jsonify({"code": 200, "data": scoreboard.snapshot()})
+
+@app.route('/api/scheduler', methods=['GET'])
+def scheduler_status():
+    """上游调度状态：在途/排队数、各 Key 占用、各优先级的排队等待统计"""
+    return jsonify({"code": 200, "data": scheduler.stats()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询任务状态"""
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({"code": 404, "msg": "任务不存在"}), 404
+    return jsonify({"code": 200, "data": job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """以 Server-Sent Events 推送任务进度"""
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({"code": 404, "msg": "任务不存在"}), 404
+    
+    try:
+        last_id = int(request.headers.get('Last-Event-ID', request.args.get('last_event_id', 0)))
+    except ValueError:
+        last_id = 0
+    
+    return Response(
+        sse_stream(job, last_id),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.route('/api/health', methods=['GET'])
 def health():
@@ -401,15 +1071,35 @@ def health():
         "status": "ok",
         "api": API_BASE,
         "output_dir": OUTPUT_DIR,
-        "features": ["multi_image_input", "auto_model_switch", "image_save", "file_serving", "smart_image_indexing", "4k_quality", "quality_prompt_suffix"],
+        "features": ["multi_image_input", "auto_model_switch", "image_save", "file_serving", "smart_image_indexing", "4k_quality", "quality_prompt_suffix", "async_jobs", "thumbnails", "result_cache", "reference_uploads", "output_references", "batch", "fair_scheduling", "adaptive_model_ranking", "metrics", "server_timing"],
         "latest_images": latest_files
     })
 
+def drain(timeout: float) -> bool:
+    """
+    停止前等待进行中的生成和异步任务结束、排队的图片写完（最多 timeout 秒），再释放进程池和上游连接
+
+    由生产入口（gunicorn.conf.py）在工作进程退出时调用；超时仍未结束返回 False
+    """
+    deadline = time.time() + timeout
+    while GENERATIONS_IN_FLIGHT.value() > 0 or job_store.active() > 0:
+        if time.time() >= deadline:
+            break
+        time.sleep(0.2)
+    drained = GENERATIONS_IN_FLIGHT.value() <= 0 and job_store.active() == 0
+    drained = image_writer.flush(max(0.0, deadline - time.time())) and drained
+    thumbnailer.shutdown()
+    reference_preparer.shutdown()
+    scoreboard.save()
+    upstream.close()
+    return drained
+
 if __name__ == '__main__':
     print("=" * 60)
     print("智能图生图服务 (支持 4K 高清)")
     print(f"API: {API_BASE}")
     print(f"保存目录: {OUTPUT_DIR}/")
     print("4K质量增强: ✅ 已启用")
+    print("开发服务器，生产环境请使用: gunicorn -c gunicorn.conf.py")
     print("=" * 60)
     app.run(host='0.0.0.0', port=3000, debug=True)
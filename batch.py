@@ -0,0 +1,102 @@
+"""
+批量生成 - 同一组参考图一次生成多张（指定数量，或每个提示词一张）
+
+- 各张按 API Key 排队，同一 Key 同时在跑的张数受 BATCH_MAX_PER_KEY 限制（跨批次共享）
+- 排队等名额时不占任何线程：某张结束后才把同一 Key 的下一张交给线程池，
+  批量任务本身也不占任务线程（见 JobStore.create），一个 Key 提交再多批次也挤不掉其他 Key 的任务
+- 每完成一张就推送一个 item 事件，不必等整批结束
+"""
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Deque, Dict, List, Sequence, Tuple, TypeVar
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "10"))
+BATCH_MAX_PER_KEY = int(os.environ.get("BATCH_MAX_PER_KEY", "2"))
+BATCH_POOL_SIZE = int(os.environ.get("BATCH_POOL_SIZE", "32"))
+
+T = TypeVar("T")
+Emit = Callable[[str, dict], None]
+
+
+class BatchDispatcher:
+    """按 Key 排队的执行器：同一 Key 最多 max_per_key 个在线程池中执行，其余留在队列里"""
+
+    def __init__(self, max_per_key: int = BATCH_MAX_PER_KEY, workers: int = BATCH_POOL_SIZE):
+        self.max_per_key = max_per_key
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+        self._lock = threading.Lock()
+        self._running: Dict[str, int] = {}
+        self._pending: Dict[str, Deque[Callable[[], None]]] = {}
+
+    def submit(self, key: str, fn: Callable[[], None]):
+        with self._lock:
+            self._pending.setdefault(key, deque()).append(fn)
+        self._dispatch(key)
+
+    def _dispatch(self, key: str):
+        ready = []
+        with self._lock:
+            queue = self._pending.get(key)
+            while queue and self._running.get(key, 0) < self.max_per_key:
+                self._running[key] = self._running.get(key, 0) + 1
+                ready.append(queue.popleft())
+            if queue is not None and not queue:
+                del self._pending[key]
+        for fn in ready:
+            self._executor.submit(self._run, key, fn)
+
+    def _run(self, key: str, fn: Callable[[], None]):
+        try:
+            fn()
+        finally:
+            with self._lock:
+                self._running[key] -= 1
+                if not self._running[key]:
+                    del self._running[key]
+            self._dispatch(key)
+
+
+batch_dispatcher = BatchDispatcher()
+
+
+def start_batch(
+    items: Sequence[T],
+    generate: Callable[[T, Emit], Tuple[dict, int]],
+    limit_key: str,
+    emit: Emit,
+    on_done: Callable[[List[Tuple[dict, int]]], None],
+    dispatcher: BatchDispatcher = batch_dispatcher,
+):
+    """
+    排队执行各张的 generate(item, emit) 后立即返回；
+    全部结束后用与 items 顺序一致的 (响应体, 状态码) 列表调用 on_done
+
+    进度事件会带上 index；每张结束时推送 item 事件 {"index", "status", "result"}
+    """
+    results: List[Tuple[dict, int]] = [None] * len(items)  # type: ignore[list-item]
+    remaining = [len(items)]
+    lock = threading.Lock()
+
+    def run(index: int, item: T):
+        def item_emit(event: str, data: dict):
+            emit(event, dict(data, index=index))
+
+        try:
+            body, status = generate(item, item_emit)
+        except Exception as e:
+            body, status = {"code": 500, "msg": str(e)}, 500
+        emit("item", {"index": index, "status": status, "result": body})
+        with lock:
+            results[index] = (body, status)
+            remaining[0] -= 1
+            done = remaining[0] == 0
+        if done:
+            on_done(results)
+
+    if not items:
+        on_done([])
+    for index, item in enumerate(items):
+        dispatcher.submit(limit_key, partial(run, index, item))
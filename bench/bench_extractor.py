@@ -0,0 +1,120 @@
+"""
+图片提取微基准 - 在抓包得到的真实响应体上比较各种提取方式
+
+- legacy_regex：早期做法，整个响应体转成 str 后用 Markdown 正则匹配，失败再 split('data:image')
+- scan：extractor.find_data_uri，只定位，不解码
+- scan_decode：定位并解码为图片字节
+- stream：stream_decode 按 64 KB 分块边读边解码（线上实际使用的路径）
+
+每项取 --repeat 轮中最快一轮的单次耗时；给出 --max-scan-ms / --max-decode-ms 时超出即以退出码 1 结束。
+
+用法：
+    python bench/bench_extractor.py
+    python bench/bench_extractor.py --repeat 7 --number 20 --max-scan-ms 2 --json extractor.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from extractor import find_data_uri  # noqa: E402
+from stream_decode import CHUNK_SIZE, decode_image_stream  # noqa: E402
+
+DEFAULT_FIXTURES = [os.path.join(ROOT, "raw_response.txt"), os.path.join(ROOT, "response_raw.txt")]
+_LEGACY_PATTERN = r'!\[.*?\]\((data:image/[^;]+;base64,([^)]+))\)'
+
+
+class _NullSink:
+    def write(self, data):
+        return len(data)
+
+
+def legacy_regex(body: bytes) -> bytes:
+    text = body.decode("utf-8")
+    match = re.search(_LEGACY_PATTERN, text)
+    if match:
+        data = match.group(2)
+    else:
+        data = text.split("data:image")[1].split(",", 1)[1].split('"')[0]
+    return base64.b64decode(data)
+
+
+def scan(body: bytes):
+    return find_data_uri(body)
+
+
+def scan_decode(body: bytes) -> bytes:
+    return find_data_uri(body).decode()
+
+
+def stream(body: bytes) -> int:
+    view = memoryview(body)
+    chunks = (bytes(view[i:i + CHUNK_SIZE]) for i in range(0, len(body), CHUNK_SIZE))
+    return decode_image_stream(chunks, _NullSink())[1]
+
+
+CASES = [("legacy_regex", legacy_regex), ("scan", scan), ("scan_decode", scan_decode), ("stream", stream)]
+
+
+def bench(body: bytes, repeat: int, number: int) -> dict:
+    results = {}
+    for name, fn in CASES:
+        best = min(timeit.repeat(lambda: fn(body), repeat=repeat, number=number)) / number
+        results[name] = {
+            "ms": round(best * 1000, 3),
+            "mb_per_s": round(len(body) / best / 1024 / 1024, 1) if best else None,
+        }
+    return results
+
+
+def check(body: bytes) -> str:
+    """各方式解出的图片必须一致"""
+    expected = legacy_regex(body)
+    sink = io.BytesIO()
+    decode_image_stream([body], sink)
+    if scan_decode(body) != expected or sink.getvalue() != expected:
+        raise AssertionError("提取结果不一致")
+    return f"{len(expected)} 字节"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="响应图片提取微基准")
+    parser.add_argument("fixtures", nargs="*", default=DEFAULT_FIXTURES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=10)
+    parser.add_argument("--max-scan-ms", type=float, help="scan 单次耗时上限")
+    parser.add_argument("--max-decode-ms", type=float, help="scan_decode 单次耗时上限")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    report, failures = {}, []
+    for path in args.fixtures:
+        with open(path, "rb") as f:
+            body = f.read()
+        name = os.path.basename(path)
+        print(f"\n{name} ({len(body) / 1024 / 1024:.2f} MB, 图片 {check(body)})")
+        results = report[name] = bench(body, args.repeat, args.number)
+        for case, r in results.items():
+            print(f"  {case:<14}{r['ms']:>10.3f} ms  {r['mb_per_s']:>10.1f} MB/s")
+        if args.max_scan_ms is not None and results["scan"]["ms"] > args.max_scan_ms:
+            failures.append(f"{name}: scan {results['scan']['ms']} ms > {args.max_scan_ms}")
+        if args.max_decode_ms is not None and results["scan_decode"]["ms"] > args.max_decode_ms:
+            failures.append(f"{name}: scan_decode {results['scan_decode']['ms']} ms > {args.max_decode_ms}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+端到端压测 - 本地起上游桩服务和后端，按指定并发请求 /api/gen_image
+
+报告吞吐、端到端延迟 p50/p99、后端自身开销（总耗时减去上游阶段和排队，取自响应的 timings 字段）
+p50/p99、后端进程（含子进程）峰值 RSS。给出阈值时任何一项不达标即以退出码 1 结束，可用于回归。
+
+用法：
+    python bench/load_test.py --requests 200 --concurrency 16 --latency 0.5 \\
+        --max-p99 3 --max-overhead-p99 0.5 --max-rss-mb 600
+
+    # 压测已在运行的后端（不启动桩服务和后端，RSS 需指定 --pid）
+    python bench/load_test.py --target http://127.0.0.1:3000 --pid 12345
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB = os.path.join(ROOT, "bench", "stub_upstream.py")
+IMAGE_IN_BODY = re.compile(rb"data:image/[a-z]+;base64,([A-Za-z0-9+/=]+)")
+UPSTREAM_STAGES = ("upstream", "stream_decode", "downgrade_upstream", "downgrade_stream_decode")
+
+BACKEND_LAUNCHER = (
+    "import sys; sys.path.insert(0, {root!r}); import app; "
+    "app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"服务未就绪: {url}")
+
+
+def default_reference() -> bytes:
+    """从抓包的响应体里取出图片，作为参考图"""
+    with open(os.path.join(ROOT, "raw_response.txt"), "rb") as f:
+        match = IMAGE_IN_BODY.search(f.read())
+    if not match:
+        raise RuntimeError("raw_response.txt 中没有找到图片")
+    return base64.b64decode(match.group(1))
+
+
+def _proc_children(pid: int) -> List[int]:
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _vm_hwm(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss(pid: int) -> Optional[int]:
+    """进程及其子进程（缩略图、参考图进程池）各自峰值 RSS 之和，仅 Linux"""
+    if not os.path.exists(f"/proc/{pid}/status"):
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += _vm_hwm(current)
+        stack.extend(_proc_children(current))
+    return total
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 4)
+
+
+def backend_overhead(body: dict) -> Optional[float]:
+    """后端自身耗时（秒）：总耗时减去等待上游、读取上游响应、排队等上游名额的时间"""
+    timings = body.get("timings") if isinstance(body, dict) else None
+    if not timings:
+        return None
+    upstream_ms = sum(stage_ms for attempt in timings.get("attempts", [])
+                      for stage, stage_ms in attempt["stages"].items() if stage in UPSTREAM_STAGES)
+    queue_ms = timings["stages"].get("queue", 0.0)
+    return max(0.0, timings["total_ms"] - upstream_ms - queue_ms) / 1000
+
+
+def run_load(target: str, payload: dict, total: int, concurrency: int, timeout: float) -> dict:
+    local = threading.local()
+
+    def one(i: int):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        body = dict(payload, prompt=f"{payload['prompt']} #{i}")
+        started = time.perf_counter()
+        try:
+            r = session.post(f"{target}/api/gen_image", json=body, timeout=timeout)
+            status, data = r.status_code, r.json()
+        except (requests.RequestException, ValueError) as e:
+            status, data = 0, {"msg": str(e)}
+        return status, time.perf_counter() - started, data
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for status, latency, _ in results if status == 200]
+    overheads = [o for status, _, data in results if status == 200
+                 for o in [backend_overhead(data)] if o is not None]
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "succeeded": len(latencies),
+        "error_rate": round(1 - len(latencies) / total, 4) if total else 0.0,
+        "statuses": statuses,
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p99_s": percentile(latencies, 99),
+        "overhead_p50_s": percentile(overheads, 50),
+        "overhead_p99_s": percentile(overheads, 99),
+    }
+
+
+def check_thresholds(report: dict, args) -> List[str]:
+    failures = []
+
+    def at_most(key, limit, label):
+        if limit is not None and (report.get(key) is None or report[key] > limit):
+            failures.append(f"{label} {report.get(key)} > {limit}")
+
+    if args.min_rps is not None and report["throughput_rps"] < args.min_rps:
+        failures.append(f"吞吐 {report['throughput_rps']} < {args.min_rps}")
+    at_most("error_rate", args.max_error_rate, "失败率")
+    at_most("latency_p50_s", args.max_p50, "延迟 p50")
+    at_most("latency_p99_s", args.max_p99, "延迟 p99")
+    at_most("overhead_p50_s", args.max_overhead_p50, "后端开销 p50")
+    at_most("overhead_p99_s", args.max_overhead_p99, "后端开销 p99")
+    at_most("peak_rss_mb", args.max_rss_mb, "峰值 RSS(MB)")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="图生图后端端到端压测")
+    parser.add_argument("--requests", type=int, default=100, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2, help="正式计时前的预热请求数")
+    parser.add_argument("--references", type=int, default=1, help="每个请求附带的参考图数量")
+    parser.add_argument("--reference", help="参考图文件，默认取抓包响应里的图片")
+    parser.add_argument("--race", type=int, default=0, help="竞速宽度，0 为逐个尝试")
+    parser.add_argument("--timeout", type=float, default=600)
+    # 桩服务
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--transfer", type=float, default=0.0)
+    parser.add_argument("--rate-503", type=float, default=0.0)
+    parser.add_argument("--rate-413", type=float, default=0.0)
+    # 已在运行的服务
+    parser.add_argument("--target", help="被测后端地址；指定后不启动桩服务和后端")
+    parser.add_argument("--pid", type=int, help="被测后端进程号（配合 --target 统计 RSS）")
+    # 阈值
+    parser.add_argument("--min-rps", type=float)
+    parser.add_argument("--max-error-rate", type=float, default=0.0)
+    parser.add_argument("--max-p50", type=float)
+    parser.add_argument("--max-p99", type=float)
+    parser.add_argument("--max-overhead-p50", type=float)
+    parser.add_argument("--max-overhead-p99", type=float)
+    parser.add_argument("--max-rss-mb", type=float)
+    parser.add_argument("--json", help="把报告写入 JSON 文件")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="imagegen-bench-")
+    try:
+        target, pid = args.target, args.pid
+        if not target:
+            stub_port, backend_port = free_port(), free_port()
+            stub_log = open(os.path.join(workdir, "stub.log"), "w")
+            processes.append(subprocess.Popen(
+                [sys.executable, STUB, "--port", str(stub_port), "--latency", str(args.latency),
+                 "--jitter", str(args.jitter), "--transfer", str(args.transfer),
+                 "--rate-503", str(args.rate_503), "--rate-413", str(args.rate_413)],
+                stdout=stub_log, stderr=subprocess.STDOUT))
+            wait_ready(f"http://127.0.0.1:{stub_port}/stats")
+
+            env = dict(os.environ, API_BASE=f"http://127.0.0.1:{stub_port}", TIMING_LOG=os.devnull)
+            backend_log = open(os.path.join(workdir, "backend.log"), "w")
+            backend = subprocess.Popen(
+                [sys.executable, "-c", BACKEND_LAUNCHER.format(root=ROOT, port=backend_port)],
+                cwd=workdir, env=env, stdout=backend_log, stderr=subprocess.STDOUT)
+            processes.append(backend)
+            target, pid = f"http://127.0.0.1:{backend_port}", backend.pid
+            wait_ready(f"{target}/api/health")
+            print(f"工作目录: {workdir}")
+
+        if args.reference:
+            with open(args.reference, "rb") as f:
+                reference = f.read()
+        else:
+            reference = default_reference()
+        payload = {
+            "api_key": "sk-bench",
+            "prompt": "bench",
+            "images": [base64.b64encode(reference).decode("ascii")] * args.references,
+            "auto": True,
+            "cache": False,
+            "race": args.race or False,
+        }
+
+        if args.warmup:
+            run_load(target, payload, args.warmup, 1, args.timeout)
+        report = run_load(target, payload, args.requests, args.concurrency, args.timeout)
+        rss = peak_rss(pid) if pid else None
+        report["peak_rss_mb"] = round(rss / 1024 / 1024, 1) if rss else None
+        report["stub"] = {"latency": args.latency, "jitter": args.jitter, "rate_503": args.rate_503,
+                          "rate_413": args.rate_413} if not args.target else None
+
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        failures = check_thresholds(report, args)
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ 全部阈值通过")
+        return 1 if failures else 0
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
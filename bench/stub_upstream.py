@@ -0,0 +1,154 @@
+"""
+上游桩服务 - 在本地模拟 /v1/models 和 /v1/chat/completions，用于离线压测
+
+- 生成接口轮流回放抓包得到的真实响应体（默认 raw_response.txt、response_raw.txt）
+- 可配置响应延迟及抖动、503 无可用渠道、4K 请求返回 413 的概率
+- 只依赖标准库，单独进程运行，不占用被测后端的 CPU 和内存
+
+用法：
+    python bench/stub_upstream.py --port 3999 --latency 1.5 --jitter 0.5 --rate-503 0.1 --rate-413 0.2
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BODIES = [os.path.join(ROOT, "raw_response.txt"), os.path.join(ROOT, "response_raw.txt")]
+DEFAULT_MODELS = ["gemini-3-pro-image-preview", "gemini-2.5-flash-image", "gpt-4o-mini"]
+NO_CHANNEL_BODY = json.dumps({"error": {"message": "当前分组下对于模型无可用渠道", "type": "new_api_error"}},
+                             ensure_ascii=False).encode("utf-8")
+CHUNK_SIZE = 64 * 1024
+
+
+class StubConfig:
+    def __init__(self, bodies: List[bytes], models: List[str], latency: float, jitter: float,
+                 rate_503: float, rate_413: float, transfer: float):
+        self.bodies = bodies
+        self.models = models
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_503 = rate_503
+        self.rate_413 = rate_413
+        self.transfer = transfer
+        self._next_body = itertools.cycle(range(len(bodies)))
+        self._lock = threading.Lock()
+        self.counts = {"models": 0, "generations": 0, "503": 0, "413": 0}
+
+    def next_body(self) -> bytes:
+        with self._lock:
+            return self.bodies[next(self._next_body)]
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", transfer: float = 0.0):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # transfer > 0 时把响应体分块慢慢发出，模拟上游边生成边输出
+        chunks = max(1, -(-len(body) // CHUNK_SIZE))
+        for i in range(0, len(body), CHUNK_SIZE):
+            self.wfile.write(body[i:i + CHUNK_SIZE])
+            if transfer:
+                time.sleep(transfer / chunks)
+
+    def do_GET(self):
+        if self.path.startswith("/v1/models"):
+            self.config.count("models")
+            data = {"object": "list", "data": [{"id": m, "object": "model"} for m in self.config.models]}
+            self._send(200, json.dumps(data).encode("utf-8"))
+        elif self.path == "/stats":
+            self._send(200, json.dumps(self.config.counts).encode("utf-8"))
+        else:
+            self._send(404, b'{"error":"not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if not self.path.startswith("/v1/chat/completions"):
+            self._send(404, b'{"error":"not found"}')
+            return
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            self._send(400, b'{"error":"invalid json"}')
+            return
+
+        config = self.config
+        config.count("generations")
+        delay = max(0.0, config.latency + random.uniform(-config.jitter, config.jitter))
+        if random.random() < config.rate_503:
+            config.count("503")
+            time.sleep(delay * 0.1)
+            self._send(503, NO_CHANNEL_BODY)
+            return
+        if payload.get("is_4k") and random.random() < config.rate_413:
+            config.count("413")
+            time.sleep(delay * 0.1)
+            self._send(413, b'{"error":"request entity too large"}')
+            return
+        time.sleep(delay)
+        self._send(200, config.next_body(), transfer=config.transfer)
+
+
+def make_server(host: str, port: int, config: StubConfig) -> ThreadingHTTPServer:
+    handler = type("BoundStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="本地上游桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3999)
+    parser.add_argument("--latency", type=float, default=1.0, help="返回响应头前的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的均匀抖动幅度（秒）")
+    parser.add_argument("--transfer", type=float, default=0.0, help="发送响应体所用时间（秒）")
+    parser.add_argument("--rate-503", type=float, default=0.0, help="返回 503 无可用渠道的概率")
+    parser.add_argument("--rate-413", type=float, default=0.0, help="4K 请求返回 413 的概率")
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="/v1/models 返回的模型，逗号分隔")
+    parser.add_argument("--bodies", nargs="*", default=DEFAULT_BODIES, help="回放的响应体文件")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    bodies = []
+    for path in args.bodies:
+        with open(path, "rb") as f:
+            bodies.append(f.read())
+    config = StubConfig(bodies, [m for m in args.models.split(",") if m], args.latency, args.jitter,
+                        args.rate_503, args.rate_413, args.transfer)
+    server = make_server(args.host, args.port, config)
+    print(f"上游桩服务: http://{args.host}:{server.server_address[1]} "
+          f"(延迟 {args.latency}±{args.jitter}s, 503 {args.rate_503:.0%}, 413 {args.rate_413:.0%})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""
+CPU 密集任务的执行器（缩略图、参考图预处理）
+
+- 默认是进程池，避开 GIL
+- 在 gevent 协程工作进程中（threading 已被 monkey patch）进程池的管理线程变成协程，
+  等结果时会卡住整个工作进程，改用 gevent 的原生线程池：Pillow 缩放、编码时会释放 GIL，
+  等待结果只挂起当前协程
+"""
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+
+def gevent_patched() -> bool:
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def create_executor(workers: int) -> Executor:
+    if gevent_patched():
+        from gevent.threadpool import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers)
@@ -0,0 +1,118 @@
+"""
+响应图片提取 - 在上游响应体里定位 data URI 图片
+
+- 支持 Markdown 形式 ![image](data:image/png;base64,...) 和裸 data URI（JSON 字符串里的 "data:image/...")
+- 从头到尾只扫描一遍：用 bytes.find / 预编译正则的 pos 参数逐段前进，不切分、不复制响应体
+- payload 的结束位置用 find 找常见结束符（memchr，比逐字符匹配的正则快一个数量级），
+  解码时由 Base64 校验兜底，夹杂其他非法字符的少见情况再退回逐字符规则
+- 返回的 payload 是指向原缓冲区的 memoryview，需要时再解码
+- JSON 编码器可能把 '/' 转义成 '\\/'，也可能在 Base64 中插入 '\\n'，解码时一并处理
+
+stream_decode 的流式解码器复用这里的标记和结束符定义。
+"""
+import base64
+import binascii
+import re
+from typing import Iterator, NamedTuple, Optional, Union
+
+# 需要支持 find 的缓冲区（bytes / bytearray / mmap）
+Buffer = Union[bytes, bytearray]
+
+# JSON 编码器可能把 '/' 转义成 '\/'，两种写法都要认
+MARKER = re.compile(rb"data:image\\?/")
+MARKER_MAX_LEN = len(b"data:image\\/")
+B64_MARKER = b";base64,"
+# MIME 子类型的最大长度，超过仍找不到 ;base64, 就不是 Base64 data URI
+HEADER_MAX_LEN = 64
+# Base64 字母表之外的第一个字符即为 payload 结束（Markdown 的 ')' 或 JSON 的 '"'）；
+# 反斜杠单独放行，用来处理 JSON 转义（\/ 和 \n）
+PAYLOAD_END = re.compile(rb"[^A-Za-z0-9+/=\\]")
+B64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+JSON_ESCAPES = re.compile(rb"\\[nr]")
+# payload 的常见结束符：JSON 字符串的引号、Markdown 的右括号，以及空白、逗号、尖括号
+_TERMINATORS = (b'"', b")", b"'", b" ", b",", b"<")
+
+
+class DataUri(NamedTuple):
+    mime: str
+    payload: memoryview  # Base64 部分，指向原缓冲区
+    start: int           # payload 在缓冲区中的起止位置
+    end: int
+    escaped: bool        # payload 中含有 JSON 转义
+
+    def decode(self) -> bytes:
+        return decode_payload(self.payload, self.escaped)
+
+
+def find_payload_end(data: Buffer, start: int = 0, end: Optional[int] = None) -> Optional[int]:
+    """payload 的结束位置（第一个常见结束符），在 [start, end) 内没有时返回 None"""
+    found = None
+    stop = len(data) if end is None else end
+    for terminator in _TERMINATORS:
+        i = data.find(terminator, start, stop if found is None else found)
+        if i >= 0:
+            found = i
+    return found
+
+
+def _pad(payload) -> bytes:
+    padding = -len(payload) % 4
+    return bytes(payload) + b"=" * padding if padding else payload
+
+
+def unescape_b64(data) -> bytes:
+    """去掉 JSON 转义（\\/ → /，\\n、\\r 删除）"""
+    return JSON_ESCAPES.sub(b"", bytes(data).replace(b"\\/", b"/"))
+
+
+def decode_payload(payload, escaped: Optional[bool] = None) -> bytes:
+    """
+    解码 Base64 payload；没有转义字符时直接解码 memoryview，不做额外复制
+
+    escaped 由 iter_data_uris 在扫描时确定；未知时检查一遍
+    """
+    if escaped is None:
+        escaped = b"\\" in bytes(payload)
+    if escaped:
+        payload = unescape_b64(payload)
+    try:
+        return base64.b64decode(_pad(payload), validate=True)
+    except binascii.Error:
+        # 夹杂了结束符以外的非 Base64 字符：截到第一个这样的字符为止
+        m = PAYLOAD_END.search(payload)
+        if m:
+            payload = payload[:m.start()]
+        if len(payload) % 4 == 1:
+            # 多出的单个字符凑不成一个字节
+            payload = payload[:-1]
+        return base64.b64decode(_pad(payload))
+
+
+def iter_data_uris(data: Buffer) -> Iterator[DataUri]:
+    """按出现顺序逐个返回缓冲区中的 Base64 data URI 图片"""
+    view = memoryview(data)
+    pos, size = 0, len(data)
+    while pos < size:
+        m = MARKER.search(data, pos)
+        if m is None:
+            return
+        header_start = m.end()
+        header_end = data.find(B64_MARKER, header_start, header_start + HEADER_MAX_LEN + len(B64_MARKER))
+        if header_end < 0:
+            # 不是 Base64 data URI，接着往后找
+            pos = header_start
+            continue
+        subtype = bytes(view[header_start:header_end]).replace(b"\\", b"")
+        start = header_end + len(B64_MARKER)
+        end = find_payload_end(data, start)
+        if end is None:
+            end = size
+        pos = end
+        if end > start:
+            escaped = data.find(b"\\", start, end) >= 0
+            yield DataUri("image/" + subtype.decode("ascii", "replace"), view[start:end], start, end, escaped)
+
+
+def find_data_uri(data: Buffer) -> Optional[DataUri]:
+    """第一张 data URI 图片，没有时返回 None"""
+    return next(iter_data_uris(data), None)
@@ -0,0 +1,63 @@
+"""
+图片文件响应 - 统一处理缓存头、条件请求和 Range，可选交给前置代理发送文件
+
+- ETag：有内容哈希时用哈希（强 ETag），否则用 mtime + 大小
+- Last-Modified + If-None-Match / If-Modified-Since → 304
+- Range → 206（由 werkzeug 处理）
+- immutable=True：按内容寻址、永不变化的 URL，允许浏览器缓存一年且无需再验证
+- SENDFILE_MODE：
+    ""            Flask 自己读文件发送（默认）
+    "x-sendfile"  返回 X-Sendfile 头（Apache mod_xsendfile / lighttpd）
+    "x-accel"     返回 X-Accel-Redirect 头（nginx），路径为 X_ACCEL_PREFIX + 相对 root 的路径
+  代理模式下 Range 由代理处理，这里只负责 304
+"""
+import os
+from typing import Optional
+
+from flask import Response, request, send_file
+
+SENDFILE_MODE = os.environ.get("SENDFILE_MODE", "").lower()
+X_ACCEL_PREFIX = os.environ.get("X_ACCEL_PREFIX", "/protected-images/")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _cache_control(rv: Response, immutable: bool):
+    if immutable:
+        rv.cache_control.no_cache = None
+        rv.cache_control.public = True
+        rv.cache_control.max_age = IMMUTABLE_MAX_AGE
+        rv.cache_control.immutable = True
+    else:
+        # 可以缓存，但每次使用前都要带 ETag 再验证
+        rv.cache_control.no_cache = True
+        rv.cache_control.max_age = None
+        rv.expires = None
+
+
+def _proxy_response(path: str, root: str, mimetype: str, etag: Optional[str]) -> Response:
+    rv = Response(mimetype=mimetype)
+    if SENDFILE_MODE == "x-accel":
+        rel = os.path.relpath(path, root).replace(os.sep, "/")
+        rv.headers["X-Accel-Redirect"] = X_ACCEL_PREFIX.rstrip("/") + "/" + rel
+    else:
+        rv.headers["X-Sendfile"] = path
+    stat = os.stat(path)
+    rv.last_modified = stat.st_mtime
+    rv.set_etag(etag or f"{stat.st_mtime}-{stat.st_size}")
+    return rv
+
+
+def serve_file(path: str, root: str, mimetype: str, etag: Optional[str] = None,
+               immutable: bool = False) -> Response:
+    """发送 root 下的图片文件，etag 为内容哈希（可选）"""
+    if SENDFILE_MODE in ("x-sendfile", "x-accel"):
+        rv = _proxy_response(path, root, mimetype, etag)
+        rv = rv.make_conditional(request, accept_ranges=False)
+        if rv.status_code == 304:
+            rv.headers.pop("X-Sendfile", None)
+            rv.headers.pop("X-Accel-Redirect", None)
+    else:
+        rv = send_file(path, mimetype=mimetype, etag=etag if etag else True,
+                       conditional=True, max_age=None)
+    _cache_control(rv, immutable)
+    return rv
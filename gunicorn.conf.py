@@ -0,0 +1,118 @@
+"""
+生产环境入口 - gunicorn 配置
+
+    pip install gunicorn gevent
+    gunicorn -c gunicorn.conf.py
+
+- 默认使用 gevent 工作进程：等待上游的 600 秒长请求只占一个协程，不占操作系统线程，
+  单个工作进程可同时挂起 WORKER_CONNECTIONS 个请求
+- 工作进程数取 WEB_CONCURRENCY，未设置时按本机可用 CPU 数（考虑 CPU 亲和性和 cgroup 配额）
+- preload_app：主进程导入一次应用后再 fork 工作进程
+- 收到 SIGTERM 后停止接收新连接，等待进行中的生成和异步任务完成再退出；主进程在 SIGTERM 之后
+  GRACEFUL_TIMEOUT 秒强杀工作进程，排空只用这段时间里剩下的部分（先减去等待连接关闭已用掉的），
+  并留出 EXIT_RESERVE 秒保存记分板和指标
+- 多个工作进程时异步任务经 JOB_SHARED_DIR 共享，任务查询和 SSE 可以落到任意工作进程
+- 多个工作进程时 /metrics 经 METRICS_SHARED_DIR 汇总所有工作进程的数值（见 metrics.py）
+- 调度容量（SCHED_CAPACITY 等）、模型缓存、记分板按工作进程各自计算
+"""
+import os
+import signal
+import time
+
+WORKER_CLASS = os.environ.get("WORKER_CLASS", "gevent")
+
+if WORKER_CLASS == "gevent":
+    # 必须在导入应用之前打补丁，preload 时应用里的锁、线程、socket 才会是协程版本
+    from gevent import monkey
+    monkey.patch_all()
+
+from upstream import READ_TIMEOUT  # noqa: E402
+
+
+def available_cpus() -> int:
+    """本进程可用的 CPU 数：亲和性掩码，再受 cgroup v2 的 cpu.max 配额限制"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+wsgi_app = "app:app"
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '3000')}"
+worker_class = WORKER_CLASS
+workers = int(os.environ.get("WEB_CONCURRENCY") or available_cpus())
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", "1000"))
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+preload_app = True
+# 心跳超时：gevent 工作进程等待上游时仍会按时心跳，只有 CPU 长时间被占用才会触发
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+# 留足一次完整上游读超时，再加保存和回退的余量
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", str(int(READ_TIMEOUT) + 60)))
+keepalive = 5
+# 排空结束后保存记分板、指标快照所需的时间
+EXIT_RESERVE = float(os.environ.get("EXIT_RESERVE", "2"))
+accesslog = os.environ.get("ACCESS_LOG", "-")
+
+if workers > 1:
+    # 必须在 preload 导入 jobs、metrics 之前设置
+    os.environ.setdefault("JOB_SHARED_DIR", os.path.join("generated_images", "jobs"))
+    os.environ.setdefault("METRICS_SHARED_DIR", os.path.join("generated_images", "metrics"))
+
+
+def on_starting(server):
+    import metrics
+    if metrics.SHARED_DIR:
+        metrics.clear_shared()
+
+
+def when_ready(server):
+    server.log.info("工作进程: %s × %s（graceful_timeout %ss）", workers, worker_class, graceful_timeout)
+
+
+def post_fork(server, worker):
+    import metrics
+    metrics.start_shared()
+
+
+def post_worker_init(worker):
+    """记下收到 SIGTERM 的时间，主进程从那一刻起计算 graceful_timeout"""
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def on_term(sig, frame):
+        if not hasattr(worker, "exit_requested_at"):
+            worker.exit_requested_at = time.time()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_int(worker):
+    # SIGINT / SIGQUIT 快速退出，同样从此刻起计时
+    if not hasattr(worker, "exit_requested_at"):
+        worker.exit_requested_at = time.time()
+
+
+def worker_exit(server, worker):
+    """工作进程退出前排空进行中的生成，只用主进程强杀前剩下的时间"""
+    import app
+    import metrics
+    started = getattr(worker, "exit_requested_at", time.time())
+    budget = max(0.0, graceful_timeout - (time.time() - started) - EXIT_RESERVE)
+    if not app.drain(budget):
+        worker.log.warning("剩余的 %.0fs 内仍有未完成的生成，强制退出", budget)
+    metrics.write_snapshot()
+
+
+def child_exit(server, worker):
+    """主进程中调用：已退出工作进程的计数保留，gauge 丢弃"""
+    import metrics
+    if metrics.SHARED_DIR:
+        metrics.mark_process_dead(worker.pid)
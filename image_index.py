@@ -0,0 +1,156 @@
+"""
+图片元数据索引 - 内嵌 SQLite，保存每张生成图片的文件名、提示词、模型、尺寸等
+
+列表、"最新 N 张"、按模型/4K 过滤都走索引查询，不再扫描目录、逐个 stat 文件。
+每个线程使用自己的连接，WAL 模式下读写互不阻塞。
+"""
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+Cursor = Tuple[float, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    filename   TEXT PRIMARY KEY,
+    sha256     TEXT,
+    ext        TEXT NOT NULL,
+    prompt     TEXT,
+    model      TEXT,
+    is_4k      INTEGER,
+    downgraded INTEGER NOT NULL DEFAULT 0,
+    bytes      INTEGER,
+    width      INTEGER,
+    height     INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_created_at ON images (created_at, filename);
+CREATE INDEX IF NOT EXISTS idx_images_model_created_at ON images (model, created_at);
+CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images (sha256);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+COLUMNS = ("filename", "sha256", "ext", "prompt", "model", "is_4k", "downgraded",
+           "bytes", "width", "height", "created_at")
+_DEFAULTS = {"downgraded": 0}
+
+
+def _values(row: dict) -> list:
+    return [row[c] if row.get(c) is not None else _DEFAULTS.get(c) for c in COLUMNS]
+
+
+class ImageIndex:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return conn
+
+    # ---- 写入 ----
+
+    def add(self, row: dict):
+        """插入或覆盖一条记录（row 的键取自 COLUMNS）"""
+        self._conn().execute(
+            f"INSERT OR REPLACE INTO images ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(COLUMNS))})",
+            _values(row),
+        )
+
+    def add_many(self, rows: List[dict]):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO images ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                [_values(row) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self._conn().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # ---- 查询 ----
+
+    def get(self, filename: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT * FROM images WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def latest(self, limit: int = 10, **filters) -> List[dict]:
+        """按创建时间倒序，可按 model / is_4k / downgraded 过滤"""
+        rows, _ = self.page(limit, **filters)
+        return rows
+
+    def page(self, limit: int, before: Optional[Cursor] = None, after: Optional[Cursor] = None,
+             since: Optional[float] = None, model: Optional[str] = None,
+             is_4k: Optional[bool] = None, downgraded: Optional[bool] = None) -> Tuple[List[dict], bool]:
+        """
+        键集分页，结果总是按 (created_at, filename) 倒序
+
+        before: 取比该游标更旧的一页；after: 取比该游标更新的一页
+        since: 只要 created_at 晚于该时间的记录；不带 before 时从最早的未读记录取起，
+        这样增量轮询把本页最新的 created_at 作为下一次的 since，不会跳过未取到的记录
+        limit < 0 表示不限。返回 (记录, 是否还有更多)
+        """
+        where, args = [], []
+        if before is not None:
+            where.append("(created_at < ? OR (created_at = ? AND filename < ?))")
+            args += [before[0], before[0], before[1]]
+        if after is not None:
+            where.append("(created_at > ? OR (created_at = ? AND filename > ?))")
+            args += [after[0], after[0], after[1]]
+        if since is not None:
+            where.append("created_at > ?")
+            args.append(since)
+        if model is not None:
+            where.append("model = ?")
+            args.append(model)
+        if is_4k is not None:
+            where.append("is_4k = ?")
+            args.append(int(is_4k))
+        if downgraded is not None:
+            where.append("downgraded = ?")
+            args.append(int(downgraded))
+
+        # after 翻页和 since 增量轮询要从旧往新走，取完再翻转
+        ascending = after is not None or (since is not None and before is None)
+        direction = "ASC" if ascending else "DESC"
+        sql = "SELECT * FROM images"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY created_at {direction}, filename {direction} LIMIT ?"
+        args.append(limit + 1 if limit >= 0 else -1)
+
+        rows = [dict(r) for r in self._conn().execute(sql, args)]
+        has_more = 0 <= limit < len(rows)
+        rows = rows[:limit] if limit >= 0 else rows
+        if ascending:
+            rows.reverse()
+        return rows, has_more
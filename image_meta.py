@@ -0,0 +1,97 @@
+"""
+图片元信息 - 通过文件头识别真实格式，只读头部解析宽高
+"""
+import struct
+from typing import BinaryIO, Optional, Tuple
+
+# (魔数前缀, 扩展名, MIME)
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"GIF87a", "gif", "image/gif"),
+    (b"GIF89a", "gif", "image/gif"),
+]
+
+DEFAULT_FORMAT = ("png", "image/png")
+
+
+def detect_format(head: bytes) -> Optional[Tuple[str, str]]:
+    """根据文件头返回 (扩展名, MIME)，不是已知图片格式时返回 None"""
+    for magic, ext, mime in _SIGNATURES:
+        if head.startswith(magic):
+            return ext, mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    return None
+
+
+def sniff_format(head: bytes) -> Tuple[str, str]:
+    """根据文件头返回 (扩展名, MIME)，无法识别时按 PNG 处理"""
+    return detect_format(head) or DEFAULT_FORMAT
+
+
+def file_mime(path: str) -> str:
+    """读取文件头判断 MIME（旧版 .png 文件实际可能是 JPEG）"""
+    with open(path, "rb") as f:
+        return sniff_format(f.read(16))[1]
+
+
+def _jpeg_size(f: BinaryIO) -> Optional[Tuple[int, int]]:
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        # SOF0..SOF15，排除 DHT(C4) / JPG(C8) / DAC(CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        f.seek(length - 2, 1)
+
+
+def _webp_size(head: bytes) -> Optional[Tuple[int, int]]:
+    chunk = head[12:16]
+    if chunk == b"VP8X" and len(head) >= 30:
+        width = 1 + int.from_bytes(head[24:27], "little")
+        height = 1 + int.from_bytes(head[27:30], "little")
+        return width, height
+    if chunk == b"VP8 " and len(head) >= 30:
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(head) >= 25:
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    return None
+
+
+def image_size(path: str) -> Optional[Tuple[int, int]]:
+    """读取图片宽高，无法解析时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(32)
+            ext, _ = sniff_format(head)
+            if head.startswith(b"\x89PNG") and len(head) >= 24:
+                return struct.unpack(">II", head[16:24])
+            if ext == "jpg":
+                return _jpeg_size(f)
+            if ext == "gif" and len(head) >= 10:
+                return struct.unpack("<HH", head[6:10])
+            if ext == "webp":
+                return _webp_size(head)
+    except (OSError, struct.error):
+        pass
+    return None
@@ -0,0 +1,352 @@
+"""
+图片存储 - 按内容哈希分片存放，文件名只是指向内容的别名
+
+目录结构（root 即 OUTPUT_DIR）：
+    blobs/ab/cd/<sha256>.<ext>   实际图片，扩展名由文件头识别
+    index.db                     文件名 → 内容哈希及元数据的 SQLite 索引（见 image_index）
+
+- 相同内容只存一份
+- 文件名末尾带内容哈希，同一秒、同一提示词的两次生成不会互相覆盖
+- 旧版直接放在 root 下的图片首次启动时登记进索引，仍可按原文件名访问
+- 写入分两步：prepare_file 算出记录，commit 原子改名并登记索引；image_writer 把 commit 放到后台线程，
+  排队期间临时文件放在 .pending/<文件名>.<随机后缀>.<pid>，按文件名查找时会等它提交
+- 进程崩溃或被强杀时留下的排队写入（响应里已经给出文件名）在下次启动时提交，写了一半的临时文件删除；
+  查找时发现写入它的进程已退出，也会当场提交
+"""
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Dict, List, Optional, Tuple
+
+from image_index import ImageIndex
+from image_meta import detect_format, image_size, sniff_format
+
+BLOB_DIR = "blobs"
+INDEX_DB = "index.db"
+PENDING_DIR = ".pending"
+# 流式解码的临时文件（root 下），见 temp_prefix
+TEMP_PREFIX = ".part-"
+# 提交时的 fsync 策略：always（文件和目录）/ file（只同步文件）/ never
+WRITE_FSYNC = os.environ.get("WRITE_FSYNC", "always")
+# 访问排队中的图片时最多等待提交的时间
+WRITE_WAIT_TIMEOUT = float(os.environ.get("WRITE_WAIT_TIMEOUT", "10"))
+_IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _pending_owner(name: str) -> Optional[int]:
+    """.pending/<文件名>.<随机后缀>.<pid> 中的进程号"""
+    pid = name.rsplit(".", 1)[-1]
+    return int(pid) if pid.isdigit() else None
+
+
+def _temp_owner(name: str) -> Optional[int]:
+    """.part-<pid>-<随机后缀> 中的进程号；不是这种格式（包括旧版临时文件）返回 None"""
+    pid = name[len(TEMP_PREFIX):].split("-", 1)[0]
+    return int(pid) if name.startswith(TEMP_PREFIX) and pid.isdigit() else None
+
+
+def _fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ImageStore:
+    def __init__(self, root: str, index: Optional[ImageIndex] = None):
+        # send_file 会把相对路径当作相对应用目录，这里统一用绝对路径
+        self.root = os.path.abspath(root)
+        self.index = index or ImageIndex(os.path.join(self.root, INDEX_DB))
+        self._lock = threading.Lock()
+        self._bootstrapped = False
+        # 文件名 / <sha256>.<ext> → 本进程中排队写入的 Future（内容和文件名都相同的写入可能有多个）
+        self._pending: Dict[str, List[Future]] = {}
+
+    # ---- 路径 ----
+
+    def blob_path(self, sha256: str, ext: str) -> str:
+        return os.path.join(self.root, BLOB_DIR, sha256[:2], sha256[2:4], f"{sha256}.{ext}")
+
+    def path_of(self, row: dict) -> str:
+        if row["sha256"]:
+            return self.blob_path(row["sha256"], row["ext"])
+        return os.path.join(self.root, row["filename"])
+
+    def _with_path(self, row: Optional[dict]) -> Optional[dict]:
+        if row is None:
+            return None
+        return dict(row, path=self.path_of(row))
+
+    # ---- 首次启动：登记旧数据 ----
+
+    def _ensure_bootstrapped(self):
+        if self._bootstrapped:
+            return
+        with self._lock:
+            if self._bootstrapped:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            if self.index.get_meta("bootstrapped") is None:
+                rows = self._legacy_rows()
+                if rows:
+                    print(f"登记已有图片到索引: {len(rows)} 张")
+                    self.index.add_many(rows)
+                self.index.set_meta("bootstrapped", str(time.time()))
+            self._bootstrapped = True
+        # 每个进程启动时收拾已退出进程留下的临时文件（提交要用到索引，放在锁外）
+        self._recover_orphans()
+
+    def _legacy_row(self, filename: str, path: str) -> dict:
+        stat = os.stat(path)
+        dims = image_size(path)
+        return {
+            "filename": filename,
+            "ext": filename.rsplit(".", 1)[1].lower(),
+            "bytes": stat.st_size,
+            "width": dims[0] if dims else None,
+            "height": dims[1] if dims else None,
+            "created_at": stat.st_mtime,
+        }
+
+    def _legacy_rows(self) -> List[dict]:
+        rows = []
+        # 旧版平铺在 root 下的图片
+        for entry in os.scandir(self.root):
+            if entry.is_file() and self._is_plain_name(entry.name) and entry.name.lower().endswith(_IMAGE_EXTS):
+                rows.append(self._legacy_row(entry.name, entry.path))
+        return rows
+
+    # ---- 写入 ----
+
+    def _record(self, stem: str, sha256: str, head: bytes, size: int,
+                dims: Optional[Tuple[int, int]], meta: Optional[dict]) -> dict:
+        ext, mime = sniff_format(head)
+        path = self.blob_path(sha256, ext)
+        row = dict(meta or {})
+        row.update({
+            "filename": f"{stem}_{sha256[:8]}.{ext}",
+            "sha256": sha256,
+            "ext": ext,
+            "bytes": size,
+            "width": dims[0] if dims else None,
+            "height": dims[1] if dims else None,
+            "created_at": time.time(),
+        })
+        return dict(row, path=path, mime=mime, deduplicated=os.path.exists(path))
+
+    def prepare_file(self, tmp_path: str, stem: str, sha256: Optional[str] = None,
+                     meta: Optional[dict] = None) -> dict:
+        """
+        读取临时文件的格式、大小、宽高，算出将要登记的记录，不移动文件也不写索引
+
+        meta 可带 prompt / model / is_4k / downgraded。返回索引记录，
+        外加 "path"（提交后的位置）、"mime"、"deduplicated"
+        """
+        self._ensure_bootstrapped()
+        with open(tmp_path, "rb") as f:
+            head = f.read(16)
+            if sha256 is None:
+                h = hashlib.sha256(head)
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+                sha256 = h.hexdigest()
+        return self._record(stem, sha256, head, os.path.getsize(tmp_path), image_size(tmp_path), meta)
+
+    def commit(self, tmp_path: str, record: dict, fsync: str = WRITE_FSYNC) -> dict:
+        """
+        把写好的临时文件原子地换到内容路径，再登记索引（tmp_path 会被移动或删除）
+
+        fsync：always 在改名前同步文件、改名后同步目录；file 只同步文件；never 交给操作系统。
+        索引在文件完整就位后才写入，按索引找到的文件不会是写了一半的
+        """
+        path = record["path"]
+        deduplicated = os.path.exists(path)
+        try:
+            if deduplicated:
+                os.remove(tmp_path)
+            else:
+                if fsync != "never":
+                    _fsync_path(tmp_path)
+                directory = os.path.dirname(path)
+                os.makedirs(directory, exist_ok=True)
+                os.replace(tmp_path, path)
+                if fsync == "always":
+                    _fsync_path(directory)
+        except FileNotFoundError:
+            # 临时文件已不在但相同内容已经就位：按去重处理
+            if not os.path.exists(path):
+                raise
+            deduplicated = True
+        self.index.add(record)
+        return dict(record, deduplicated=deduplicated)
+
+    # ---- 待提交的写入（见 image_writer）----
+
+    @staticmethod
+    def temp_prefix() -> str:
+        """root 下临时文件的前缀，带上进程号，进程退出后留下的文件才认得出来"""
+        return f"{TEMP_PREFIX}{os.getpid()}-"
+
+    def new_pending_path(self, filename: str) -> str:
+        """
+        为一次排队写入创建独占的临时文件（.pending/<文件名>.<随机后缀>.<pid>）
+
+        同一文件名可能同时有多次写入（相同内容、同一秒、同一提示词），各用各的文件；
+        其他工作进程据此判断图片即将可用
+        """
+        directory = os.path.join(self.root, PENDING_DIR)
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"{filename}.", suffix=f".{os.getpid()}", dir=directory)
+        os.close(fd)
+        return path
+
+    def _recover_pending(self, path: str) -> bool:
+        """
+        提交已退出进程留下的排队写入：响应里已经给出了文件名，只要内容与文件名中的哈希一致就照常提交，
+        否则（改名前就退出，文件是空的）删除。prompt 等元数据随进程丢失，只恢复图片本身
+        """
+        filename = os.path.basename(path).rsplit(".", 2)[0]
+        try:
+            with open(path, "rb") as f:
+                head = f.read(16)
+                h = hashlib.sha256(head)
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+            sha256 = h.hexdigest()
+            ext, _ = sniff_format(head)
+            suffix = f"_{sha256[:8]}.{ext}"
+            if detect_format(head) is None or not filename.endswith(suffix):
+                os.remove(path)
+                return False
+            record = self._record(filename[:-len(suffix)], sha256, head, os.path.getsize(path), image_size(path), None)
+            self.commit(path, record)
+        except FileNotFoundError:
+            # 其他进程刚好先一步收拾了
+            return self.index.get(filename) is not None
+        print(f"  ♻️ 恢复未提交的图片: {filename}")
+        return True
+
+    def _recover_orphans(self):
+        """提交或删除已退出进程留下的 .pending/ 文件，删除其未完成的流式解码临时文件"""
+        pending_dir = os.path.join(self.root, PENDING_DIR)
+        if os.path.isdir(pending_dir):
+            for entry in os.scandir(pending_dir):
+                owner = _pending_owner(entry.name)
+                if owner is not None and owner != os.getpid() and not _pid_alive(owner):
+                    try:
+                        self._recover_pending(entry.path)
+                    except Exception as e:
+                        print(f"  ⚠️ 恢复 {entry.name} 失败: {e}")
+        for entry in os.scandir(self.root):
+            owner = _temp_owner(entry.name)
+            if owner is not None and owner != os.getpid() and not _pid_alive(owner):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _pending_keys(record: dict) -> Tuple[str, str]:
+        return record["filename"], f"{record['sha256']}.{record['ext']}"
+
+    def add_pending(self, record: dict, future: Future):
+        with self._lock:
+            for key in self._pending_keys(record):
+                self._pending.setdefault(key, []).append(future)
+
+    def remove_pending(self, record: dict, future: Future):
+        with self._lock:
+            for key in self._pending_keys(record):
+                futures = self._pending.get(key, [])
+                if future in futures:
+                    futures.remove(future)
+                if not futures:
+                    self._pending.pop(key, None)
+
+    def wait_pending(self, name: str, timeout: float = WRITE_WAIT_TIMEOUT) -> bool:
+        """
+        name（文件名或 <sha256>.<ext>）正在排队写入时等它提交完成
+
+        本进程的写入等全部 Future，其中任一次成功即可；其他工作进程的写入（仅文件名）
+        等 .pending/ 下对应的临时文件消失。没有待提交的写入、写入全部失败或超时都返回 False
+        """
+        with self._lock:
+            futures = list(self._pending.get(name, []))
+        if futures:
+            wait(futures, timeout)
+            return any(f.done() and f.exception() is None for f in futures)
+        if not self._is_plain_name(name):
+            return False
+        pattern = os.path.join(glob.escape(os.path.join(self.root, PENDING_DIR)), glob.escape(name) + ".*")
+        if not glob.glob(pattern):
+            return False
+        deadline = time.time() + timeout
+        while True:
+            paths = glob.glob(pattern)
+            if not paths:
+                return True
+            # 写入它的工作进程已退出：在这里提交
+            orphans = [p for p in paths if not _pid_alive(_pending_owner(p) or os.getpid())]
+            if orphans:
+                return any([self._recover_pending(p) for p in orphans])
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def wait_all_pending(self, timeout: float = WRITE_WAIT_TIMEOUT):
+        """等本进程中已排队的写入全部提交（失败的不算）"""
+        with self._lock:
+            futures = {f for pending in self._pending.values() for f in pending}
+        wait(futures, timeout)
+
+    # ---- 读取 ----
+
+    def resolve(self, filename: str) -> Optional[dict]:
+        """按文件名查找记录（带 path），不存在时返回 None；正在排队写入的等它提交"""
+        self._ensure_bootstrapped()
+        record = self._with_path(self.index.get(filename))
+        if record is None:
+            # 等待后再查一次：刚好在两次查询之间提交完成的写入也能找到
+            self.wait_pending(filename)
+            record = self._with_path(self.index.get(filename))
+        if record:
+            return record if os.path.exists(record["path"]) else None
+
+        # 启动后手动放进目录的旧版文件：按需登记
+        if self._is_plain_name(filename) and filename.lower().endswith(_IMAGE_EXTS):
+            path = os.path.join(self.root, filename)
+            if os.path.isfile(path):
+                row = self._legacy_row(filename, path)
+                self.index.add(row)
+                return dict(row, sha256=None, path=path)
+        return None
+
+    @staticmethod
+    def _is_plain_name(filename: str) -> bool:
+        return bool(filename) and not filename.startswith(".") and "/" not in filename and os.sep not in filename
+
+    def latest(self, limit: int = 10, **filters) -> List[dict]:
+        """最新的 limit 条记录，filters 见 ImageIndex.latest"""
+        self._ensure_bootstrapped()
+        return [self._with_path(r) for r in self.index.latest(limit, **filters)]
+
+    def page(self, limit: int, **kwargs):
+        """分页查询，参数见 ImageIndex.page"""
+        self._ensure_bootstrapped()
+        rows, has_more = self.index.page(limit, **kwargs)
+        return [self._with_path(r) for r in rows], has_more
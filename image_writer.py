@@ -0,0 +1,138 @@
+"""
+后台图片写入 - 把图片收入存储（fsync、改名、登记索引）移出请求路径
+
+- 请求线程只做准备：读文件头定格式和宽高、算出文件名，把临时文件改名为 .pending/<文件名>.<随机后缀>.<pid>
+  （同一文件系统内改名，不复制数据；每次写入独占一个文件），然后放进有界队列即可返回；
+  进程在提交前退出时由 ImageStore 在下次启动时补交
+- WRITE_WORKERS 个写入线程依次提交：按 WRITE_FSYNC 同步、原子改名到内容路径、登记索引、排队生成缩略图
+- 队列满（WRITE_QUEUE_SIZE）时提交方最多等待 WRITE_QUEUE_TIMEOUT 秒，仍无空位则在当前线程直接写入
+- 提交完成前按文件名访问图片会等待这次写入（见 ImageStore.wait_pending）
+- 写入失败删除临时文件、计入 imagegen_image_writes_total{result="error"}，
+  异常通过 submit 返回的 Future 交给调用方
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from image_store import ImageStore
+from metrics import Counter, Histogram, register_collector
+
+WRITE_WORKERS = int(os.environ.get("WRITE_WORKERS", "2"))
+WRITE_QUEUE_SIZE = int(os.environ.get("WRITE_QUEUE_SIZE", "64"))
+WRITE_QUEUE_TIMEOUT = float(os.environ.get("WRITE_QUEUE_TIMEOUT", "5"))
+# 进程正常退出时等待排队写入完成的最长时间
+WRITE_FLUSH_TIMEOUT = float(os.environ.get("WRITE_FLUSH_TIMEOUT", "30"))
+
+WRITES = Counter("imagegen_image_writes_total", "图片写入次数", ("result",))
+WRITE_SECONDS = Histogram("imagegen_image_write_seconds", "图片从入队到提交完成的耗时")
+
+
+class _WriteJob(NamedTuple):
+    path: str                 # .pending/ 下的临时文件
+    record: dict
+    future: Future
+    queued_at: float
+
+
+class ImageWriter:
+    def __init__(self, store: ImageStore, workers: int = WRITE_WORKERS, queue_size: int = WRITE_QUEUE_SIZE,
+                 on_commit: Optional[Callable[[dict], None]] = None):
+        self.store = store
+        self.workers = workers
+        self.on_commit = on_commit
+        self._queue: "queue.Queue[_WriteJob]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        register_collector(self._metrics)
+        # 写入线程是守护线程，退出前把已排队的写完
+        atexit.register(self.flush, WRITE_FLUSH_TIMEOUT)
+
+    def _ensure_started(self):
+        # 首次提交时才启动线程：gunicorn preload 时主进程里启动的线程不会带进 fork 出的工作进程
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"image-writer-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit_file(self, tmp_path: str, stem: str, sha256: Optional[str] = None,
+                    meta: Optional[dict] = None) -> Tuple[dict, Future]:
+        """排队收入一个临时文件，返回 (将要登记的记录, 提交完成时得到最终记录的 Future)"""
+        record = self.store.prepare_file(tmp_path, stem, sha256, meta)
+        pending = self.store.new_pending_path(record["filename"])
+        try:
+            os.replace(tmp_path, pending)
+        except OSError:
+            os.remove(pending)
+            raise
+        return record, self._enqueue(pending, record)
+
+    def _enqueue(self, path: str, record: dict) -> Future:
+        job = _WriteJob(path, record, Future(), time.perf_counter())
+        self.store.add_pending(record, job.future)
+        self._ensure_started()
+        try:
+            self._queue.put(job, timeout=WRITE_QUEUE_TIMEOUT)
+        except queue.Full:
+            print(f"  ⚠️ 写入队列已满，直接写入: {record['filename']}")
+            WRITES.inc("inline")
+            self._write(job)
+        return job.future
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._write(job)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, job: _WriteJob):
+        record = job.record
+        try:
+            record = self.store.commit(job.path, record)
+        except Exception as e:
+            WRITES.inc("error")
+            print(f"  ⚠️ 保存失败 {record['filename']}: {e}")
+            try:
+                os.remove(job.path)
+            except OSError:
+                pass
+            self.store.remove_pending(record, job.future)
+            job.future.set_exception(e)
+            return
+
+        WRITES.inc("ok")
+        WRITE_SECONDS.observe(time.perf_counter() - job.queued_at)
+        print(f"  💾 保存: {record['filename']} -> {record['path']}" + (" (已存在，去重)" if record['deduplicated'] else ""))
+        self.store.remove_pending(record, job.future)
+        job.future.set_result(record)
+        if self.on_commit:
+            try:
+                self.on_commit(record)
+            except Exception as e:
+                print(f"  ⚠️ 保存后处理失败 {record['filename']}: {e}")
+
+    def pending(self) -> int:
+        """排队中和正在写入的任务数"""
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout: float) -> bool:
+        """等已排队的写入全部完成，超时返回 False"""
+        deadline = time.time() + timeout
+        while self.pending() > 0:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _metrics(self):
+        return [
+            ("imagegen_image_write_queue", "gauge", "排队中和正在写入的图片数", [({}, self.pending())]),
+        ]
@@ -0,0 +1,247 @@
+"""
+异步生成任务 - 提交后立即返回任务 ID，生成在后台线程中执行
+
+- 每个任务记录一串按序编号的事件（attempt / downgrade / fallback / completed）
+- SSE 订阅者可以通过 Last-Event-ID 断线续传
+- 已结束的任务保留 JOB_TTL 秒后清理
+- 多进程部署时设置 JOB_SHARED_DIR：任务状态和事件同时追加到共享目录下的日志文件，
+  查询和 SSE 请求落到其他工作进程时从日志读取
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "16"))
+JOB_TTL = float(os.environ.get("JOB_TTL", "3600"))
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "15"))
+JOB_SHARED_DIR = os.environ.get("JOB_SHARED_DIR", "")
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))
+
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+Emit = Callable[[str, dict], None]
+
+
+class Job:
+    def __init__(self, journal_path: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.http_status: Optional[int] = None
+        self._events: List[Tuple[int, str, dict]] = []
+        self._cond = threading.Condition()
+        self.journal_path = journal_path and os.path.join(journal_path, f"{self.id}.jsonl")
+        self._journal({"status": self.status, "at": self.created_at})
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def _journal(self, record: dict):
+        """追加一行到共享日志（调用方持有 self._cond 或尚未发布任务）"""
+        if not self.journal_path:
+            return
+        try:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"写入任务日志失败: {e}")
+
+    def start(self):
+        with self._cond:
+            if self.status != "queued":
+                return
+            self.status = "running"
+            self.started_at = time.time()
+            self._journal({"status": self.status, "at": self.started_at})
+
+    def emit(self, event: str, data: dict):
+        with self._cond:
+            self._events.append((len(self._events) + 1, event, data))
+            self._journal({"seq": len(self._events), "event": event, "data": data})
+            self._cond.notify_all()
+
+    def finish(self, body: dict, http_status: int):
+        with self._cond:
+            self.result = body
+            self.http_status = http_status
+            self.status = "succeeded" if http_status == 200 else "failed"
+            self.finished_at = time.time()
+            self._events.append((len(self._events) + 1, "completed", body))
+            self._journal({"status": self.status, "at": self.finished_at, "http_status": http_status})
+            self._journal({"seq": len(self._events), "event": "completed", "data": body})
+            self._cond.notify_all()
+
+    def events_after(self, last_id: int, timeout: float) -> Tuple[List[Tuple[int, str, dict]], bool]:
+        """返回编号大于 last_id 的事件；没有新事件时最多等待 timeout 秒"""
+        with self._cond:
+            if len(self._events) <= last_id and not self.finished:
+                self._cond.wait(timeout)
+            return self._events[last_id:], self.finished
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": len(self._events),
+            "result": self.result,
+        }
+
+
+class JournalJob:
+    """其他工作进程创建的任务：只读，从共享日志文件还原状态和事件"""
+
+    def __init__(self, job_id: str, path: str):
+        self.id = job_id
+        self.path = path
+        self.status = "queued"
+        self.created_at: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.http_status: Optional[int] = None
+        self._events: List[Tuple[int, str, dict]] = []
+        self._offset = 0
+        self.refresh()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def refresh(self):
+        """读取上次之后新追加的完整行"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            if "seq" in record:
+                self._events.append((record["seq"], record["event"], record["data"]))
+                if record["event"] == "completed":
+                    self.result = record["data"]
+                continue
+            self.status = record["status"]
+            if self.status == "queued":
+                self.created_at = record["at"]
+            elif self.status == "running":
+                self.started_at = record["at"]
+            else:
+                self.finished_at = record["at"]
+                self.http_status = record.get("http_status")
+
+    def events_after(self, last_id: int, timeout: float) -> Tuple[List[Tuple[int, str, dict]], bool]:
+        deadline = time.time() + timeout
+        while len(self._events) <= last_id and not self.finished and time.time() < deadline:
+            time.sleep(min(JOB_POLL_INTERVAL, max(0.0, deadline - time.time())))
+            self.refresh()
+        return self._events[last_id:], self.finished
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": len(self._events),
+            "result": self.result,
+        }
+
+
+class JobStore:
+    def __init__(self, workers: int = JOB_WORKERS, ttl: float = JOB_TTL, shared_dir: str = JOB_SHARED_DIR):
+        self.ttl = ttl
+        self.shared_dir = shared_dir
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def submit(self, fn: Callable[[Emit], Tuple[dict, int]]) -> Job:
+        """提交任务；fn(emit) 在后台执行并返回 (响应体, 状态码)"""
+        job = self.create()
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def create(self) -> Job:
+        """登记一个由调用方自己推进（start / emit / finish）的任务，不占任务线程"""
+        self._cleanup()
+        job = Job(self.shared_dir or None)
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str):
+        """本进程的任务返回 Job；其他工作进程的任务（共享目录中有日志时）返回只读的 JournalJob"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or not self.shared_dir or not JOB_ID.match(job_id):
+            return job
+        path = os.path.join(self.shared_dir, f"{job_id}.jsonl")
+        return JournalJob(job_id, path) if os.path.exists(path) else None
+
+    def active(self) -> int:
+        """本进程中排队或执行中的任务数"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _run(self, job: Job, fn: Callable[[Emit], Tuple[dict, int]]):
+        job.start()
+        try:
+            body, http_status = fn(job.emit)
+        except Exception as e:
+            print(f"任务 {job.id} 执行失败: {e}")
+            body, http_status = {"code": 500, "msg": str(e)}, 500
+        job.finish(body, http_status)
+
+    def _cleanup(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [jid for jid, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for jid in expired:
+                del self._jobs[jid]
+        if self.shared_dir:
+            # 日志按修改时间清理，也覆盖已退出的工作进程留下的文件
+            for name in os.listdir(self.shared_dir):
+                path = os.path.join(self.shared_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+def sse_stream(job: Job, last_id: int = 0, heartbeat: float = SSE_HEARTBEAT) -> Iterator[str]:
+    """把任务事件编码成 text/event-stream，任务结束且事件发完后关闭"""
+    yield "retry: 3000\n\n"
+    while True:
+        events, finished = job.events_after(last_id, heartbeat)
+        if not events:
+            if finished:
+                return
+            yield ": keep-alive\n\n"
+            continue
+        for seq, event, data in events:
+            last_id = seq
+            yield f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+job_store = JobStore()
@@ -0,0 +1,292 @@
+"""
+Prometheus 指标 - 不依赖 prometheus_client 的最小实现，由 /metrics 以文本格式输出
+
+- Counter / Gauge / Histogram，标签值按位置传入（顺序与 labelnames 一致）
+- 每次记录只是一次加锁的字典更新，热路径上开销可以忽略
+- register_collector 注册在抓取时才计算的指标（例如队列长度）
+- 多进程（gunicorn 多个工作进程）时设置 METRICS_SHARED_DIR：每个工作进程每 METRICS_FLUSH_INTERVAL 秒
+  把自己的数值写到 <目录>/<pid>.json，/metrics 汇总目录下所有进程的数值后输出，
+  无论落到哪个工作进程，计数器都单调递增。思路同 prometheus_client 的 multiprocess 模式：
+  - counter / histogram 按标签求和，已退出的工作进程（mark_process_dead 改名为 dead-*.json）的数值保留
+  - gauge 和 collector 的结果只汇总存活的工作进程，同样求和（在途数、排队数、容量都是各进程之和）
+  - 其他工作进程的数值最多滞后 METRICS_FLUSH_INTERVAL 秒
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+SHARED_DIR = os.environ.get("METRICS_SHARED_DIR", "")
+FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KB ... 256 MB
+DEPTH_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10)
+
+# 抓取时调用，返回 [(名称, 类型, 说明, [(标签字典, 值), ...]), ...]
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+_registry: List["_Metric"] = []
+_collectors: List[Collector] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def items(self) -> List[tuple]:
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self) -> List[str]:
+        return _render(self.name, self.kind, self.help, self.labelnames, self.items())
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    @contextmanager
+    def track(self, *labels: str):
+        """在 with 块执行期间 +1"""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 → [各桶计数..., 总和, 总数]
+        self._values: Dict[tuple, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def items(self) -> List[tuple]:
+        with self._lock:
+            return [(k, list(v)) for k, v in self._values.items()]
+
+    def render(self) -> List[str]:
+        return _render(self.name, self.kind, self.help, self.labelnames, self.items(), self.buckets)
+
+
+def register_collector(collector: Collector):
+    _collectors.append(collector)
+
+
+def _render(name: str, kind: str, help: str, labelnames: Sequence[str], items: Iterable[tuple],
+            buckets: Sequence[float] = ()) -> List[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in items:
+        if kind != "histogram":
+            lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+            continue
+        cumulative = 0
+        for bound, count in zip(buckets, value):
+            cumulative += count
+            le = 'le="%s"' % _number(bound)
+            lines.append(f"{name}_bucket{_labels(labelnames, labels, le)} {_number(cumulative)}")
+        inf = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_labels(labelnames, labels, inf)} {_number(value[-1])}")
+        lines.append(f"{name}_sum{_labels(labelnames, labels)} {_number(value[-2])}")
+        lines.append(f"{name}_count{_labels(labelnames, labels)} {_number(value[-1])}")
+    return lines
+
+
+def _collect() -> List[tuple]:
+    """collector 的结果，统一成 (名称, 类型, 说明, 标签名, [(标签值, 值), ...])"""
+    result = []
+    for collector in _collectors:
+        for name, kind, help, samples in collector():
+            labelnames = tuple(samples[0][0]) if samples else ()
+            result.append((name, kind, help, labelnames, [(tuple(labels.values()), value) for labels, value in samples]))
+    return result
+
+
+def render() -> str:
+    """所有指标的 Prometheus 文本格式"""
+    if SHARED_DIR:
+        return _render_shared()
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for name, kind, help, labelnames, samples in _collect():
+        lines.extend(_render(name, kind, help, labelnames, samples))
+    return "\n".join(lines) + "\n"
+
+
+# ---- 多进程汇总 ----
+
+def _snapshot() -> dict:
+    metrics = []
+    for metric in _registry:
+        metrics.append({
+            "name": metric.name, "kind": metric.kind, "help": metric.help,
+            "labelnames": list(metric.labelnames), "buckets": list(getattr(metric, "buckets", ())),
+            "values": [[list(labels), value] for labels, value in metric.items()],
+        })
+    for name, kind, help, labelnames, samples in _collect():
+        metrics.append({
+            "name": name, "kind": kind, "help": help, "labelnames": list(labelnames), "buckets": [],
+            "values": [[list(labels), value] for labels, value in samples], "collected": True,
+        })
+    return {"pid": os.getpid(), "metrics": metrics}
+
+
+def _write_json(path: str, data: dict):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def write_snapshot():
+    """把本进程的数值写到共享目录"""
+    if not SHARED_DIR:
+        return
+    try:
+        os.makedirs(SHARED_DIR, exist_ok=True)
+        _write_json(os.path.join(SHARED_DIR, f"{os.getpid()}.json"), _snapshot())
+    except OSError as e:
+        print(f"  ⚠️ 写入指标快照失败: {e}")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        write_snapshot()
+
+
+_flusher: Optional[threading.Thread] = None
+
+
+def start_shared():
+    """在工作进程中启动定期写快照的线程（gunicorn post_fork 时调用）"""
+    global _flusher
+    if not SHARED_DIR or _flusher is not None:
+        return
+    write_snapshot()
+    _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+    _flusher.start()
+    atexit.register(write_snapshot)
+
+
+def clear_shared():
+    """清掉上次运行留下的快照（主进程启动时调用，计数器随服务重启归零）"""
+    for path in glob.glob(os.path.join(SHARED_DIR, "*.json")):
+        os.remove(path)
+
+
+def mark_process_dead(pid: int):
+    """工作进程退出后：保留其 counter / histogram，丢弃 gauge，腾出 <pid>.json 以免 pid 复用时覆盖"""
+    path = os.path.join(SHARED_DIR, f"{pid}.json")
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    data["metrics"] = [m for m in data["metrics"] if m["kind"] in ("counter", "histogram") and not m.get("collected")]
+    _write_json(os.path.join(SHARED_DIR, f"dead-{pid}-{int(time.time() * 1000)}.json"), data)
+    os.remove(path)
+
+
+def _render_shared() -> str:
+    write_snapshot()
+    merged: Dict[str, dict] = {}
+    for path in sorted(glob.glob(os.path.join(SHARED_DIR, "*.json")), key=lambda p: not p.endswith(f"/{os.getpid()}.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = not os.path.basename(path).startswith("dead-")
+        for metric in data["metrics"]:
+            if metric["kind"] not in ("counter", "histogram") and not alive:
+                continue
+            entry = merged.setdefault(metric["name"], dict(metric, values={}))
+            values = entry["values"]
+            for labels, value in metric["values"]:
+                key = tuple(labels)
+                if isinstance(value, list):
+                    total = values.setdefault(key, [0] * len(value))
+                    for i, v in enumerate(value):
+                        total[i] += v
+                else:
+                    values[key] = values.get(key, 0) + value
+    lines: List[str] = []
+    for m in merged.values():
+        lines.extend(_render(m["name"], m["kind"], m["help"], m["labelnames"], m["values"].items(), m["buckets"]))
+    return "\n".join(lines) + "\n"
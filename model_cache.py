@@ -0,0 +1,111 @@
+"""
+模型列表缓存 - 按 API Key 哈希缓存 /v1/models 的结果
+
+- TTL 内直接返回缓存
+- 过期但仍在 stale 窗口内：先返回旧数据，后台刷新（stale-while-revalidate）
+- 同一个 Key 的并发请求只触发一次上游请求（single-flight）
+- 模型返回"无可用渠道"时可显式失效
+- label()：指标标签、记分板键只用上游列出过的模型 id，客户端传来的其他名字归为 other，序列数有上限
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import Counter
+from singleflight import SingleFlight
+
+MODEL_CACHE_TTL = float(os.environ.get("MODEL_CACHE_TTL", "300"))
+MODEL_CACHE_STALE = float(os.environ.get("MODEL_CACHE_STALE", "1800"))
+
+OTHER_MODEL = "other"
+
+LOOKUPS = Counter("imagegen_model_cache_lookups_total", "模型列表缓存查询次数", ("result",))
+
+
+def key_hash(api_key: str) -> str:
+    """API Key 只以哈希形式出现在内存结构里"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class ModelListCache:
+    def __init__(self, ttl: float = MODEL_CACHE_TTL, stale: float = MODEL_CACHE_STALE):
+        self.ttl = ttl
+        self.stale = stale
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[List[dict], float]] = {}
+        self._refreshing = set()
+        self._flight = SingleFlight()
+        # 任一 Key 的模型列表里出现过的 id（失效、清空缓存后仍保留）
+        self._known = set()
+
+    def get(self, api_key: str, loader: Callable[[str], List[dict]]) -> List[dict]:
+        """
+        获取模型列表；loader(api_key) 负责真正请求上游，失败时应抛出异常。
+        没有可用缓存且 loader 失败时异常会向上抛出。
+        """
+        h = key_hash(api_key)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(h)
+
+        if entry is not None:
+            models, fetched_at = entry
+            age = now - fetched_at
+            if age < self.ttl:
+                LOOKUPS.inc("fresh")
+                return models
+            if age < self.ttl + self.stale:
+                LOOKUPS.inc("stale")
+                self._refresh_in_background(h, api_key, loader)
+                return models
+
+        LOOKUPS.inc("miss")
+        try:
+            return self._load(h, api_key, loader)
+        except Exception:
+            # 上游失败但还有过期数据时，宁可返回旧列表
+            if entry is not None:
+                return entry[0]
+            raise
+
+    def invalidate(self, api_key: str):
+        with self._lock:
+            self._entries.pop(key_hash(api_key), None)
+
+    def label(self, model: Optional[str]) -> str:
+        """上游列出过的模型原样返回，其余（客户端随意填写的名字）返回 OTHER_MODEL"""
+        with self._lock:
+            return model if model in self._known else OTHER_MODEL
+
+    def _load(self, h: str, api_key: str, loader: Callable[[str], List[dict]]) -> List[dict]:
+        def fetch():
+            models = loader(api_key)
+            with self._lock:
+                self._entries[h] = (models, time.monotonic())
+                self._known.update(m["id"] for m in models if m.get("id"))
+            return models
+
+        return self._flight.do(h, fetch)
+
+    def _refresh_in_background(self, h: str, api_key: str, loader: Callable[[str], List[dict]]):
+        with self._lock:
+            if h in self._refreshing:
+                return
+            self._refreshing.add(h)
+
+        def run():
+            try:
+                self._load(h, api_key, loader)
+            except Exception as e:
+                print(f"后台刷新模型列表失败: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(h)
+
+        threading.Thread(target=run, name="model-cache-refresh", daemon=True).start()
+
+
+model_cache = ModelListCache()
@@ -0,0 +1,109 @@
+"""
+竞速模式 - 并发/对冲地尝试多个候选模型，返回第一个有效结果
+
+- width: 同时在途的最大请求数
+- hedge_delay: 0 表示一开始就并发发出 width 个请求；
+  大于 0 表示先发一个，每隔 hedge_delay 秒仍无结果就再补发一个（对冲请求）
+- 某个请求失败时立刻补上下一个候选模型
+- 每个请求都先从 limiter（scheduler 的公平调度）拿名额，同一 API Key 的并发上限即 SCHED_MAX_PER_KEY
+"""
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, List, Optional, Tuple
+
+from scheduler import BoundLimiter
+
+RACE_WIDTH = int(os.environ.get("RACE_WIDTH", "2"))
+RACE_HEDGE_DELAY = float(os.environ.get("RACE_HEDGE_DELAY", "0"))
+RACE_POOL_SIZE = int(os.environ.get("RACE_POOL_SIZE", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=RACE_POOL_SIZE, thread_name_prefix="race")
+
+
+def _discard(fut, on_discard: Callable[[dict], None]):
+    try:
+        result = fut.result()
+        if result.get("ok"):
+            on_discard(result)
+    except Exception:
+        pass
+
+
+def race_models(
+    models: List[str],
+    attempt: Callable[[str, threading.Event], dict],
+    limit_key: str,
+    limiter: BoundLimiter,
+    width: int = RACE_WIDTH,
+    hedge_delay: float = RACE_HEDGE_DELAY,
+    on_discard: Optional[Callable[[dict], None]] = None,
+) -> Tuple[Optional[dict], List[str], Optional[str]]:
+    """
+    竞速尝试 models。attempt(model, cancel) 返回 {"ok": bool, "error": str, ...}，
+    cancel 被置位后 attempt 应尽快放弃（例如不再做降级重试）。
+    胜出者之外、稍后也成功了的结果会交给 on_discard 清理。
+
+    返回 (第一个成功的结果 或 None, 已发出的模型列表, 最后一个错误)
+    """
+    width = max(1, width)
+    pending = deque(models)
+    running = {}
+    tried: List[str] = []
+    last_error: Optional[str] = None
+    cancel = threading.Event()
+
+    def run(model: str) -> dict:
+        try:
+            return attempt(model, cancel)
+        finally:
+            limiter.release(limit_key)
+
+    def launch(blocking: bool) -> bool:
+        if not pending or len(running) >= width:
+            return False
+        if not limiter.acquire(limit_key, blocking):
+            return False
+        model = pending.popleft()
+        tried.append(model)
+        print(f"\n[竞速] 发出 {model} (在途: {len(running) + 1}/{width})")
+        running[_executor.submit(run, model)] = model
+        return True
+
+    launch(blocking=True)
+    if hedge_delay <= 0:
+        while launch(blocking=False):
+            pass
+
+    while running:
+        timeout = hedge_delay if hedge_delay > 0 and pending and len(running) < width else None
+        done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            # 对冲计时到点，仍无结果：再补发一个
+            launch(blocking=False)
+            continue
+
+        for fut in done:
+            model = running.pop(fut)
+            try:
+                result = fut.result()
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            if result.get("ok"):
+                cancel.set()
+                if running:
+                    print(f"  [竞速] {model} 胜出，忽略其余 {len(running)} 个请求")
+                if on_discard is not None:
+                    for other in list(done) + list(running):
+                        if other is not fut:
+                            other.add_done_callback(lambda f: _discard(f, on_discard))
+                return result, tried, last_error
+            last_error = result.get("error") or last_error
+
+        # 失败的位置立刻由下一个候选补上
+        while launch(blocking=not running):
+            pass
+
+    return None, tried, last_error
@@ -0,0 +1,248 @@
+"""
+参考图预处理 - 发给上游之前解码、缩小并重新编码参考图
+
+- 最长边按模型限制：REF_MAX_EDGE，REF_MAX_EDGE_BY_MODEL（JSON，模型名前缀 → 最长边）可覆盖
+- 重新编码为 REF_FORMAT（默认 JPEG）/ REF_QUALITY；先按 EXIF 方向摆正，输出不带 EXIF 等元数据
+- 不需要缩小且重新编码后反而更大时保留原图内容，但同样去掉元数据：JPEG 直接删掉 APP1（EXIF/XMP）、
+  APP13（IPTC）和注释段，PNG 无损重存；EXIF 方向不是 1 时原图要靠 EXIF 摆正，改用重新编码的结果
+- data URI 的 MIME 按实际格式填写，不再一律标成 PNG
+- 解码/缩放在进程池中进行（gevent 工作进程中为线程池，见 cpu_pool）；同一张图在同一限制下只处理一次（内存 LRU）
+- 依赖 Pillow；未安装时原样转发，只修正 MIME
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Dict, List, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 是可选依赖
+    Image = None
+
+from cpu_pool import create_executor
+from image_meta import sniff_format
+from metrics import Counter
+from singleflight import SingleFlight
+
+REF_MAX_EDGE = int(os.environ.get("REF_MAX_EDGE", "2048"))
+REF_MAX_EDGE_BY_MODEL: Dict[str, int] = json.loads(os.environ.get("REF_MAX_EDGE_BY_MODEL", "{}"))
+REF_FORMAT = os.environ.get("REF_FORMAT", "JPEG").upper()
+REF_QUALITY = int(os.environ.get("REF_QUALITY", "85"))
+REF_WORKERS = int(os.environ.get("REF_WORKERS", str(min(4, os.cpu_count() or 1))))
+REF_CACHE_BYTES = int(os.environ.get("REF_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+CACHE_LOOKUPS = Counter("imagegen_reference_cache_lookups_total", "参考图预处理缓存查询次数", ("result",))
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def max_edge_for(model: str) -> int:
+    """模型的参考图最长边限制（取最长匹配前缀）"""
+    best, edge = -1, REF_MAX_EDGE
+    for prefix, limit in REF_MAX_EDGE_BY_MODEL.items():
+        if model.startswith(prefix) and len(prefix) > best:
+            best, edge = len(prefix), int(limit)
+    return edge
+
+
+def decode_reference(data: str) -> bytes:
+    """解码客户端传来的参考图（纯 Base64 或 data URI），无效时抛出 ValueError"""
+    if data.startswith("data:"):
+        data = data.split(",", 1)[1] if "," in data else ""
+    raw = base64.b64decode(data, validate=False)
+    if not raw:
+        raise ValueError("参考图片为空")
+    return raw
+
+
+def to_data_uri(data: bytes) -> str:
+    mime = sniff_format(data[:16])[1]
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+# 去掉的 JPEG 段：APP1（EXIF / XMP）、APP13（IPTC / Photoshop）、COM
+_JPEG_METADATA_MARKERS = {0xE1, 0xED, 0xFE}
+# Pillow 读出的 PNG 信息里不算元数据的键（颜色、透明、分辨率），其余是文本块、EXIF 等
+_PNG_SAFE_INFO = {"dpi", "gamma", "transparency", "icc_profile", "srgb", "chromaticity", "aspect"}
+# 其他格式的元数据键
+_METADATA_INFO = {"exif", "xmp", "comment", "photoshop", "iptc"}
+
+
+def _strip_jpeg(data: bytes) -> bytes:
+    """逐段复制 JPEG 文件头，跳过元数据段；图像数据（SOS 之后）原样保留"""
+    out = [data[:2]]
+    i = 2
+    while i + 4 <= len(data) and data[i] == 0xFF:
+        marker = data[i + 1]
+        if marker == 0xFF:  # 填充字节
+            i += 1
+            continue
+        if marker == 0xDA:  # SOS：之后是压缩数据
+            break
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        if marker not in _JPEG_METADATA_MARKERS:
+            out.append(data[i:i + 2 + length])
+        i += 2 + length
+    out.append(data[i:])
+    return b"".join(out)
+
+
+def _has_metadata(img) -> bool:
+    if img.format == "PNG":
+        return bool(set(img.info) - _PNG_SAFE_INFO)
+    return bool(set(img.info) & _METADATA_INFO)
+
+
+def _resave_png(img) -> bytes:
+    """无损重存 PNG，只带颜色、透明和分辨率信息"""
+    params = {k: img.info[k] for k in ("transparency", "icc_profile", "dpi") if k in img.info}
+    out = io.BytesIO()
+    img.save(out, "PNG", optimize=True, **params)
+    return out.getvalue()
+
+
+def _shrink(data: bytes, max_edge: int, fmt: str, quality: int) -> Optional[bytes]:
+    """在子进程中执行：返回处理后的图片，原图可以原样发送时返回 None"""
+    with Image.open(io.BytesIO(data)) as original:
+        upright = original.getexif().get(0x0112, 1) == 1
+        img = ImageOps.exif_transpose(original)
+        resized = max(img.size) > max_edge
+        if resized:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if img.mode in ("P", "PA", "LA", "RGBA"):
+            img = img.convert("RGBA")
+        if img.mode == "RGBA" and fmt == "JPEG":
+            # JPEG 没有透明通道，铺白底
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode not in ("RGB", "L", "RGBA"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, fmt, quality=quality, optimize=True)
+        encoded = out.getvalue()
+        if not resized and upright and len(encoded) >= len(data):
+            # 保留原图内容，只去掉元数据；其他格式带元数据时仍发送重新编码的结果
+            if original.format == "JPEG":
+                stripped = _strip_jpeg(data)
+                return stripped if stripped != data else None
+            if not _has_metadata(original):
+                return None
+            if original.format == "PNG":
+                return _resave_png(original)
+    return encoded
+
+
+class ReferencePreparer:
+    def __init__(self, workers: int = REF_WORKERS, cache_bytes: int = REF_CACHE_BYTES,
+                 fmt: str = REF_FORMAT, quality: int = REF_QUALITY):
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self.fmt = fmt
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._pool: Optional[Executor] = None
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+
+    def _executor(self) -> Executor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = create_executor(self.workers)
+            return self._pool
+
+    def _cache_get(self, key: tuple) -> Optional[bytes]:
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+            return data
+
+    def _cache_put(self, key: tuple, data: bytes):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = data
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_bytes and self._cache:
+                _, old = self._cache.popitem(last=False)
+                self._cached_bytes -= len(old)
+
+    def prepare(self, images: List[bytes], max_edge: int) -> List[bytes]:
+        """并行处理一组参考图，返回要发送的图片数据（顺序不变）"""
+        results: List[Optional[bytes]] = [None] * len(images)
+        keys = [(hashlib.sha256(raw).hexdigest(), max_edge, self.fmt, self.quality) for raw in images]
+        futures = {}
+        for i, (raw, key) in enumerate(zip(images, keys)):
+            results[i] = self._cache_get(key)
+            CACHE_LOOKUPS.inc("hit" if results[i] is not None else "miss")
+            if results[i] is None and available():
+                futures[i] = self._executor().submit(_shrink, raw, max_edge, self.fmt, self.quality)
+
+        for i, future in futures.items():
+            try:
+                results[i] = future.result() or images[i]
+            except Exception as e:
+                print(f"  ⚠️ 参考图预处理失败，按原图发送: {e}")
+                results[i] = images[i]
+            self._cache_put(keys[i], results[i])
+
+        return [data if data is not None else raw for data, raw in zip(results, images)]
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+
+reference_preparer = ReferencePreparer()
+
+
+class ReferenceSet:
+    """一次请求的参考图；按模型的最长边限制各处理一次，多个模型/竞速请求共享结果"""
+
+    def __init__(self, images: List[bytes], preparer: ReferencePreparer = reference_preparer):
+        self.raw = images
+        self.preparer = preparer
+        self._flight = SingleFlight()
+        self._prepared: Dict[int, List[bytes]] = {}
+        self._digests: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def digests(self) -> List[str]:
+        """各参考图原始字节的 sha256（请求指纹用）"""
+        if self._digests is None:
+            self._digests = [hashlib.sha256(raw).hexdigest() for raw in self.raw]
+        return self._digests
+
+    def _prepared_for(self, model: str) -> List[bytes]:
+        edge = max_edge_for(model)
+        prepared = self._prepared.get(edge)
+        if prepared is None:
+            prepared = self._flight.do(edge, lambda: self.preparer.prepare(self.raw, edge))
+            self._prepared[edge] = prepared
+        return prepared
+
+    def for_model(self, model: str) -> List[str]:
+        """发给该模型的 data URI 列表"""
+        return [to_data_uri(data) for data in self._prepared_for(model)]
+
+    def stats(self, model: str) -> dict:
+        original = sum(len(raw) for raw in self.raw)
+        sent = sum(len(data) for data in self._prepared_for(model))
+        return {
+            "count": len(self.raw),
+            "original_bytes": original,
+            "sent_bytes": sent,
+            "saved_bytes": original - sent,
+        }
@@ -0,0 +1,91 @@
+"""
+生成结果缓存 - 完全相同的请求（参考图、提示词、参数、模型选择）直接复用上次的结果
+
+- 以构建好的请求内容的指纹为键，值是上次成功的响应体（引用图片存储里的文件名）
+- 图片本身已按内容哈希存放在 ImageStore 中，缓存只记录引用，不再复制一份
+- 条目数和存活时间有上限，超出时按最近使用时间（LRU）淘汰
+- 默认关闭，设置 RESULT_CACHE=1 开启
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE", "0") == "1"
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1000"))
+RESULT_CACHE_MAX_AGE = float(os.environ.get("RESULT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+RESULT_CACHE_DB = "results.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    fingerprint TEXT PRIMARY KEY,
+    body        TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    last_used   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_last_used ON results (last_used);
+"""
+
+
+class ResultCache:
+    def __init__(self, db_path: str, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 max_age: float = RESULT_CACHE_MAX_AGE, enabled: bool = RESULT_CACHE_ENABLED):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.enabled = enabled
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def get(self, fingerprint: str) -> Optional[dict]:
+        """命中返回缓存的响应体并刷新最近使用时间，过期或不存在返回 None"""
+        conn = self._conn()
+        row = conn.execute("SELECT body, created_at FROM results WHERE fingerprint = ?",
+                           (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.max_age:
+            self.remove(fingerprint)
+            return None
+        conn.execute("UPDATE results SET last_used = ? WHERE fingerprint = ?", (now, fingerprint))
+        return json.loads(row[0])
+
+    def put(self, fingerprint: str, body: dict):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO results (fingerprint, body, created_at, last_used) VALUES (?, ?, ?, ?)",
+            (fingerprint, json.dumps(body, ensure_ascii=False), now, now),
+        )
+        self.evict()
+
+    def remove(self, fingerprint: str):
+        self._conn().execute("DELETE FROM results WHERE fingerprint = ?", (fingerprint,))
+
+    def evict(self):
+        """删除过期条目，再按最近使用时间淘汰超出上限的部分"""
+        conn = self._conn()
+        conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.max_age,))
+        conn.execute(
+            "DELETE FROM results WHERE fingerprint IN ("
+            "SELECT fingerprint FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
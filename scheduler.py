@@ -0,0 +1,214 @@
+"""
+上游调用调度 - 所有 API Key 共享有限的上游并发名额，按 Key 公平排队
+
+- SCHED_CAPACITY：同时在途的上游生成请求总数
+- SCHED_MAX_PER_KEY：单个 Key 同时在途的请求数上限，一个 Key 占不满所有名额
+- 交互请求（INTERACTIVE）优先于批量任务（BATCH）
+- 同一优先级内，先给在途请求最少的 Key，再给最久没被服务的 Key（轮转），
+  同一 Key 内先来先服务
+- 排队时通过 on_wait 回调报告排队位置，拿到名额时报告等待时间
+"""
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+SCHED_CAPACITY = int(os.environ.get("SCHED_CAPACITY", "16"))
+SCHED_MAX_PER_KEY = int(os.environ.get("SCHED_MAX_PER_KEY", "3"))
+SCHED_MAX_WAIT = float(os.environ.get("SCHED_MAX_WAIT", "900"))
+SCHED_POSITION_INTERVAL = float(os.environ.get("SCHED_POSITION_INTERVAL", "5"))
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+OnWait = Callable[[str, dict], None]
+
+
+def _no_wait(event: str, data: dict):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("key", "priority", "seq", "enqueued_at", "granted", "event")
+
+    def __init__(self, key: str, priority: int, seq: int):
+        self.key = key
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.time()
+        self.granted = False
+        self.event = threading.Event()
+
+
+class FairScheduler:
+    def __init__(self, capacity: int = SCHED_CAPACITY, max_per_key: int = SCHED_MAX_PER_KEY,
+                 max_wait: float = SCHED_MAX_WAIT):
+        self.capacity = capacity
+        self.max_per_key = max_per_key
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queues: Dict[Tuple[str, int], Deque[_Waiter]] = {}
+        self._running: Dict[str, int] = {}
+        self._total = 0
+        self._last_served: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._ticks = itertools.count(1)
+        # 每个优先级的等待统计：次数、总等待秒数、最长等待秒数、超时次数
+        self._waits = {p: {"count": 0, "total": 0.0, "max": 0.0, "timeouts": 0} for p in PRIORITY_NAMES}
+
+    # ---- 内部（调用方持有 self._lock） ----
+
+    def _grant(self, key: str):
+        self._running[key] = self._running.get(key, 0) + 1
+        self._total += 1
+        self._last_served[key] = next(self._ticks)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        best, best_rank = None, None
+        for (key, priority), queue in self._queues.items():
+            if self._running.get(key, 0) >= self.max_per_key:
+                continue
+            rank = (priority, self._running.get(key, 0), self._last_served.get(key, 0), queue[0].seq)
+            if best_rank is None or rank < best_rank:
+                best, best_rank = (key, priority), rank
+        if best is None:
+            return None
+        return self._dequeue(best, self._queues[best][0])
+
+    def _dequeue(self, queue_key: Tuple[str, int], waiter: _Waiter) -> _Waiter:
+        queue = self._queues[queue_key]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[queue_key]
+        return waiter
+
+    def _dispatch(self):
+        while self._total < self.capacity:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._grant(waiter.key)
+            waiter.granted = True
+            waiter.event.set()
+
+    def _position(self, waiter: _Waiter) -> int:
+        """估算排队位置：优先级更高、或同优先级更早排队的请求都排在前面"""
+        ahead = 0
+        for (_, priority), queue in self._queues.items():
+            for other in queue:
+                if (other.priority, other.seq) < (waiter.priority, waiter.seq):
+                    ahead += 1
+        return ahead + 1
+
+    def _record_wait(self, priority: int, waited: float, timed_out: bool = False):
+        stats = self._waits[priority]
+        if timed_out:
+            stats["timeouts"] += 1
+            return
+        stats["count"] += 1
+        stats["total"] += waited
+        stats["max"] = max(stats["max"], waited)
+
+    # ---- 对外接口 ----
+
+    def acquire(self, key: str, priority: int = INTERACTIVE, blocking: bool = True,
+                on_wait: OnWait = _no_wait) -> bool:
+        """
+        获取一个上游名额。blocking=False 时只在无需排队时拿名额（用于竞速模式的对冲请求）
+
+        排队时调用 on_wait("queued", {"position", "queued"})，位置变化时再次调用；
+        排队后拿到名额时调用 on_wait("dispatched", {"wait_ms"})。等待超过 max_wait 返回 False
+        """
+        with self._lock:
+            # 先排进队列再分配，和已在排队的请求按同样的规则竞争
+            waiter = _Waiter(key, priority, next(self._seq))
+            self._queues.setdefault((key, priority), deque()).append(waiter)
+            self._dispatch()
+            if waiter.granted:
+                self._record_wait(priority, 0.0)
+                return True
+            if not blocking:
+                self._dequeue((key, priority), waiter)
+                return False
+            position = self._position(waiter)
+            queued = sum(len(q) for q in self._queues.values())
+
+        on_wait("queued", {"position": position, "queued": queued, "priority": PRIORITY_NAMES[priority]})
+        deadline = waiter.enqueued_at + self.max_wait
+        while not waiter.event.wait(min(SCHED_POSITION_INTERVAL, max(0.0, deadline - time.time()))):
+            with self._lock:
+                if waiter.granted:
+                    break
+                if time.time() >= deadline:
+                    self._dequeue((key, priority), waiter)
+                    self._record_wait(priority, 0.0, timed_out=True)
+                    return False
+                new_position = self._position(waiter)
+            if new_position != position:
+                position = new_position
+                on_wait("queued", {"position": position, "priority": PRIORITY_NAMES[priority]})
+
+        waited = time.time() - waiter.enqueued_at
+        with self._lock:
+            self._record_wait(priority, waited)
+        on_wait("dispatched", {"wait_ms": round(waited * 1000)})
+        return True
+
+    def release(self, key: str):
+        with self._lock:
+            self._running[key] -= 1
+            if not self._running[key]:
+                del self._running[key]
+            self._total -= 1
+            self._dispatch()
+
+    def limiter(self, priority: int = INTERACTIVE, on_wait: OnWait = _no_wait) -> "BoundLimiter":
+        """绑定优先级和回调，提供 race / 逐个尝试所用的 acquire / release 接口"""
+        return BoundLimiter(self, priority, on_wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            keys = set(self._running) | {key for key, _ in self._queues}
+            per_key = {
+                key[:12]: {
+                    "running": self._running.get(key, 0),
+                    "queued": sum(len(q) for (k, _), q in self._queues.items() if k == key),
+                }
+                for key in keys
+            }
+            waits = {
+                PRIORITY_NAMES[p]: {
+                    "count": s["count"],
+                    "avg_ms": round(s["total"] / s["count"] * 1000) if s["count"] else 0,
+                    "max_ms": round(s["max"] * 1000),
+                    "timeouts": s["timeouts"],
+                }
+                for p, s in self._waits.items()
+            }
+            return {
+                "capacity": self.capacity,
+                "max_per_key": self.max_per_key,
+                "running": self._total,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "keys": per_key,
+                "waits": waits,
+            }
+
+
+class BoundLimiter:
+    def __init__(self, scheduler: FairScheduler, priority: int, on_wait: OnWait):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.on_wait = on_wait
+
+    def acquire(self, key: str, blocking: bool = True) -> bool:
+        return self.scheduler.acquire(key, self.priority, blocking, self.on_wait)
+
+    def release(self, key: str):
+        self.scheduler.release(key)
+
+
+scheduler = FairScheduler()
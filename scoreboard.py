@@ -0,0 +1,200 @@
+"""
+模型记分板 - 按实际表现给候选模型排序，持续失败的模型暂时排到最后
+
+每个模型记录：
+- 成功/失败请求耗时的 EWMA
+- 成功率、降级率的 EWMA
+- 最近的 503 无可用渠道次数、连续失败次数
+
+排序依据是预计出图时间：(p·成功耗时 + (1-p)·失败耗时) / p，p 为成功率；
+没有数据的模型按 SCOREBOARD_PRIOR_SECONDS 估计，并保持原有顺序。
+
+熔断：连续失败 SCOREBOARD_FAILURES_TO_OPEN 次，或返回 503 无可用渠道时打开，
+冷却 SCOREBOARD_COOLDOWN 秒后放行一次试探；试探失败则冷却时间翻倍（最长 SCOREBOARD_MAX_COOLDOWN）。
+熔断中的模型排在所有正常模型之后，不会被移出候选列表。
+
+数据定期写入 JSON 文件，重启后继续使用。
+键由调用方经 model_cache.label() 限定为上游列出过的模型 id（其余归为 other），文件不会随客户端输入无限增长。
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+SCOREBOARD_FILE = "scoreboard.json"
+SCOREBOARD_ALPHA = float(os.environ.get("SCOREBOARD_ALPHA", "0.2"))
+SCOREBOARD_PRIOR_SECONDS = float(os.environ.get("SCOREBOARD_PRIOR_SECONDS", "60"))
+SCOREBOARD_FAILURES_TO_OPEN = int(os.environ.get("SCOREBOARD_FAILURES_TO_OPEN", "3"))
+SCOREBOARD_COOLDOWN = float(os.environ.get("SCOREBOARD_COOLDOWN", "300"))
+SCOREBOARD_MAX_COOLDOWN = float(os.environ.get("SCOREBOARD_MAX_COOLDOWN", "3600"))
+SCOREBOARD_NO_CHANNEL_WINDOW = float(os.environ.get("SCOREBOARD_NO_CHANNEL_WINDOW", "3600"))
+SCOREBOARD_SAVE_INTERVAL = float(os.environ.get("SCOREBOARD_SAVE_INTERVAL", "30"))
+
+_MIN_SUCCESS_RATE = 0.05
+
+
+def _ewma(old: Optional[float], value: float, alpha: float = SCOREBOARD_ALPHA) -> float:
+    return value if old is None else old + alpha * (value - old)
+
+
+class ModelScore:
+    FIELDS = ("attempts", "successes", "failures", "latency", "failure_latency", "success_rate",
+              "downgrade_rate", "consecutive_failures", "no_channel", "open_until", "cooldown", "last_used")
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.latency: Optional[float] = None
+        self.failure_latency: Optional[float] = None
+        self.success_rate: Optional[float] = None
+        self.downgrade_rate: Optional[float] = None
+        self.consecutive_failures = 0
+        self.no_channel: List[float] = []
+        self.open_until = 0.0
+        self.cooldown = SCOREBOARD_COOLDOWN
+        self.last_used = 0.0
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def expected_seconds(self) -> float:
+        """预计出图时间（含失败重试的期望开销）"""
+        if self.latency is None and self.failure_latency is None:
+            return SCOREBOARD_PRIOR_SECONDS
+        p = max(self.success_rate if self.success_rate is not None else 1.0, _MIN_SUCCESS_RATE)
+        ok = self.latency if self.latency is not None else SCOREBOARD_PRIOR_SECONDS
+        failed = self.failure_latency if self.failure_latency is not None else 0.0
+        return (p * ok + (1 - p) * failed) / p
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ModelScore":
+        score = cls()
+        for name in cls.FIELDS:
+            if name in data:
+                setattr(score, name, data[name])
+        return score
+
+
+class Scoreboard:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._scores: Dict[str, ModelScore] = {}
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    # ---- 持久化 ----
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._scores = {model: ModelScore.from_dict(d) for model, d in data.get("models", {}).items()}
+        except (OSError, ValueError) as e:
+            print(f"读取模型记分板失败，重新开始统计: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"saved_at": time.time(), "models": {m: s.to_dict() for m, s in self._scores.items()}}
+            self._dirty = False
+            self._last_save = time.time()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".scoreboard-", dir=os.path.dirname(self.path) or ".")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            os.remove(tmp_path)
+            print(f"保存模型记分板失败: {e}")
+
+    def _maybe_save(self):
+        if time.time() - self._last_save >= SCOREBOARD_SAVE_INTERVAL:
+            self.save()
+
+    # ---- 记录 ----
+
+    def record(self, model: str, ok: bool, latency: float, downgraded: bool = False,
+               no_channel: bool = False):
+        """记录一次尝试的结果"""
+        now = time.time()
+        with self._lock:
+            score = self._scores.setdefault(model, ModelScore())
+            score.attempts += 1
+            score.last_used = now
+            score.success_rate = _ewma(score.success_rate, 1.0 if ok else 0.0)
+            if ok:
+                score.successes += 1
+                score.latency = _ewma(score.latency, latency)
+                score.downgrade_rate = _ewma(score.downgrade_rate, 1.0 if downgraded else 0.0)
+                score.consecutive_failures = 0
+                score.open_until = 0.0
+                score.cooldown = SCOREBOARD_COOLDOWN
+            else:
+                score.failures += 1
+                score.failure_latency = _ewma(score.failure_latency, latency)
+                score.consecutive_failures += 1
+                score.no_channel = [t for t in score.no_channel if now - t < SCOREBOARD_NO_CHANNEL_WINDOW]
+                if no_channel:
+                    score.no_channel.append(now)
+                if no_channel or score.consecutive_failures >= SCOREBOARD_FAILURES_TO_OPEN:
+                    if score.open_until:
+                        # 冷却后的试探又失败了：冷却时间翻倍
+                        score.cooldown = min(score.cooldown * 2, SCOREBOARD_MAX_COOLDOWN)
+                    score.open_until = now + score.cooldown
+                    print(f"  [熔断] {model} 暂停 {score.cooldown:.0f} 秒")
+            self._dirty = True
+        self._maybe_save()
+
+    # ---- 排序 ----
+
+    def rank(self, models: List[str], pinned: int = 0) -> List[str]:
+        """
+        按预计出图时间重新排序，熔断中的模型不删除，按恢复时间先后排在最后（前面都失败时仍会试到）
+
+        前 pinned 个（用户指定的模型）保持原位
+        """
+        now = time.time()
+        with self._lock:
+            head, rest = models[:pinned], models[pinned:]
+            scores = {m: self._scores.get(m) for m in rest}
+            closed = [m for m in rest if not (scores[m] and scores[m].is_open(now))]
+            opened = [m for m in rest if scores[m] and scores[m].is_open(now)]
+            ordered = sorted(closed, key=lambda m: scores[m].expected_seconds() if scores[m]
+                             else SCOREBOARD_PRIOR_SECONDS)
+            ordered += sorted(opened, key=lambda m: scores[m].open_until)
+        return head + ordered
+
+    def snapshot(self) -> List[dict]:
+        now = time.time()
+        with self._lock:
+            rows = []
+            for model, score in self._scores.items():
+                row = score.to_dict()
+                row["model"] = model
+                row["no_channel"] = len([t for t in score.no_channel if now - t < SCOREBOARD_NO_CHANNEL_WINDOW])
+                row["expected_seconds"] = round(score.expected_seconds(), 2)
+                row["circuit"] = "open" if score.is_open(now) else ("half_open" if score.open_until else "closed")
+                rows.append(row)
+        rows.sort(key=lambda r: (r["circuit"] == "open", r["expected_seconds"]))
+        return rows
+
+
+def create_scoreboard(root: str) -> Scoreboard:
+    board = Scoreboard(os.path.join(os.path.abspath(root), SCOREBOARD_FILE))
+    atexit.register(board.save)
+    return board
@@ -1,5 +1,5 @@
 import { useState, useCallback, useEffect } from 'react';
-import { AlertCircle, Download, Sparkles, RotateCw, Settings, ExternalLink, X } from 'lucide-react';
+import { AlertCircle, Download, Sparkles, RotateCw, Settings, ExternalLink, X, ImagePlus } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Alert, AlertDescription, AlertTitle } from '@/components/ui/alert';
@@ -18,6 +18,8 @@ interface ImageItem {
   id: string;
   dataUrl: string;
   filename: string;
+  /** 服务端已有的图片（如 output:<文件名>），生成时直接引用，不再上传 */
+  reference?: string;
 }
 
 interface GenerationResult {
@@ -29,6 +31,101 @@ interface GenerationResult {
   modelUsed?: string;
 }
 
+/**
+ * 提交异步生成任务，并通过 SSE 等待结果（不再占用一个长连接请求等待生成）
+ * 批量任务（/api/batch）每完成一张会回调 onItem
+ */
+async function runGenerationJob(
+  requestBody: Record<string, unknown>,
+  endpoint: string = '/api/jobs',
+  onItem?: (index: number, result: any) => void,
+): Promise<any> {
+  const response = await fetch(`${API_BASE_URL}${endpoint}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(requestBody),
+  });
+
+  const created = await response.json();
+  if (!response.ok) {
+    return created;
+  }
+
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_BASE_URL}${created.events_url}`);
+    if (onItem) {
+      source.addEventListener('item', (event) => {
+        const item = JSON.parse((event as MessageEvent).data);
+        onItem(item.index, item.result);
+      });
+    }
+    source.addEventListener('completed', (event) => {
+      source.close();
+      resolve(JSON.parse((event as MessageEvent).data));
+    });
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        reject(new Error('任务进度连接已断开'));
+      }
+    };
+  });
+}
+
+/** 把一次生成的响应体转换成结果卡片 */
+function toGenerationResult(id: string, result: any): GenerationResult {
+  if (result.code !== 200) {
+    return { id, imageUrl: '', status: 'error', error: result.msg || result.detail || '生成失败' };
+  }
+
+  const filename = result.data?.filename;
+  let imageUrl = '';
+  if (filename) {
+    imageUrl = `${API_BASE_URL}/api/image/${encodeURIComponent(filename)}`;
+  } else if (result.data?.image) {
+    imageUrl = result.data.image;
+  }
+  return { id, imageUrl, filename, status: 'success', modelUsed: result.model_used };
+}
+
+/** 上游一次返回多张图时，第一张（data）之外的其余图片 */
+function extraGenerationResults(id: string, result: any): GenerationResult[] {
+  if (result.code !== 200 || !Array.isArray(result.images)) return [];
+  return result.images.slice(1).map((image: any, i: number) => ({
+    id: `${id}-${i + 1}`,
+    imageUrl: `${API_BASE_URL}/api/image/${encodeURIComponent(image.filename)}`,
+    filename: image.filename,
+    status: 'success' as const,
+    modelUsed: result.model_used,
+  }));
+}
+
+// 已上传参考图的句柄（按图片 dataUrl 缓存），同一组参考图反复生成时不再重复上传；
+// 缓存 Promise，并发生成多张时同一张图也只上传一次
+const uploadHandles = new Map<string, Promise<string>>();
+
+async function postReference(dataUrl: string): Promise<string> {
+  const blob = await (await fetch(dataUrl)).blob();
+  const form = new FormData();
+  form.append('file', blob);
+  const response = await fetch(`${API_BASE_URL}/api/uploads`, { method: 'POST', body: form });
+  const result = await response.json();
+  if (!response.ok) {
+    throw new Error(result.msg || '参考图上传失败');
+  }
+  return result.data.handle;
+}
+
+/** 上传参考图，返回可放进 images 数组的句柄 */
+function uploadReference(dataUrl: string): Promise<string> {
+  let handle = uploadHandles.get(dataUrl);
+  if (!handle) {
+    handle = postReference(dataUrl);
+    handle.catch(() => uploadHandles.delete(dataUrl));
+    uploadHandles.set(dataUrl, handle);
+  }
+  return handle;
+}
+
 function App() {
   const [apiKey, setApiKey] = useState<string>(() => {
     try {
@@ -116,62 +213,40 @@ function App() {
     setAutoMode(true);
   }, []);
 
-  const generateSingleImage = useCallback(async (index: number): Promise<GenerationResult> => {
-    const resultItem: GenerationResult = {
-      id: `result-${Date.now()}-${index}`,
-      imageUrl: '',
-      status: 'loading',
-    };
+  const buildRequestBody = useCallback(async () => ({
+    api_key: apiKey,
+    images: await Promise.all(uploadedImages.map(img => img.reference || uploadReference(img.dataUrl))),
+    prompt: prompt.trim(),
+    denoising,
+    seed,
+    model: autoMode ? '' : selectedModel,
+    auto: autoMode,
+    is_4k: is4KMode,
+    prompt_weight: promptWeight,
+  }), [apiKey, uploadedImages, prompt, denoising, seed, autoMode, selectedModel, is4KMode, promptWeight]);
+
+  /** 提交任务；参考图上传已过期被清理（410）时重新上传后再试一次 */
+  const submitWithReupload = useCallback(async (submit: () => Promise<any>): Promise<any> => {
+    const result = await submit();
+    if (result.code !== 410) return result;
+    uploadedImages.forEach(img => uploadHandles.delete(img.dataUrl));
+    return submit();
+  }, [uploadedImages]);
 
+  const generateSingleImage = useCallback(async (index: number): Promise<GenerationResult> => {
+    const id = `result-${Date.now()}-${index}`;
     try {
-      const base64Images = uploadedImages.map(img => img.dataUrl.replace(/^data:image\/(png|jpeg|jpg|webp);base64,/, ''));
-
-      const requestBody = {
-        api_key: apiKey,
-        images: base64Images,
-        prompt: prompt.trim(),
-        denoising,
-        seed,
-        model: autoMode ? '' : selectedModel,
-        auto: autoMode,
-        is_4k: is4KMode,
-        prompt_weight: promptWeight,
-      };
-
-      const response = await fetch(`${API_BASE_URL}/api/gen_image`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(requestBody),
-      });
-
-      const result = await response.json();
-
-      if (!response.ok || result.code !== 200) {
-        resultItem.status = 'error';
-        resultItem.error = result.msg || result.detail || '生成失败';
-        return resultItem;
-      }
-
-      const imageFilename = result.data?.filename;
-      let imageUrl = '';
-      if (imageFilename) {
-        imageUrl = `${API_BASE_URL}/api/image/${encodeURIComponent(imageFilename)}`;
-      } else if (result.data?.image) {
-        imageUrl = result.data.image;
-      }
-
-      resultItem.imageUrl = imageUrl;
-      resultItem.filename = imageFilename;
-      resultItem.status = 'success';
-      resultItem.modelUsed = result.model_used;
-
-      return resultItem;
+      const result = await submitWithReupload(async () => runGenerationJob(await buildRequestBody()));
+      return toGenerationResult(id, result);
     } catch (error) {
-      resultItem.status = 'error';
-      resultItem.error = error instanceof Error ? error.message : '网络请求失败';
-      return resultItem;
+      return {
+        id,
+        imageUrl: '',
+        status: 'error',
+        error: error instanceof Error ? error.message : '网络请求失败',
+      };
     }
-  }, [apiKey, uploadedImages, prompt, denoising, seed, autoMode, selectedModel]);
+  }, [buildRequestBody, submitWithReupload]);
 
   const handleGenerate = useCallback(async () => {
     if (uploadedImages.length === 0 || !prompt.trim()) return;
@@ -191,14 +266,33 @@ function App() {
     const newResults: GenerationResult[] = Array.from({ length: generationCount }, (_, i) => ({
       id: `result-${Date.now()}-${i}`,
       imageUrl: '',
-      status: 'pending' as const,
+      status: 'loading' as const,
     }));
 
     setGenerationResults(newResults);
 
     try {
-      const promises = Array.from({ length: generationCount }, (_, i) => generateSingleImage(i));
-      const results = await Promise.all(promises);
+      let results: GenerationResult[];
+      if (generationCount === 1) {
+        // 单张走 /api/jobs：按交互优先级调度，可以命中结果缓存
+        const result = await submitWithReupload(async () => runGenerationJob(await buildRequestBody()));
+        results = [toGenerationResult(newResults[0].id, result), ...extraGenerationResults(newResults[0].id, result)];
+      } else {
+        // 一个批量任务生成全部张数，参考图只传一次；每完成一张就先显示出来
+        const batch = await submitWithReupload(async () => runGenerationJob(
+          { ...(await buildRequestBody()), count: generationCount },
+          '/api/batch',
+          (index, itemResult) => {
+            setGenerationResults(prev => prev.map((r, i) => (i === index ? toGenerationResult(r.id, itemResult) : r)));
+          },
+        ));
+
+        results = newResults.flatMap((r, i) => (
+          batch.data?.[i]
+            ? [toGenerationResult(r.id, batch.data[i]), ...extraGenerationResults(r.id, batch.data[i])]
+            : [{ ...r, status: 'error' as const, error: batch.msg || '生成失败' }]
+        ));
+      }
 
       setGenerationResults(results);
 
@@ -208,7 +302,8 @@ function App() {
 
         const newHistoryItem: HistoryItem = {
           id: Date.now().toString(),
-          resultImages: successResults.map(r => r.imageUrl),
+          // 有文件名时只存文件名，画廊据此取缩略图
+          resultImages: successResults.map(r => r.filename || r.imageUrl),
           prompt: prompt.trim(),
           denoising,
           seed,
@@ -230,7 +325,7 @@ function App() {
     } finally {
       setIsGenerating(false);
     }
-  }, [apiKey, uploadedImages, prompt, denoising, seed, generationCount, generateSingleImage]);
+  }, [apiKey, uploadedImages, prompt, denoising, seed, generationCount, buildRequestBody, submitWithReupload]);
 
   const handleRetry = useCallback(async (index: number) => {
     const newResults = [...generationResults];
@@ -253,6 +348,20 @@ function App() {
     link.click();
   }, []);
 
+  // 把生成结果加入参考图，服务端直接按文件名读取，无需下载再上传
+  const handleUseAsReference = useCallback((result: GenerationResult) => {
+    if (!result.filename || uploadedImages.length >= 10) return;
+    setUploadedImages([
+      ...uploadedImages,
+      {
+        id: `ref-${Date.now()}`,
+        dataUrl: `${API_BASE_URL}/api/thumb/256/${encodeURIComponent(result.filename)}`,
+        filename: result.filename,
+        reference: `output:${result.filename}`,
+      },
+    ]);
+  }, [uploadedImages]);
+
   const handleOpenNewTab = useCallback((result: GenerationResult) => {
     if (!result.imageUrl) return;
     window.open(result.imageUrl, '_blank');
@@ -496,6 +605,19 @@ function App() {
                                   >
                                     <ExternalLink className="h-4 w-4" />
                                   </Button>
+                                  {result.filename && (
+                                    <Button
+                                      type="button"
+                                      variant="secondary"
+                                      size="icon"
+                                      className="h-8 w-8"
+                                      title="用作参考图"
+                                      disabled={isGenerating}
+                                      onClick={() => handleUseAsReference(result)}
+                                    >
+                                      <ImagePlus className="h-4 w-4" />
+                                    </Button>
+                                  )}
                                 </div>
                               </>
                             )}
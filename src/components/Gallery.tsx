@@ -19,15 +19,33 @@ interface GalleryProps {
   onClearHistory: () => void;
 }
 
+// 生成的图片写入后不再变化，服务端带 ETag / 长期缓存头，这里不要加时间戳破坏缓存
 function getImageUrl(urlOrFilename: string): string {
   if (!urlOrFilename) return '';
   
-  if (urlOrFilename.startsWith('http')) {
-    const separator = urlOrFilename.includes('?') ? '&' : '?';
-    return `${urlOrFilename}${separator}t=${Date.now()}`;
+  if (urlOrFilename.startsWith('http') || urlOrFilename.startsWith('data:')) {
+    return urlOrFilename;
   }
   
-  return `${API_BASE_URL}/api/image/${encodeURIComponent(urlOrFilename)}?t=${Date.now()}`;
+  return `${API_BASE_URL}/api/image/${encodeURIComponent(urlOrFilename)}`;
+}
+
+const IMAGE_PATH = '/api/image/';
+
+// 网格用缩略图，大图预览用 WebP 预览图；
+// 历史记录里可能是文件名，也可能是 .../api/image/<文件名> 的完整 URL，两者都换成 /api/thumb/<尺寸>/<文件名>，
+// 其他 URL / data URI 原样返回
+function getThumbUrl(urlOrFilename: string, variant: '128' | '256' | '512' | 'preview'): string {
+  if (!urlOrFilename || urlOrFilename.startsWith('data:')) {
+    return getImageUrl(urlOrFilename);
+  }
+  if (urlOrFilename.startsWith('http')) {
+    const i = urlOrFilename.indexOf(IMAGE_PATH);
+    if (i === -1) return urlOrFilename;
+    // 文件名部分已经过 encodeURIComponent
+    return `${urlOrFilename.slice(0, i)}/api/thumb/${variant}/${urlOrFilename.slice(i + IMAGE_PATH.length)}`;
+  }
+  return `${API_BASE_URL}/api/thumb/${variant}/${encodeURIComponent(urlOrFilename)}`;
 }
 
 export function Gallery({ history, onClearHistory }: GalleryProps) {
@@ -74,13 +92,21 @@ export function Gallery({ history, onClearHistory }: GalleryProps) {
     );
   }
 
-  const allResults: Array<{ item: HistoryItem; resultIdx: number; imageUrl: string }> = [];
+  const allResults: Array<{
+    item: HistoryItem;
+    resultIdx: number;
+    imageUrl: string;
+    thumbUrl: string;
+    previewUrl: string;
+  }> = [];
   history.forEach((item, groupIndex) => {
     item.resultImages.forEach((resultImg, resultIdx) => {
       allResults.push({
         item,
         resultIdx,
         imageUrl: getImageUrl(resultImg),
+        thumbUrl: getThumbUrl(resultImg, '512'),
+        previewUrl: getThumbUrl(resultImg, 'preview'),
       });
     });
   });
@@ -111,17 +137,19 @@ export function Gallery({ history, onClearHistory }: GalleryProps) {
           <div key={`${entry.item.id}-${entry.resultIdx}`} className="space-y-2">
             <div className="relative rounded-xl overflow-hidden bg-muted cursor-pointer group">
               <img
-                src={entry.imageUrl}
+                src={entry.thumbUrl}
                 alt={`生成结果 ${index + 1}`}
+                loading="lazy"
+                decoding="async"
                 className="w-full h-auto object-cover"
                 onError={(e) => {
-                  console.error('历史图片加载失败:', entry.imageUrl);
+                  console.error('历史图片加载失败:', entry.thumbUrl);
                   (e.target as HTMLImageElement).style.display = 'none';
                 }}
                 onLoad={(e) => {
                   (e.target as HTMLImageElement).style.display = 'block';
                 }}
-                onClick={() => setSelectedImage(entry.imageUrl)}
+                onClick={() => setSelectedImage(entry.previewUrl)}
               />
               <div className="absolute inset-0 bg-black/0 group-hover:bg-black/40 transition-colors flex items-center justify-center gap-2">
                 <Button
@@ -7,6 +7,8 @@ interface ImageItem {
   id: string;
   dataUrl: string;
   filename: string;
+  /** 服务端已有的图片（如 output:<文件名>），生成时直接引用，不再上传 */
+  reference?: string;
 }
 
 interface ImageGalleryUploaderProps {
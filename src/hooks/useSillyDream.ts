@@ -145,7 +145,7 @@ export function useSillyDream() {
 
   const fetchLatestImage = useCallback(async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/api/latest_image?t=${Date.now()}`, {
+      const response = await fetch(`${API_BASE_URL}/api/latest_image`, {
         cache: 'no-cache',
       });
       if (response.ok) {
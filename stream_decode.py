@@ -0,0 +1,173 @@
+"""
+流式解析上游响应 - 边读响应体边找 data URI，Base64 分块解码后直接写入文件
+
+上游成功响应约 1 MB，其中几乎全部是一段 Base64 图片。逐块处理后，
+单次生成的内存占用只和块大小有关，不再随响应体大小增长。
+一个响应里有多张图片时依次解码，每张写入各自的目标。
+"""
+import base64
+import binascii
+import hashlib
+import threading
+from typing import BinaryIO, Callable, Iterable, List, Optional, Tuple
+
+from extractor import (B64_ALPHABET, B64_MARKER, HEADER_MAX_LEN, MARKER, MARKER_MAX_LEN, PAYLOAD_END, find_payload_end,
+                       unescape_b64)
+
+CHUNK_SIZE = 64 * 1024
+
+_SEEK, _HEADER, _PAYLOAD, _DONE = range(4)
+
+
+class HashingSink:
+    """写入文件的同时计算 SHA-256，省掉落盘后再读一遍"""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.sha256.update(data)
+        return self.f.write(data)
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+class DataUriStreamDecoder:
+    """
+    增量解码器：feed() 逐块喂入响应体，其中的 data URI 图片依次解码
+
+    每遇到一张图片调用 open_sink(mime) 取得写入目标；解码完 max_images 张后不再继续
+    """
+
+    def __init__(self, open_sink: Callable[[str], BinaryIO], max_images: int = 1):
+        self.open_sink = open_sink
+        self.max_images = max_images
+        self.images: List[Tuple[str, int]] = []  # 已解码完的 (mime, 字节数)
+        self.sink: Optional[BinaryIO] = None
+        self.mime: Optional[str] = None
+        self.bytes_written = 0
+        self._state = _SEEK
+        self._buf = b""      # SEEK/HEADER 阶段跨块的未决数据
+        self._b64 = b""      # 不足 4 字符、尚未解码的 Base64 尾巴
+
+    @property
+    def done(self) -> bool:
+        return self._state == _DONE
+
+    def feed(self, chunk: bytes):
+        while chunk and self._state != _DONE:
+            if self._state == _SEEK:
+                data = self._buf + chunk
+                m = MARKER.search(data)
+                if m is None:
+                    # 保留可能被截断的标记前缀
+                    self._buf = data[-(MARKER_MAX_LEN - 1):]
+                    return
+                self._buf = b""
+                chunk = data[m.end():]
+                self._state = _HEADER
+
+            elif self._state == _HEADER:
+                data = self._buf + chunk
+                idx = data.find(B64_MARKER)
+                if idx < 0:
+                    if len(data) > HEADER_MAX_LEN:
+                        # 不是 Base64 data URI，继续找下一个
+                        self._buf = b""
+                        self._state = _SEEK
+                        chunk = data
+                        continue
+                    self._buf = data
+                    return
+                self.mime = "image/" + data[:idx].replace(b"\\", b"").decode("ascii", "replace")
+                self.sink = self.open_sink(self.mime)
+                self.bytes_written = 0
+                self._buf = b""
+                chunk = data[idx + len(B64_MARKER):]
+                self._state = _PAYLOAD
+
+            else:
+                end = find_payload_end(chunk)
+                try:
+                    self._write_b64(chunk if end is None else chunk[:end], validate=True)
+                except binascii.Error:
+                    # 少见：payload 中夹杂了结束符以外的非 Base64 字符，按逐字符规则重新切分
+                    m = PAYLOAD_END.search(chunk)
+                    end = m.start() if m else None
+                    self._write_b64(chunk if end is None else chunk[:end])
+                if end is None:
+                    return
+                self._finish()
+                chunk = chunk[end:]
+
+    def close(self):
+        """响应体读完后调用，写出最后不足 4 字符的部分"""
+        if self._state == _PAYLOAD:
+            self._finish()
+
+    def _write_b64(self, piece: bytes, validate: bool = False):
+        data = self._b64 + piece
+        if b"\\" in data:
+            data = unescape_b64(data)
+        # 末尾的反斜杠是被块边界截断的转义序列，留到下一块再处理
+        body_len = len(data) - 1 if data.endswith(b"\\") else len(data)
+        usable = body_len - body_len % 4
+        if validate and data[usable:body_len].translate(None, B64_ALPHABET):
+            # 留到下一块的尾巴也要校验，否则非法字符会混进下一次解码
+            raise binascii.Error("Only base64 data is allowed")
+        if usable:
+            decoded = base64.b64decode(data[:usable], validate=validate)
+            self.sink.write(decoded)
+            self.bytes_written += len(decoded)
+        self._b64 = data[usable:]
+
+    def _finish(self):
+        rest = self._b64.replace(b"\\", b"")
+        if rest:
+            rest += b"=" * (-len(rest) % 4)
+            decoded = base64.b64decode(rest)
+            self.sink.write(decoded)
+            self.bytes_written += len(decoded)
+        self._b64 = b""
+        self.images.append((self.mime, self.bytes_written))
+        self.sink = None
+        self._state = _DONE if len(self.images) >= self.max_images else _SEEK
+
+
+def decode_images_stream(chunks: Iterable[bytes], open_sink: Callable[[str], BinaryIO],
+                         cancel: Optional[threading.Event] = None,
+                         head_limit: int = 2048, max_images: int = 1):
+    """
+    从响应体块流中依次解码最多 max_images 张图片，每张写入 open_sink(mime) 返回的目标
+
+    返回 ([(mime, 写入字节数), ...], 响应体开头 head_limit 字节)，顺序与 open_sink 的调用顺序一致；
+    开头部分用于没有图片时的错误信息。cancel 被置位时提前停止读取并返回空列表。
+    """
+    decoder = DataUriStreamDecoder(open_sink, max_images)
+    head = b""
+    for chunk in chunks:
+        if cancel is not None and cancel.is_set():
+            return [], head
+        if len(head) < head_limit:
+            head += chunk[:head_limit - len(head)]
+        decoder.feed(chunk)
+        if decoder.done:
+            break
+    decoder.close()
+    return decoder.images, head
+
+
+def decode_image_stream(chunks: Iterable[bytes], sink: BinaryIO,
+                        cancel: Optional[threading.Event] = None,
+                        head_limit: int = 2048):
+    """
+    从响应体块流中解码第一张图片到 sink
+
+    返回 (mime 或 None, 写入字节数, 响应体开头 head_limit 字节)
+    """
+    images, head = decode_images_stream(chunks, lambda mime: sink, cancel, head_limit)
+    if not images or images[0][1] == 0:
+        return None, 0, head
+    return images[0][0], images[0][1], head
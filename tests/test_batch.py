@@ -0,0 +1,59 @@
+"""
+批量生成：同一 Key 的并发上限，排队中的张数不占线程、不挡其他 Key
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import BatchDispatcher, start_batch  # noqa: E402
+
+
+def test_per_key_cap_does_not_block_other_keys():
+    dispatcher = BatchDispatcher(max_per_key=1, workers=2)
+    release = threading.Event()
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def slow(prompt, emit):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        release.wait(5)
+        with lock:
+            running[0] -= 1
+        return {"prompt": prompt}, 200
+
+    slow_done = threading.Event()
+    # 同一 Key 连续提交多批，只有一张在执行，其余排队
+    for _ in range(5):
+        start_batch(["a", "b"], slow, "busy", lambda e, d: None, lambda r: slow_done.set(), dispatcher)
+
+    other = []
+    other_done = threading.Event()
+    start_batch(["x", "y", "z"], lambda p, emit: ({"prompt": p}, 200), "other", lambda e, d: None,
+                lambda r: (other.extend(r), other_done.set()), dispatcher)
+    assert other_done.wait(5)
+    assert [b["prompt"] for b, _ in other] == ["x", "y", "z"]
+
+    release.set()
+    assert slow_done.wait(5)
+    assert peak[0] == 1
+
+
+def test_item_events_and_failures():
+    dispatcher = BatchDispatcher(max_per_key=2, workers=2)
+    events, results, done = [], [], threading.Event()
+
+    def generate(prompt, emit):
+        emit("attempt", {"model": "m"})
+        if prompt == "bad":
+            raise RuntimeError("boom")
+        return {"prompt": prompt}, 200
+
+    start_batch(["ok", "bad"], generate, "k", lambda e, d: events.append((e, d)),
+                lambda r: (results.extend(r), done.set()), dispatcher)
+    assert done.wait(5)
+    assert results[0] == ({"prompt": "ok"}, 200)
+    assert results[1][1] == 500
+    assert {(e, d["index"]) for e, d in events} == {("attempt", 0), ("attempt", 1), ("item", 0), ("item", 1)}
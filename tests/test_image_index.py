@@ -0,0 +1,46 @@
+"""
+ImageIndex.page 的 since 增量轮询
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_index import ImageIndex  # noqa: E402
+
+
+def _add(index: ImageIndex, name: str, created_at: float):
+    index.add({"filename": name, "sha256": name, "ext": "png", "created_at": created_at})
+
+
+def test_since_polls_across_pages(tmp_path):
+    index = ImageIndex(str(tmp_path / "index.db"))
+    _add(index, "old.png", 100.0)
+    for i in range(5):
+        _add(index, f"new{i}.png", 200.0 + i)
+
+    seen, since, polls = [], 100.0, 0
+    while True:
+        rows, has_more = index.page(2, since=since)
+        polls += 1
+        # 页内仍按倒序
+        assert [r["created_at"] for r in rows] == sorted((r["created_at"] for r in rows), reverse=True)
+        seen += [r["filename"] for r in rows]
+        # 与 /api/images 的 latest 字段一致
+        since = max((r["created_at"] for r in rows), default=since)
+        if not has_more:
+            break
+
+    assert polls == 3
+    assert sorted(seen) == [f"new{i}.png" for i in range(5)]
+    assert index.page(2, since=since) == ([], False)
+
+
+def test_since_with_before_pages_backwards(tmp_path):
+    index = ImageIndex(str(tmp_path / "index.db"))
+    for i in range(4):
+        _add(index, f"img{i}.png", 100.0 + i)
+
+    rows, has_more = index.page(2, since=100.0, before=(103.0, "img3.png"))
+    assert [r["filename"] for r in rows] == ["img2.png", "img1.png"]
+    assert has_more is False
@@ -0,0 +1,98 @@
+"""
+ImageWriter：相同内容、相同文件名的并发写入；进程退出后留下的排队写入
+"""
+import os
+import subprocess
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_store import ImageStore  # noqa: E402
+from image_writer import ImageWriter  # noqa: E402
+
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63f8cf00000301010018dd8db00000000049454e44ae426082"
+)
+
+
+def _tmp_file(store: ImageStore, name: str) -> str:
+    path = os.path.join(store.root, name)
+    with open(path, "wb") as f:
+        f.write(PNG)
+    return path
+
+
+def test_same_filename_writes_do_not_collide(tmp_path):
+    store = ImageStore(str(tmp_path))
+    writer = ImageWriter(store, workers=2)
+    gate = threading.Event()
+    commit = store.commit
+
+    def slow_commit(*args, **kwargs):
+        gate.wait(5)
+        return commit(*args, **kwargs)
+
+    store.commit = slow_commit
+    (first, f1), (second, f2) = (writer.submit_file(_tmp_file(store, f".part-{i}"), "same") for i in range(2))
+    assert first["filename"] == second["filename"]
+    pending = os.listdir(os.path.join(store.root, ".pending"))
+    assert len(pending) == 2
+
+    gate.set()
+    records = [f1.result(5), f2.result(5)]
+    assert all(os.path.exists(r["path"]) for r in records)
+    assert len(os.listdir(os.path.dirname(records[0]["path"]))) == 1
+    assert store.wait_pending(first["filename"]) is False
+    assert store.resolve(first["filename"])["sha256"] == first["sha256"]
+    assert os.listdir(os.path.join(store.root, ".pending")) == []
+
+
+def test_commit_treats_missing_tmp_as_dedup(tmp_path):
+    store = ImageStore(str(tmp_path))
+    tmp = _tmp_file(store, ".part-a")
+    record = store.prepare_file(tmp, "x")
+    store.commit(tmp, record)
+    assert store.commit(os.path.join(store.root, ".part-gone"), record)["deduplicated"] is True
+
+
+def _dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_orphaned_pending_writes_are_recovered(tmp_path):
+    store = ImageStore(str(tmp_path))
+    record = store.prepare_file(_tmp_file(store, ".part-a"), "crashed")
+    dead = _dead_pid()
+    pending = os.path.join(store.root, ".pending")
+    os.makedirs(pending)
+    # 已改名进 .pending/ 的完整图片
+    with open(os.path.join(pending, f"{record['filename']}.abc123.{dead}"), "wb") as f:
+        f.write(PNG)
+    # 改名前就退出：空文件
+    open(os.path.join(pending, f"other_00000000.png.def456.{dead}"), "wb").close()
+    # 流式解码到一半的临时文件，以及仍在运行的进程的临时文件
+    open(os.path.join(store.root, f".part-{dead}-xyz"), "wb").close()
+    live = os.path.join(store.root, f".part-{os.getpid()}-xyz")
+    open(live, "wb").close()
+
+    restarted = ImageStore(str(tmp_path))
+    found = restarted.resolve(record["filename"])
+    assert found["sha256"] == record["sha256"] and os.path.exists(found["path"])
+    assert os.listdir(pending) == []
+    assert not os.path.exists(os.path.join(store.root, f".part-{dead}-xyz"))
+    assert os.path.exists(live)
+
+
+def test_wait_pending_commits_for_exited_worker(tmp_path):
+    store = ImageStore(str(tmp_path))
+    record = store.prepare_file(_tmp_file(store, ".part-a"), "crashed")
+    # 本进程已完成启动检查之后，另一个工作进程退出
+    pending = os.path.join(store.root, ".pending")
+    os.makedirs(pending)
+    with open(os.path.join(pending, f"{record['filename']}.abc123.{_dead_pid()}"), "wb") as f:
+        f.write(PNG)
+    assert store.resolve(record["filename"])["sha256"] == record["sha256"]
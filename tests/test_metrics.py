@@ -0,0 +1,48 @@
+"""
+metrics 多进程汇总：/metrics 落到任一工作进程都输出所有进程之和
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+REQUESTS = metrics.Counter("test_requests_total", "测试计数", ("code",))
+IN_FLIGHT = metrics.Gauge("test_in_flight", "测试 gauge")
+LATENCY = metrics.Histogram("test_latency_seconds", "测试直方图", buckets=(1, 10))
+
+
+def _other_worker(shared_dir, pid: int, requests: int, in_flight: int):
+    data = {"pid": pid, "metrics": [
+        {"name": "test_requests_total", "kind": "counter", "help": "测试计数", "labelnames": ["code"],
+         "buckets": [], "values": [[["200"], requests]]},
+        {"name": "test_in_flight", "kind": "gauge", "help": "测试 gauge", "labelnames": [],
+         "buckets": [], "values": [[[], in_flight]]},
+        {"name": "test_latency_seconds", "kind": "histogram", "help": "测试直方图", "labelnames": [],
+         "buckets": [1, 10], "values": [[[], [1, 0, 0.5, 1]]]},
+    ]}
+    with open(os.path.join(shared_dir, f"{pid}.json"), "w") as f:
+        json.dump(data, f)
+
+
+def test_shared_render_sums_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "SHARED_DIR", str(tmp_path))
+    REQUESTS.inc("200", amount=3)
+    IN_FLIGHT.set(value=2)
+    LATENCY.observe(5)
+    _other_worker(str(tmp_path), 1, requests=4, in_flight=1)
+    _other_worker(str(tmp_path), 2, requests=10, in_flight=7)
+    metrics.mark_process_dead(2)
+
+    lines = metrics.render().splitlines()
+    # 已退出进程的计数保留，gauge 丢弃
+    assert 'test_requests_total{code="200"} 17' in lines
+    assert "test_in_flight 3" in lines
+    assert 'test_latency_seconds_bucket{le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="10"} 3' in lines
+    assert "test_latency_seconds_count 3" in lines
+    assert lines.count("# TYPE test_requests_total counter") == 1
+    assert not os.path.exists(tmp_path / "2.json")
+    assert os.path.exists(tmp_path / f"{os.getpid()}.json")
@@ -0,0 +1,24 @@
+"""
+ModelListCache.label：只有上游列出过的模型 id 才能作为指标标签、记分板键
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_cache import OTHER_MODEL, ModelListCache  # noqa: E402
+
+
+def test_label_maps_unknown_models_to_other():
+    cache = ModelListCache()
+    assert cache.label("gemini-image") == OTHER_MODEL
+
+    cache.get("sk-a", lambda key: [{"id": "gemini-image"}, {"id": "flux-image"}])
+    assert cache.label("gemini-image") == "gemini-image"
+    assert cache.label("flux-image") == "flux-image"
+    assert cache.label("whatever-the-client-sent") == OTHER_MODEL
+    assert cache.label(None) == OTHER_MODEL
+
+    # 失效后已发现的 id 仍然有效
+    cache.invalidate("sk-a")
+    assert cache.label("gemini-image") == "gemini-image"
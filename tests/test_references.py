@@ -0,0 +1,62 @@
+"""
+references._shrink：原图可以原样发送时也要去掉 EXIF / 文本块等元数据
+"""
+import io
+import os
+import sys
+
+from PIL import Image, PngImagePlugin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from references import _shrink  # noqa: E402
+
+
+def _noise(size, mode="RGB"):
+    # 噪点图：重新以高质量编码一定比低质量原图大，走保留原图的路径
+    return Image.frombytes(mode, size, os.urandom(size[0] * size[1] * len(mode)))
+
+
+def _jpeg_with_exif(orientation=1):
+    exif = Image.Exif()
+    exif[0x010F] = "TestCam"  # Make
+    exif[0x0112] = orientation
+    out = io.BytesIO()
+    _noise((128, 64)).save(out, "JPEG", quality=20, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def test_jpeg_kept_without_exif():
+    data = _jpeg_with_exif()
+    result = _shrink(data, 4096, "JPEG", 95)
+    assert b"Exif" not in result and b"TestCam" not in result
+    # 去掉的只有 APP1 段，压缩数据原样保留
+    assert len(data) - len(result) > 0 and result.endswith(data[-64:])
+    with Image.open(io.BytesIO(result)) as img, Image.open(io.BytesIO(data)) as src:
+        assert img.tobytes() == src.tobytes()
+
+
+def test_jpeg_without_metadata_sent_as_is():
+    out = io.BytesIO()
+    _noise((128, 64)).save(out, "JPEG", quality=20)
+    assert _shrink(out.getvalue(), 4096, "JPEG", 95) is None
+
+
+def test_rotated_jpeg_reencoded():
+    data = _jpeg_with_exif(orientation=6)
+    result = _shrink(data, 4096, "JPEG", 95)
+    with Image.open(io.BytesIO(result)) as img:
+        assert img.size == (64, 128)
+        assert 0x0112 not in img.getexif()
+
+
+def test_png_text_chunks_dropped():
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Comment", "secret location")
+    out = io.BytesIO()
+    src = _noise((8, 8), "RGBA")
+    src.save(out, "PNG", pnginfo=info)
+    result = _shrink(out.getvalue(), 4096, "PNG", 95)
+    assert b"secret location" not in result
+    with Image.open(io.BytesIO(result)) as img:
+        assert img.format == "PNG" and img.tobytes() == src.tobytes()
@@ -0,0 +1,83 @@
+"""
+FairScheduler：交互请求先于批量任务；同一优先级内按 Key 轮转；排队超时返回 False
+"""
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import BATCH, INTERACTIVE, FairScheduler  # noqa: E402
+
+
+def _enqueue(sched, key, label, granted, priority=INTERACTIVE):
+    """在后台线程排队，确认已进入队列后返回；拿到名额时把 (label, key) 放进 granted"""
+    queued = threading.Event()
+
+    def on_wait(event, data):
+        if event == "queued":
+            queued.set()
+
+    def run():
+        if sched.acquire(key, priority, on_wait=on_wait):
+            granted.put((label, key))
+
+    threading.Thread(target=run, daemon=True).start()
+    assert queued.wait(2)
+
+
+def _drain(sched, holder, granted, n):
+    """释放占着名额的请求，之后每拿到一个名额就记下并释放，返回放行顺序"""
+    order = []
+    sched.release(holder)
+    for _ in range(n):
+        label, key = granted.get(timeout=2)
+        order.append(label)
+        sched.release(key)
+    return order
+
+
+def test_interactive_before_batch():
+    sched = FairScheduler(capacity=1, max_per_key=4)
+    granted = queue.Queue()
+    assert sched.acquire("holder")
+    _enqueue(sched, "a", "batch-1", granted, BATCH)
+    _enqueue(sched, "a", "batch-2", granted, BATCH)
+    _enqueue(sched, "b", "interactive", granted, INTERACTIVE)
+    assert _drain(sched, "holder", granted, 3) == ["interactive", "batch-1", "batch-2"]
+
+
+def test_round_robin_between_keys():
+    sched = FairScheduler(capacity=1, max_per_key=4)
+    granted = queue.Queue()
+    assert sched.acquire("a")
+    for label in ("a1", "a2", "a3"):
+        _enqueue(sched, "a", label, granted)
+    for label in ("b1", "b2"):
+        _enqueue(sched, "b", label, granted)
+    # a 刚被服务过，先轮到 b；之后两个 Key 交替，同一 Key 内先来先服务
+    assert _drain(sched, "a", granted, 5) == ["b1", "a1", "b2", "a2", "a3"]
+
+
+def test_per_key_cap_leaves_room_for_other_keys():
+    sched = FairScheduler(capacity=4, max_per_key=2)
+    assert sched.acquire("a") and sched.acquire("a")
+    assert not sched.acquire("a", blocking=False)
+    assert sched.acquire("b", blocking=False)
+    assert sched.stats()["queued"] == 0
+
+
+def test_wait_times_out():
+    sched = FairScheduler(capacity=1, max_wait=0.2)
+    assert sched.acquire("a")
+    started = time.time()
+    assert not sched.acquire("b")
+    assert 0.2 <= time.time() - started < 2
+    stats = sched.stats()
+    assert stats["queued"] == 0
+    assert stats["waits"]["interactive"]["timeouts"] == 1
+    # 超时的请求已离开队列，名额释放后直接给新请求
+    sched.release("a")
+    assert sched.acquire("b", blocking=False)
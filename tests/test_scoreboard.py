@@ -0,0 +1,22 @@
+"""
+Scoreboard.rank：熔断中的模型排到最后而不是被移出候选列表
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scoreboard import Scoreboard  # noqa: E402
+
+
+def test_open_circuit_models_move_to_end():
+    board = Scoreboard()
+    board.record("a", ok=False, latency=1.0, no_channel=True)
+    board.record("b", ok=True, latency=5.0)
+    board.record("c", ok=True, latency=2.0)
+
+    assert board.rank(["a", "b", "c"]) == ["c", "b", "a"]
+    # 唯一的候选熔断时仍然保留
+    assert board.rank(["a"]) == ["a"]
+    # 用户指定的模型保持在最前
+    assert board.rank(["a", "b", "c"], pinned=1) == ["a", "c", "b"]
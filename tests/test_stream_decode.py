@@ -0,0 +1,95 @@
+"""
+stream_decode：任意块边界下的流式解码结果都要和 extractor.iter_data_uris 一致
+"""
+import base64
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from extractor import iter_data_uris  # noqa: E402
+from stream_decode import DataUriStreamDecoder  # noqa: E402
+
+FIXTURES = [os.path.join(ROOT, "raw_response.txt"), os.path.join(ROOT, "response_raw.txt")]
+CHUNK_SIZES = [1, 3, 7]
+# 真实响应约 1 MB，逐字节喂完太慢：开头和结尾按小块喂（标记、头部、结束符都在这里），中间整段
+EDGE = 32 * 1024
+
+
+def _chunks(body: bytes, size: int, edge: int = 0):
+    head_end = edge or len(body)
+    tail_start = max(head_end, len(body) - edge) if edge else len(body)
+    for i in range(0, head_end, size):
+        yield body[i:min(i + size, head_end)]
+    if tail_start > head_end:
+        yield body[head_end:tail_start]
+    for i in range(tail_start, len(body), size):
+        yield body[i:i + size]
+
+
+def _stream(chunks, max_images=8):
+    sinks = []
+
+    def open_sink(mime):
+        sinks.append(io.BytesIO())
+        return sinks[-1]
+
+    decoder = DataUriStreamDecoder(open_sink, max_images)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    decoder.close()
+    return [(mime, sink.getvalue()) for (mime, _), sink in zip(decoder.images, sinks)]
+
+
+def _expected(body: bytes):
+    return [(uri.mime, uri.decode()) for uri in iter_data_uris(body)]
+
+
+def _escaped_json(*images: bytes) -> bytes:
+    # 模拟 JSON 编码器把 '/' 转义成 '\/'
+    parts = [f'"data:image/png;base64,{base64.b64encode(img).decode()}"'.replace("/", "\\/") for img in images]
+    return ('{"content":[' + ",".join(parts) + "]}").encode()
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+@pytest.mark.parametrize("path", FIXTURES)
+def test_fixtures_match_extractor(path, size):
+    with open(path, "rb") as f:
+        body = f.read()
+    expected = _expected(body)
+    assert expected
+    assert _stream(_chunks(body, size, EDGE)) == expected
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_escaped_slashes(size):
+    image = bytes(range(256)) * 3  # Base64 里必然有 '/'
+    body = _escaped_json(image)
+    assert b"\\/" in body.split(b"base64,")[1]
+    assert _stream(_chunks(body, size)) == _expected(body) == [("image/png", image)]
+
+
+def test_backslash_split_at_chunk_boundary():
+    image = bytes(range(256)) * 3
+    body = _escaped_json(image)
+    payload_start = body.index(b"base64,") + len(b"base64,")
+    # 每个 '\/' 都在反斜杠之后切一刀
+    cuts = [i + 1 for i in range(payload_start, len(body)) if body[i:i + 1] == b"\\"]
+    assert cuts
+    pieces = [body[a:b] for a, b in zip([0] + cuts, cuts + [len(body)])]
+    assert _stream(pieces) == [("image/png", image)]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_multiple_images(size):
+    images = [os.urandom(100), os.urandom(301), bytes(range(256))]
+    body = _escaped_json(*images[:2]) + b" ![image](data:image/jpeg;base64," + base64.b64encode(images[2]) + b")"
+    expected = _expected(body)
+    assert [data for _, data in expected] == images
+    assert _stream(_chunks(body, size)) == expected
+    # max_images 之后的图片不再解码
+    assert _stream(_chunks(body, size), max_images=2) == expected[:2]
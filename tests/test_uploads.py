@@ -0,0 +1,30 @@
+"""
+UploadStore：超过 TTL 未使用的上传即使还没被清理也不能再读取
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from uploads import UploadStore  # noqa: E402
+
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63f8cf00000301010018dd8db00000000049454e44ae426082"
+)
+
+
+def test_read_expires_after_ttl(tmp_path):
+    store = UploadStore(str(tmp_path), ttl=60)
+    info = store.put(PNG)
+    assert store.read(info["handle"]) == PNG
+
+    path = store._path(info["sha256"])
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert store.read(info["handle"]) is None
+
+    # 重新上传相同内容后恢复可用
+    store.put(PNG)
+    assert store.read(info["handle"]) == PNG
@@ -0,0 +1,128 @@
+"""
+缩略图 / 预览图 - 为每张生成图片派生小尺寸版本，供图库网格使用
+
+- 多个缩略图尺寸（JPEG）+ 一个 WebP 预览图
+- 在后台进程池中生成（缩放是 CPU 密集型；gevent 工作进程中为线程池，见 cpu_pool），新图保存后立即排队
+- 旧图首次被请求时按需生成；结果缓存在磁盘上，按内容哈希命名
+- 依赖 Pillow；未安装时 available() 返回 False，调用方回退到原图
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import Executor, Future
+from typing import Dict, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 是可选依赖
+    Image = None
+
+from cpu_pool import create_executor
+
+DERIVED_DIR = "derived"
+THUMB_WORKERS = int(os.environ.get("THUMB_WORKERS", str(min(4, os.cpu_count() or 1))))
+THUMB_WAIT_TIMEOUT = float(os.environ.get("THUMB_WAIT_TIMEOUT", "30"))
+
+# 变体名 → (最长边, 格式, 质量)
+VARIANTS = {
+    "128": (128, "JPEG", 80),
+    "256": (256, "JPEG", 80),
+    "512": (512, "JPEG", 82),
+    "preview": (1024, "WEBP", 80),
+}
+_EXT = {"JPEG": "jpg", "WEBP": "webp"}
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def variant_mime(variant: str) -> str:
+    return _MIME[VARIANTS[variant][1]]
+
+
+def _render(src: str, targets: Dict[str, str]):
+    """在子进程中执行：解码一次原图，依次输出各个变体（从大到小缩放）"""
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        for variant in sorted(targets, key=lambda v: -VARIANTS[v][0]):
+            edge, fmt, quality = VARIANTS[variant]
+            img.thumbnail((edge, edge), Image.LANCZOS)
+            dst = targets[variant]
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            tmp = f"{dst}.{os.getpid()}.tmp"
+            img.save(tmp, fmt, quality=quality, optimize=fmt == "JPEG")
+            os.replace(tmp, dst)
+
+
+class Thumbnailer:
+    def __init__(self, root: str, workers: int = THUMB_WORKERS):
+        self.root = os.path.abspath(root)
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pool: Optional[Executor] = None
+        self._pending: Dict[str, Future] = {}
+
+    def _executor(self) -> Executor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = create_executor(self.workers)
+            return self._pool
+
+    def _key(self, record: dict) -> str:
+        # 旧版文件没有内容哈希，用文件名代替
+        return record["sha256"] or hashlib.sha256(record["filename"].encode("utf-8")).hexdigest()
+
+    def path_for(self, record: dict, variant: str) -> str:
+        key = self._key(record)
+        ext = _EXT[VARIANTS[variant][1]]
+        return os.path.join(self.root, DERIVED_DIR, key[:2], f"{key}_{variant}.{ext}")
+
+    def schedule(self, record: dict) -> Optional[Future]:
+        """为一张图片排队生成所有缺失的变体（同一张图不会重复排队）"""
+        if not available():
+            return None
+        key = self._key(record)
+        targets = {v: self.path_for(record, v) for v in VARIANTS}
+        targets = {v: p for v, p in targets.items() if not os.path.exists(p)}
+        if not targets:
+            return None
+
+        executor = self._executor()
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = executor.submit(_render, record["path"], targets)
+            self._pending[key] = future
+
+        def done(f: Future):
+            with self._lock:
+                self._pending.pop(key, None)
+            if not f.cancelled() and f.exception() is not None:
+                print(f"  ⚠️ 缩略图生成失败 {record['filename']}: {f.exception()}")
+
+        future.add_done_callback(done)
+        return future
+
+    def get(self, record: dict, variant: str) -> Optional[str]:
+        """返回变体文件路径；不存在时按需生成并等待，失败返回 None"""
+        path = self.path_for(record, variant)
+        if os.path.exists(path):
+            return path
+        future = self.schedule(record)
+        if future is not None:
+            try:
+                future.result(timeout=THUMB_WAIT_TIMEOUT)
+            except Exception:
+                return None
+        return path if os.path.exists(path) else None
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
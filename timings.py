@@ -0,0 +1,104 @@
+"""
+分阶段计时 - 记录一次生成的时间花在了哪里
+
+- 请求级阶段：parse（解析请求、解码参考图）、cache（查结果缓存）、discovery（获取模型列表）、
+  queue（等待上游名额）、save（收入存储）
+- 模型回退链中的每次尝试单独记录：payload（参考图预处理、组装请求）、upstream（等到上游响应头）、
+  stream_decode（读取并解码响应体）、downgrade_upstream / downgrade_stream_decode（4K 降级重试）
+- 结果以 Server-Timing 响应头和响应体的 timings 字段返回，并按请求写一行 JSON 日志：
+  TIMING_LOG 指定文件时追加到文件（JSON Lines），否则打印到标准输出
+- 各阶段耗时同时计入 imagegen_stage_seconds 直方图
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from metrics import Histogram
+
+TIMING_LOG = os.environ.get("TIMING_LOG", "")
+
+STAGE_SECONDS = Histogram("imagegen_stage_seconds", "生成各阶段耗时", ("stage",))
+
+_log_lock = threading.Lock()
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+class Timings:
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+        self.ok: Optional[bool] = None
+        self._started = time.perf_counter()
+        self._finished: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stages: Dict[str, float] = {}
+        self._attempts: List["Timings"] = []
+
+    def add(self, stage: str, seconds: float):
+        """累加一个阶段的耗时（同名阶段多次出现时相加，例如多次排队）"""
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage)
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def attempt(self, model: str) -> "Timings":
+        """开始记录一次模型尝试；竞速模式下多个尝试可以并行记录"""
+        child = Timings(model)
+        with self._lock:
+            self._attempts.append(child)
+        return child
+
+    def finish(self, ok: Optional[bool] = None):
+        self._finished = time.perf_counter()
+        self.ok = ok
+
+    def total(self) -> float:
+        return (self._finished or time.perf_counter()) - self._started
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = dict(self._stages)
+            attempts = list(self._attempts)
+        result = {"total_ms": _ms(self.total()), "stages": {name: _ms(s) for name, s in stages.items()}}
+        if self.model is not None:
+            result = dict(model=self.model, ok=self.ok, **result)
+        if attempts:
+            result["attempts"] = [a.to_dict() for a in attempts]
+        return result
+
+    def server_timing(self) -> str:
+        """Server-Timing 头：请求级阶段、每次尝试（a1、a2 …）及其各阶段、总耗时"""
+        timings = self.to_dict()
+        entries = [f"{name};dur={ms}" for name, ms in timings["stages"].items()]
+        for i, attempt in enumerate(timings.get("attempts", []), 1):
+            desc = attempt["model"].replace('"', "")
+            entries.append(f'a{i};dur={attempt["total_ms"]};desc="{desc}"')
+            entries.extend(f"a{i}-{name};dur={ms}" for name, ms in attempt["stages"].items())
+        entries.append(f"total;dur={timings['total_ms']}")
+        return ", ".join(entries)
+
+
+def log_request(record: dict):
+    """写一行结构化计时日志"""
+    line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    if not TIMING_LOG:
+        print(f"[timing] {line}")
+        return
+    with _log_lock:
+        try:
+            with open(TIMING_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"写入计时日志失败: {e}")
@@ -0,0 +1,100 @@
+"""
+参考图上传 - 上传一次，之后的生成请求只传句柄
+
+- 按内容哈希存放：uploads/ab/<sha256>，同一张图重复上传只存一份
+- 句柄形如 "upload:<sha256>"，可直接放进生成请求的 images 数组
+- 每次上传或使用都会刷新文件时间；超过 UPLOAD_TTL 秒未被使用的上传会被清理
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from image_meta import detect_format
+
+UPLOAD_DIR = "uploads"
+UPLOAD_TTL = float(os.environ.get("UPLOAD_TTL", str(24 * 3600)))
+UPLOAD_SWEEP_INTERVAL = float(os.environ.get("UPLOAD_SWEEP_INTERVAL", "600"))
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(30 * 1024 * 1024)))
+HANDLE_PREFIX = "upload:"
+
+
+class UploadStore:
+    def __init__(self, root: str, ttl: float = UPLOAD_TTL):
+        self.root = os.path.join(os.path.abspath(root), UPLOAD_DIR)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def is_handle(value: str) -> bool:
+        return value.startswith(HANDLE_PREFIX)
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def put(self, data: bytes) -> dict:
+        """保存上传的图片，返回 {"handle", "sha256", "bytes", "mime"}；不是图片时抛出 ValueError"""
+        fmt = detect_format(data[:16])
+        if fmt is None:
+            raise ValueError("不支持的图片格式")
+        self._sweep()
+
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self._path(sha256)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".part-", dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        return {"handle": HANDLE_PREFIX + sha256, "sha256": sha256, "bytes": len(data), "mime": fmt[1]}
+
+    def read(self, handle: str) -> Optional[bytes]:
+        """按句柄读取图片并刷新使用时间，不存在或已过期返回 None"""
+        sha256 = handle[len(HANDLE_PREFIX):]
+        if len(sha256) != 64 or not all(c in "0123456789abcdef" for c in sha256):
+            return None
+        path = self._path(sha256)
+        try:
+            # 清理只是定期扫描，过期但还没被删掉的文件同样视为不存在（重新上传会刷新时间）
+            if os.stat(path).st_mtime < time.time() - self.ttl:
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _sweep(self):
+        """删除超过 TTL 未被使用的上传（最多每 UPLOAD_SWEEP_INTERVAL 秒扫描一次）"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < UPLOAD_SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        if not os.path.isdir(self.root):
+            return
+        cutoff = now - self.ttl
+        removed = 0
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            print(f"清理过期上传: {removed} 个")
@@ -0,0 +1,74 @@
+"""
+上游 HTTP 客户端 - 所有对 API_BASE 的调用共用一个带连接池的 Session
+"""
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 连接池：每个上游主机一个池，池内保持 keep-alive 连接，模型切换/降级重试时直接复用
+POOL_CONNECTIONS = int(os.environ.get("UPSTREAM_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.environ.get("UPSTREAM_POOL_MAXSIZE", "32"))
+
+# 连接超时与读取超时分开：连接不上要尽快失败，生成本身允许慢
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "600"))
+MODELS_READ_TIMEOUT = float(os.environ.get("UPSTREAM_MODELS_READ_TIMEOUT", "10"))
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """获取共享 Session（懒加载，线程安全）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # 不做自动重试：POST 生成请求不是幂等的，失败交给上层的模型切换逻辑
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    max_retries=0,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def auth_headers(api_key: str) -> dict:
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+def get(url: str, api_key: str, read_timeout: float = MODELS_READ_TIMEOUT, **kwargs) -> requests.Response:
+    """GET 上游接口"""
+    return get_session().get(
+        url,
+        headers=auth_headers(api_key),
+        timeout=(CONNECT_TIMEOUT, read_timeout),
+        **kwargs
+    )
+
+
+def post(url: str, api_key: str, payload: dict, read_timeout: float = READ_TIMEOUT, **kwargs) -> requests.Response:
+    """POST JSON 到上游接口"""
+    return get_session().post(
+        url,
+        json=payload,
+        headers=auth_headers(api_key),
+        timeout=(CONNECT_TIMEOUT, read_timeout),
+        **kwargs
+    )
+
+
+def close():
+    """关闭共享 Session，释放池中的连接"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None